@@ -1,13 +1,30 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from sqlalchemy import event
 from config import Config
+from app.replica import SesionEnrutada
 
-db = SQLAlchemy()
+# Las consultas de los reportes pueden ir a una réplica (ver app/replica.py)
+db = SQLAlchemy(session_options={'class_': SesionEnrutada})
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'info'
 
+def _configurar_sqlite(engine):
+    """
+    SQLite en archivo (pruebas de carga): transacciones explícitas para que los
+    SAVEPOINT funcionen con pysqlite, y BEGIN IMMEDIATE para que las escrituras
+    concurrentes esperen su turno en lugar de fallar con "database is locked".
+    """
+    @event.listens_for(engine, 'connect')
+    def _sin_transaccion_implicita(conexion, registro):
+        conexion.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def _begin_immediate(conexion):
+        conexion.exec_driver_sql('BEGIN IMMEDIATE')
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
@@ -15,6 +32,10 @@ def create_app(config_class=Config):
     db.init_app(app)
     login_manager.init_app(app)
 
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite' and db.engine.url.database not in (None, '', ':memory:'):
+            _configurar_sqlite(db.engine)
+
     # Registro de blueprints
     from app.routes.auth import auth_bp
     from app.routes.productos import productos_bp
@@ -28,6 +49,14 @@ def create_app(config_class=Config):
     app.register_blueprint(main_bp)
     app.register_blueprint(reportes_bp, url_prefix='/reportes')
 
+    # Funciones disponibles en las plantillas
+    from app.imagenes import srcset_imagen
+    app.add_template_global(srcset_imagen)
+
+    # Los archivos del almacén por contenido se sirven como inmutables
+    from app.almacen import cabeceras_inmutables
+    app.after_request(cabeceras_inmutables)
+
     # Crear tablas en la base de datos
     with app.app_context():
         db.create_all()
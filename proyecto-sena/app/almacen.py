@@ -0,0 +1,169 @@
+"""
+Almacén de imágenes direccionado por contenido.
+
+Cada archivo se guarda una sola vez en `static/uploads/cas/<xx>/<sha256>.<ext>`:
+el hash se calcula mientras se copia el stream a disco, sin cargar el archivo
+entero en memoria. La tabla `archivos_subidos` lleva la cuenta de cuántos
+productos usan cada archivo y solo se borra del disco cuando nadie lo usa.
+Como la URL depende del contenido, estos archivos se sirven como inmutables.
+"""
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+from datetime import datetime
+from flask import request
+from sqlalchemy import delete
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.utils import secure_filename
+from app import db, imagenes
+from app.models import ArchivoSubido, Producto
+
+CARPETA_CAS = 'cas'
+TAMANO_BLOQUE = 64 * 1024
+MAX_AGE_INMUTABLE = 365 * 24 * 3600
+
+# Subida pendiente: nombre en el almacén y temporal que se mueve tras el commit
+Subida = namedtuple('Subida', 'nombre temporal')
+
+
+def _ruta(nombre):
+    return os.path.join(imagenes.carpeta_uploads(), nombre)
+
+
+def _sentencia_referencia(valores):
+    """INSERT del archivo que, si el digest ya existe, solo suma una referencia"""
+    tabla = ArchivoSubido.__table__
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto == 'mysql':
+        sentencia = mysql_insert(tabla).values(**valores)
+        return sentencia.on_duplicate_key_update(referencias=tabla.c.referencias + 1)
+    if dialecto == 'sqlite':
+        sentencia = sqlite_insert(tabla).values(**valores)
+        return sentencia.on_conflict_do_update(index_elements=['digest'],
+                                               set_={'referencias': tabla.c.referencias + 1})
+    raise RuntimeError(f'Almacén no soportado para {dialecto}')
+
+
+def guardar_subida(archivo):
+    """
+    Copia un FileStorage a un temporal y suma una referencia a su contenido (sin
+    commit). El archivo no entra en el almacén hasta `confirmar_subida`, que se
+    llama tras el commit; `descartar_subida` borra el temporal si no se llegó a
+    confirmar. Devuelve una Subida(nombre, temporal).
+    """
+    extension = os.path.splitext(secure_filename(archivo.filename))[1].lower()
+    carpeta = imagenes.carpeta_uploads()
+    os.makedirs(carpeta, exist_ok=True)
+
+    sha = hashlib.sha256()
+    tamano = 0
+    descriptor, temporal = tempfile.mkstemp(dir=carpeta, suffix='.subida')
+    try:
+        with os.fdopen(descriptor, 'wb') as destino:
+            while True:
+                bloque = archivo.stream.read(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                sha.update(bloque)
+                destino.write(bloque)
+                tamano += len(bloque)
+        digest = sha.hexdigest()
+
+        # Un solo INSERT: dos subidas simultáneas del mismo contenido no chocan con el índice único
+        db.session.execute(_sentencia_referencia({
+            'digest': digest,
+            'nombre': f'{CARPETA_CAS}/{digest[:2]}/{digest}{extension}',
+            'tamano': tamano,
+            'referencias': 1,
+            'creado_en': datetime.utcnow()
+        }))
+        nombre = db.session.query(ArchivoSubido.nombre).filter_by(digest=digest).scalar()
+    except Exception:
+        os.remove(temporal)
+        raise
+    return Subida(nombre, temporal)
+
+
+def confirmar_subida(subida):
+    """
+    Tras el commit: mueve el temporal al almacén si el contenido no estaba ya en
+    disco y programa sus derivados. Devuelve True si el archivo es nuevo.
+    """
+    if subida is None:
+        return False
+    ruta = _ruta(subida.nombre)
+    nuevo = not os.path.exists(ruta)
+    if nuevo:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        os.replace(subida.temporal, ruta)
+        imagenes.programar_derivados(subida.nombre)
+    descartar_subida(subida)
+    return nuevo
+
+
+def descartar_subida(subida):
+    """Borra el temporal de una subida que no se confirmó (p. ej. si falló el commit)"""
+    if subida is not None and os.path.exists(subida.temporal):
+        os.remove(subida.temporal)
+
+
+def liberar(nombre):
+    """Resta una referencia al archivo (sin commit). Llamar a `eliminar_si_huerfano` tras el commit."""
+    if not nombre:
+        return
+    ArchivoSubido.query.filter(
+        ArchivoSubido.nombre == nombre,
+        ArchivoSubido.referencias > 0
+    ).update({ArchivoSubido.referencias: ArchivoSubido.referencias - 1}, synchronize_session=False)
+
+
+def eliminar_si_huerfano(nombre):
+    """
+    Borra del disco el archivo (y sus derivados) si ya ningún producto lo usa.
+    La fila se borra con `WHERE referencias = 0` y el archivo se elimina antes
+    del commit: mientras tanto la fila queda bloqueada, así que una subida
+    simultánea del mismo contenido espera y después vuelve a crear fila y archivo.
+    """
+    if not nombre:
+        return False
+    borradas = db.session.execute(
+        delete(ArchivoSubido.__table__).where(
+            ArchivoSubido.nombre == nombre,
+            ArchivoSubido.referencias == 0
+        )
+    ).rowcount
+    if not borradas:
+        en_uso = (db.session.query(ArchivoSubido.id).filter_by(nombre=nombre).first() is not None
+                  # Archivo anterior al almacén que todavía usa otro producto
+                  or Producto.query.filter_by(imagen=nombre).count())
+        if en_uso:
+            db.session.rollback()
+            return False
+
+    try:
+        imagenes.eliminar_derivados(nombre)
+        try:
+            os.remove(_ruta(nombre))
+        except OSError:
+            pass
+    finally:
+        db.session.commit()
+    return True
+
+
+def es_inmutable(ruta):
+    """True para las URLs del almacén y sus derivados, que nunca cambian de contenido"""
+    return (ruta.startswith(f'/static/uploads/{CARPETA_CAS}/')
+            or ruta.startswith(f'/static/uploads/{imagenes.CARPETA_DERIVADOS}/{CARPETA_CAS}/'))
+
+
+def cabeceras_inmutables(response):
+    """after_request: caché de larga duración para los archivos del almacén"""
+    if response.status_code == 200 and es_inmutable(request.path):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = MAX_AGE_INMUTABLE
+        response.cache_control.immutable = True
+    return response
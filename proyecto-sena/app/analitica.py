@@ -0,0 +1,371 @@
+"""
+Instantánea columnar de las líneas de venta para análisis ad hoc.
+
+Cada línea de `detalle_ventas` se guarda como una posición en arrays de NumPy
+(fecha en días desde 1970-01-01, producto, códigos de categoría, método de
+pago y estado, unidades y subtotal en céntimos). Las agrupaciones se
+resuelven con `np.bincount` sobre una máscara booleana y los top-N con
+`np.argpartition`, sin pasar por el ORM ni por la base de datos.
+
+La instantánea se carga una vez (desde la base de datos o desde un archivo
+.npz guardado con `guardar`) y después solo se le añaden las líneas nuevas:
+
+- las líneas se leen por `detalle_ventas.id`, volviendo a leer una ventana de
+  `MARGEN_RELECTURA` ids por si una transacción más lenta confirmó ids menores,
+- los cambios de estado (anulaciones) se detectan con el contador
+  `estados_venta` y solo se vuelven a leer las ventas no completadas.
+
+NumPy es opcional: sin él `disponible()` devuelve False y los reportes siguen
+usando SQL.
+"""
+import threading
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import Integer, case, cast, func, or_, select
+from app import db
+from app.models import Venta, DetalleVenta, Producto, Generacion
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él no hay instantánea
+    np = None
+
+CATEGORIAS = ('Tenis', 'Pádel', 'Accesorios')
+METODOS_PAGO = ('efectivo', 'tarjeta', 'transferencia')
+ESTADOS = ('pendiente', 'completada', 'cancelada', 'anulada')
+
+EPOCA = date(1970, 1, 1)
+MARGEN_RELECTURA = 1000
+FILAS_POR_BLOQUE = 50000
+
+# Columnas y tipos de la instantánea; los códigos valen 0 para NULL y i+1 para el valor i
+COLUMNAS = {
+    'detalle_id': 'int64',
+    'venta_id': 'int64',
+    'dia': 'int64',
+    'producto_id': 'int64',
+    'categoria': 'int8',
+    'metodo_pago': 'int8',
+    'estado': 'int8',
+    'cantidad': 'int64',
+    'centimos': 'int64',
+    # 1 en la primera línea de cada venta: su suma cuenta ventas, no líneas
+    'primera_linea': 'int8',
+}
+
+# Agrupaciones admitidas: columna y valores de sus códigos
+AGRUPACIONES = {
+    'producto': ('producto_id', None),
+    'categoria': ('categoria', CATEGORIAS),
+    'metodo_pago': ('metodo_pago', METODOS_PAGO),
+    'estado': ('estado', ESTADOS),
+}
+PERIODOS = ('dia', 'semana', 'mes')
+
+Grupo = namedtuple('Grupo', 'clave lineas ventas unidades total')
+
+_instantanea = None
+_lock = threading.Lock()
+
+
+def disponible():
+    return np is not None
+
+
+def _codigo(valores):
+    return {valor: i + 1 for i, valor in enumerate(valores)}
+
+
+def _a_dia(valor):
+    """date o datetime -> días desde 1970-01-01"""
+    if valor is None:
+        return None
+    if hasattr(valor, 'date'):
+        valor = valor.date()
+    return (valor - EPOCA).days
+
+
+def _de_dia(dias):
+    return EPOCA + timedelta(days=int(dias))
+
+
+class Instantanea:
+    """Arrays columnares de las líneas de venta con espacio de reserva para añadir"""
+
+    def __init__(self):
+        self.n = 0
+        self._datos = {columna: np.empty(0, dtype=tipo) for columna, tipo in COLUMNAS.items()}
+        self.ultimo_detalle_id = 0
+        self.generacion_estados = 0
+        self.generacion_ventas = 0
+
+    def __getattr__(self, columna):
+        if columna in COLUMNAS:
+            return self._datos[columna][:self.n]
+        raise AttributeError(columna)
+
+    def __len__(self):
+        return self.n
+
+    def vista(self):
+        """
+        Instantánea de solo lectura con las `n` líneas actuales. Comparte los arrays:
+        `actualizar` nunca escribe por debajo de `n` (añade detrás o sustituye la
+        columna entera), así que la vista no cambia aunque otra petición actualice.
+        """
+        vista = Instantanea()
+        vista.n = self.n
+        vista._datos = {columna: array[:self.n] for columna, array in self._datos.items()}
+        vista.ultimo_detalle_id = self.ultimo_detalle_id
+        vista.generacion_estados = self.generacion_estados
+        vista.generacion_ventas = self.generacion_ventas
+        return vista
+
+    # ---------- Carga ----------
+
+    def _reservar(self, extra):
+        capacidad = len(self._datos['detalle_id'])
+        if self.n + extra <= capacidad:
+            return
+        nueva = max(self.n + extra, capacidad * 2, 1024)
+        for columna, array in self._datos.items():
+            ampliado = np.empty(nueva, dtype=array.dtype)
+            ampliado[:self.n] = array[:self.n]
+            self._datos[columna] = ampliado
+
+    def _anadir(self, columnas):
+        cuantas = len(columnas['detalle_id'])
+        if not cuantas:
+            return
+        self._reservar(cuantas)
+        for columna, valores in columnas.items():
+            self._datos[columna][self.n:self.n + cuantas] = valores
+        self.n += cuantas
+
+    def _leer_lineas(self, desde_id):
+        """
+        Líneas con id > desde_id, en bloques de arrays. Los códigos y los céntimos
+        se calculan en SQL y se lee por Core (sin ORM ni conversión de tipos por
+        fila), que es lo que más cuesta con millones de líneas.
+        """
+        def codigo(columna, valores):
+            return case(_codigo(valores), value=columna, else_=0)
+
+        consulta = select(
+            DetalleVenta.id, DetalleVenta.venta_id, func.date(Venta.fecha), DetalleVenta.producto_id,
+            codigo(Producto.categoria, CATEGORIAS), codigo(Venta.metodo_pago, METODOS_PAGO),
+            codigo(Venta.estado, ESTADOS), DetalleVenta.cantidad,
+            cast(func.round(DetalleVenta.subtotal * 100), Integer)
+        ).join(
+            Venta, Venta.id == DetalleVenta.venta_id
+        ).outerjoin(
+            Producto, Producto.id == DetalleVenta.producto_id
+        ).where(
+            DetalleVenta.id > desde_id
+        ).order_by(DetalleVenta.id)
+
+        # DATE() devuelve date en MySQL y texto en SQLite; hay pocos días distintos
+        dias = {}
+
+        def dia(valor):
+            if valor not in dias:
+                dias[valor] = _a_dia(date.fromisoformat(str(valor)[:10]))
+            return dias[valor]
+
+        resultado = db.session.connection().execution_options(stream_results=True).execute(consulta)
+        try:
+            for filas in resultado.partitions(FILAS_POR_BLOQUE):
+                ids, ventas, fechas, productos, cats, pagos, ests, cantidades, centimos = zip(*filas)
+                yield {
+                    'detalle_id': np.array(ids, dtype='int64'),
+                    'venta_id': np.array(ventas, dtype='int64'),
+                    'dia': np.array([dia(f) for f in fechas], dtype='int64'),
+                    'producto_id': np.array(productos, dtype='int64'),
+                    'categoria': np.array(cats, dtype='int8'),
+                    'metodo_pago': np.array(pagos, dtype='int8'),
+                    'estado': np.array(ests, dtype='int8'),
+                    'cantidad': np.array(cantidades, dtype='int64'),
+                    'centimos': np.array(centimos, dtype='int64'),
+                }
+        finally:
+            resultado.close()
+
+    def actualizar(self):
+        """Añade las líneas nuevas y aplica los cambios de estado; devuelve cuántas líneas añadió"""
+        generacion_ventas = Generacion.obtener('ventas')
+        generacion_estados = Generacion.obtener('estados_venta')
+        desde_id = max(self.ultimo_detalle_id - MARGEN_RELECTURA, 0)
+        ventana = self.detalle_id >= desde_id
+        ids_ventana = self.detalle_id[ventana]
+        ventas_ventana = self.venta_id[ventana]
+
+        anadidas = 0
+        for bloque in self._leer_lineas(desde_id):
+            nuevas = ~np.isin(bloque['detalle_id'], ids_ventana)
+            bloque = {columna: valores[nuevas] for columna, valores in bloque.items()}
+            _, primeras = np.unique(bloque['venta_id'], return_index=True)
+            primera_linea = np.zeros(len(bloque['venta_id']), dtype='int8')
+            primera_linea[primeras] = 1
+            # Una venta ya contada en la ventana o en un bloque anterior no vuelve a contar
+            primera_linea[np.isin(bloque['venta_id'], ventas_ventana)] = 0
+            bloque['primera_linea'] = primera_linea
+            self._anadir(bloque)
+            ventas_ventana = np.concatenate([ventas_ventana, bloque['venta_id']])
+            anadidas += len(primera_linea)
+
+        if self.n:
+            self.ultimo_detalle_id = int(self.detalle_id.max())
+        if generacion_estados != self.generacion_estados:
+            self._releer_estados()
+        self.generacion_estados = generacion_estados
+        self.generacion_ventas = generacion_ventas
+        return anadidas
+
+    def _releer_estados(self):
+        """Las ventas solo cambian de estado al anularse: se releen las no completadas"""
+        estados = _codigo(ESTADOS)
+        filas = db.session.execute(
+            select(Venta.id, Venta.estado).where(or_(Venta.estado != 'completada', Venta.estado.is_(None)))
+        ).all()
+        # Columna nueva en lugar de escribir sobre la que pueden estar leyendo las vistas
+        columna = self._datos['estado'].copy()
+        estado = columna[:self.n]
+        estado[:] = estados['completada']
+        por_estado = {}
+        for venta_id, valor in filas:
+            por_estado.setdefault(estados.get(valor, 0), []).append(venta_id)
+        for codigo, ids in por_estado.items():
+            estado[np.isin(self.venta_id, ids)] = codigo
+        self._datos['estado'] = columna
+
+    # ---------- Archivo ----------
+
+    def guardar(self, ruta):
+        """Guarda la instantánea en un .npz para no releer la base de datos al arrancar"""
+        np.savez(ruta, meta=np.array([self.ultimo_detalle_id, self.generacion_estados], dtype='int64'),
+                 **{columna: getattr(self, columna) for columna in COLUMNAS})
+
+    @classmethod
+    def cargar(cls, ruta):
+        instantanea = cls()
+        with np.load(ruta) as archivo:
+            instantanea._anadir({columna: archivo[columna] for columna in COLUMNAS})
+            instantanea.ultimo_detalle_id, instantanea.generacion_estados = (int(v) for v in archivo['meta'])
+        return instantanea
+
+    # ---------- Consultas ----------
+
+    def mascara(self, desde=None, hasta=None, estado=None, metodo_pago=None, categoria=None):
+        """Filtro booleano de las líneas de los días [desde, hasta] y los valores pedidos"""
+        mascara = np.ones(self.n, dtype=bool)
+        if desde is not None:
+            mascara &= self.dia >= _a_dia(desde)
+        if hasta is not None:
+            mascara &= self.dia <= _a_dia(hasta)
+        for columna, valor, valores in (('estado', estado, ESTADOS), ('metodo_pago', metodo_pago, METODOS_PAGO),
+                                        ('categoria', categoria, CATEGORIAS)):
+            if valor is not None:
+                mascara &= getattr(self, columna) == _codigo(valores).get(valor, -1)
+        return mascara
+
+    def _sumas(self, claves, mascara, minimo):
+        """bincount de líneas, ventas, unidades y céntimos por clave"""
+        claves = claves[mascara]
+
+        def suma(columna=None):
+            pesos = None if columna is None else getattr(self, columna)[mascara]
+            return np.bincount(claves, weights=pesos, minlength=minimo).astype('int64')
+
+        return suma(), suma('primera_linea'), suma('cantidad'), suma('centimos')
+
+    def _grupos(self, claves, sumas, etiqueta):
+        lineas, ventas, unidades, centimos = sumas
+        return [
+            Grupo(etiqueta(clave), int(lineas[clave]), int(ventas[clave]), int(unidades[clave]),
+                  Decimal(int(centimos[clave])) / 100)
+            for clave in claves
+        ]
+
+    def agrupar(self, por, **filtros):
+        """
+        Totales por producto, categoría, método de pago o estado. `ventas` cuenta
+        la primera línea de cada venta, así que solo tiene sentido para atributos
+        de la venta (método de pago, estado), no de la línea.
+        """
+        columna, valores = AGRUPACIONES[por]
+        claves = getattr(self, columna)
+        minimo = (len(valores) + 1) if valores else (int(claves.max()) + 1 if self.n else 0)
+        sumas = self._sumas(claves, self.mascara(**filtros), minimo)
+        presentes = np.flatnonzero(sumas[0])
+        return self._grupos(presentes, sumas, (lambda c: valores[c - 1] if c else None) if valores else int)
+
+    def top(self, por='producto', n=10, medida='total', **filtros):
+        """Los `n` grupos con mayor `medida` (total, unidades, lineas o ventas)"""
+        columna, valores = AGRUPACIONES[por]
+        claves = getattr(self, columna)
+        minimo = (len(valores) + 1) if valores else (int(claves.max()) + 1 if self.n else 0)
+        sumas = self._sumas(claves, self.mascara(**filtros), minimo)
+        valor = sumas[('lineas', 'ventas', 'unidades', 'total').index(medida)]
+        presentes = np.count_nonzero(sumas[0])
+        n = min(n, presentes)
+        if not n:
+            return []
+        # argpartition deja los n mayores al final sin ordenar todo el array
+        candidatos = np.argpartition(valor, len(valor) - n)[-n:]
+        # Orden: mayor medida primero; a igualdad, la clave menor
+        candidatos = candidatos[np.lexsort((candidatos, -valor[candidatos]))]
+        return self._grupos(candidatos, sumas, (lambda c: valores[c - 1] if c else None) if valores else int)
+
+    def por_periodo(self, periodo='dia', **filtros):
+        """Totales por día, semana (lunes) o mes, en orden cronológico"""
+        mascara = self.mascara(**filtros)
+        dias = self.dia[mascara]
+        if not len(dias):
+            return []
+        if periodo == 'semana':
+            # 1970-01-01 fue jueves: +3 alinea las semanas al lunes
+            cubetas = (dias + 3) // 7 * 7 - 3
+        elif periodo == 'mes':
+            cubetas = dias.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype('int64')
+        else:
+            cubetas = dias
+        base = int(cubetas.min())
+        claves = np.zeros(self.n, dtype='int64')
+        claves[mascara] = cubetas - base
+        sumas = self._sumas(claves, mascara, int(cubetas.max()) - base + 1)
+        presentes = np.flatnonzero(sumas[0])
+        return self._grupos(presentes, sumas, lambda c: _de_dia(c + base))
+
+
+def instantanea():
+    """
+    Instantánea del proceso, al día con la base de datos. La primera vez se carga
+    de ANALITICA_ARCHIVO si existe (o de la base de datos); después solo se
+    añaden las líneas nuevas cuando cambia el contador de ventas. Devuelve una
+    vista de longitud fija que se puede leer fuera del lock.
+    """
+    global _instantanea
+    if np is None:
+        raise RuntimeError('NumPy no está instalado')
+    with _lock:
+        if _instantanea is None:
+            ruta = current_app.config.get('ANALITICA_ARCHIVO')
+            try:
+                _instantanea = Instantanea.cargar(ruta) if ruta else Instantanea()
+            except FileNotFoundError:
+                _instantanea = Instantanea()
+            _instantanea.actualizar()
+        elif Generacion.obtener('ventas') != _instantanea.generacion_ventas:
+            _instantanea.actualizar()
+        return _instantanea.vista()
+
+
+def construir():
+    """Instantánea nueva leída completa de la base de datos (no la del proceso)"""
+    if np is None:
+        raise RuntimeError('NumPy no está instalado')
+    nueva = Instantanea()
+    nueva.actualizar()
+    return nueva
@@ -0,0 +1,123 @@
+"""
+Índice en memoria para el autocompletado de productos en la pantalla de ventas.
+
+Cada proceso guarda una tupla compacta por producto y un índice de trigramas
+sobre nombre, código y marca. El índice se refresca de forma incremental con
+los productos cuyo `actualizado_en` cambió desde la última carga. El stock no
+se guarda en el índice: se consulta en cada petición solo para los resultados.
+"""
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from app import db
+from app.models import Producto
+
+# Posiciones de la tupla compacta de cada producto
+ID, CODIGO, NOMBRE, PRECIO, IMAGEN, TEXTO = range(6)
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes, para que 'padel' encuentre 'Pádel'"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceAutocompletado:
+
+    def __init__(self, intervalo_refresco=5):
+        self.intervalo_refresco = intervalo_refresco
+        self._productos = {}
+        self._trigramas = defaultdict(set)
+        self._ultima_modificacion = None
+        self._ultimo_refresco = 0
+        self._lock = threading.Lock()
+
+    def _quitar(self, producto_id):
+        anterior = self._productos.pop(producto_id, None)
+        if anterior is None:
+            return
+        for trigrama in trigramas(anterior[TEXTO]):
+            ids = self._trigramas.get(trigrama)
+            if ids is not None:
+                ids.discard(producto_id)
+                if not ids:
+                    del self._trigramas[trigrama]
+
+    def _agregar(self, fila):
+        texto = normalizar(' '.join(filter(None, (fila.nombre, fila.codigo, fila.marca))))
+        self._productos[fila.id] = (
+            fila.id,
+            fila.codigo,
+            fila.nombre,
+            float(fila.precio_venta) if fila.precio_venta else 0,
+            fila.imagen,
+            texto
+        )
+        for trigrama in trigramas(texto):
+            self._trigramas[trigrama].add(fila.id)
+
+    def refrescar(self, forzar=False):
+        """Carga los productos modificados desde el último refresco (como mucho cada `intervalo_refresco` s)"""
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo_refresco < self.intervalo_refresco:
+            return
+        with self._lock:
+            if not forzar and ahora - self._ultimo_refresco < self.intervalo_refresco:
+                return
+            query = db.session.query(
+                Producto.id, Producto.codigo, Producto.nombre, Producto.marca,
+                Producto.precio_venta, Producto.imagen, Producto.actualizado_en
+            )
+            if self._ultima_modificacion is not None:
+                # >= para no perder cambios guardados en el mismo instante que el último visto
+                query = query.filter(Producto.actualizado_en >= self._ultima_modificacion)
+            for fila in query:
+                self._quitar(fila.id)
+                self._agregar(fila)
+                if fila.actualizado_en and (self._ultima_modificacion is None
+                                            or fila.actualizado_en > self._ultima_modificacion):
+                    self._ultima_modificacion = fila.actualizado_en
+            self._ultimo_refresco = ahora
+
+    def buscar(self, texto, limite=10):
+        """Devuelve las tuplas de los productos cuyo nombre, código o marca contienen `texto`"""
+        consulta = normalizar(texto).strip()
+        with self._lock:
+            if not consulta:
+                candidatos = sorted(self._productos)[:limite]
+                return [self._productos[i] for i in candidatos]
+
+            if len(consulta) >= 3:
+                # Intersección de las listas de trigramas, empezando por la más corta
+                listas = sorted((self._trigramas.get(t, set()) for t in trigramas(consulta)), key=len)
+                ids = set(listas[0])
+                for lista in listas[1:]:
+                    ids &= lista
+                candidatos = (self._productos[i] for i in ids)
+            else:
+                candidatos = self._productos.values()
+
+            encontrados = [p for p in candidatos if consulta in p[TEXTO]]
+
+        # Primero los que empiezan por el texto buscado, luego por nombre
+        encontrados.sort(key=lambda p: (not p[TEXTO].startswith(consulta), p[NOMBRE]))
+        return encontrados[:limite]
+
+    def quitar(self, producto_id):
+        with self._lock:
+            self._quitar(producto_id)
+
+
+indice_productos = IndiceAutocompletado()
+
+
+def stock_actual(ids):
+    """Stock vigente de los productos indicados, en una sola consulta por clave primaria"""
+    if not ids:
+        return {}
+    return dict(db.session.query(Producto.id, Producto.stock).filter(Producto.id.in_(ids)).all())
@@ -0,0 +1,137 @@
+"""
+Búsqueda de texto completo sobre nombre y descripción de productos.
+
+- MySQL: índice FULLTEXT con el parser ngram (mantenido por InnoDB).
+- SQLite: tabla virtual FTS5 con tokenizador trigram, sincronizada con
+  `productos` mediante triggers.
+
+Si el índice no existe o el texto es demasiado corto para buscarse por
+n-gramas, se usa la búsqueda LIKE de siempre.
+"""
+import re
+from sqlalchemy import event, or_, text, column, table
+from app import db
+from app.models import Producto
+
+INDICE_MYSQL = 'ft_productos_texto'
+TABLA_FTS = 'productos_fts'
+
+# Longitud mínima de cada término para que el índice de n-gramas lo encuentre
+LONGITUD_MINIMA = {'mysql': 2, 'sqlite': 3}
+
+_SQL_SQLITE = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5(
+        nombre, descripcion, content='productos', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ai AFTER INSERT ON productos BEGIN
+        INSERT INTO {TABLA_FTS}(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ad AFTER DELETE ON productos BEGIN
+        INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, nombre, descripcion) VALUES ('delete', old.id, old.nombre, old.descripcion);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_au AFTER UPDATE OF nombre, descripcion ON productos BEGIN
+        INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, nombre, descripcion) VALUES ('delete', old.id, old.nombre, old.descripcion);
+        INSERT INTO {TABLA_FTS}(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion);
+    END""",
+    f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES ('rebuild')",
+]
+
+_fts = table(TABLA_FTS, column('rowid'))
+_backends = {}
+
+
+def _existe_indice(conexion):
+    dialecto = conexion.dialect.name
+    if dialecto == 'mysql':
+        return bool(conexion.execute(text(
+            "SELECT COUNT(*) FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = 'productos' AND index_name = :indice"
+        ), {'indice': INDICE_MYSQL}).scalar())
+    if dialecto == 'sqlite':
+        return bool(conexion.execute(text(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = :tabla"
+        ), {'tabla': TABLA_FTS}).scalar())
+    return False
+
+
+def crear_indice(conexion):
+    """Crea el índice de texto completo si el motor lo soporta. Devuelve True si queda disponible."""
+    dialecto = conexion.dialect.name
+    if _existe_indice(conexion):
+        return True
+    if dialecto == 'mysql':
+        conexion.execute(text(
+            f"ALTER TABLE productos ADD FULLTEXT INDEX {INDICE_MYSQL} (nombre, descripcion) WITH PARSER ngram"
+        ))
+    elif dialecto == 'sqlite':
+        for sql in _SQL_SQLITE:
+            conexion.execute(text(sql))
+    else:
+        return False
+    _backends.clear()
+    return True
+
+
+@event.listens_for(Producto.__table__, 'after_create')
+def _al_crear_productos(tabla, conexion, **kwargs):
+    try:
+        crear_indice(conexion)
+    except Exception:
+        # p. ej. SQLite compilado sin FTS5: se seguirá usando LIKE
+        pass
+
+
+def backend():
+    """'mysql', 'sqlite' o 'like' según el índice disponible en la base de datos actual"""
+    clave = str(db.engine.url)
+    if clave not in _backends:
+        # Conexión de la sesión: no abrir otra mientras la petición tiene una transacción
+        disponible = _existe_indice(db.session.connection())
+        _backends[clave] = db.engine.dialect.name if disponible else 'like'
+    return _backends[clave]
+
+
+def _terminos(texto):
+    return [t for t in re.split(r'\s+', texto.strip()) if t]
+
+
+def _filtrar_like(query, texto):
+    patron = f'%{texto}%'
+    return query.filter(
+        or_(
+            Producto.nombre.like(patron),
+            Producto.descripcion.like(patron)
+        )
+    )
+
+
+def filtrar(query, texto):
+    """
+    Aplica la búsqueda de `texto` a una consulta de productos.
+    Con índice disponible los resultados quedan ordenados por relevancia.
+    """
+    motor = backend()
+    terminos = _terminos(texto)
+    if motor == 'like' or not terminos or min(len(t) for t in terminos) < LONGITUD_MINIMA[motor]:
+        return _filtrar_like(query, texto)
+
+    if motor == 'mysql':
+        # Modo booleano: todos los términos son obligatorios
+        consulta = ' '.join('+"{}"'.format(t.replace('"', '')) for t in terminos)
+        coincidencia = text(
+            'MATCH (productos.nombre, productos.descripcion) AGAINST (:consulta IN BOOLEAN MODE)'
+        ).bindparams(consulta=consulta)
+        return query.filter(coincidencia).order_by(
+            text('MATCH (productos.nombre, productos.descripcion) AGAINST (:consulta IN BOOLEAN MODE) DESC')
+            .bindparams(consulta=consulta)
+        )
+
+    # SQLite FTS5: cada término entre comillas se busca como subcadena (trigram)
+    consulta = ' '.join('"{}"'.format(t.replace('"', '""')) for t in terminos)
+    return query.join(
+        _fts, _fts.c.rowid == Producto.id
+    ).filter(
+        text(f'{TABLA_FTS} MATCH :consulta').bindparams(consulta=consulta)
+    ).order_by(
+        text(f'{TABLA_FTS}.rank')
+    )
@@ -0,0 +1,224 @@
+"""
+Caché en memoria para bloques calculados, versionada por generación.
+
+Cada entrada guarda la generación con la que se calculó. Cuando la generación
+actual es mayor, la entrada está obsoleta: en modo stale-while-revalidate se
+devuelve el valor anterior y se recalcula en un hilo aparte, de modo que
+ningún usuario espera el recálculo salvo la primera vez que se pide la clave.
+"""
+import contextvars
+import threading
+import time
+from flask import current_app
+
+
+class CacheGeneracional:
+
+    def __init__(self, nombre, max_entradas=128):
+        self.nombre = nombre
+        self.max_entradas = max_entradas
+        self._entradas = {}
+        self._recalculando = set()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.obsoletos = 0
+
+    def obtener(self, clave, generacion, calcular, obsoleto_permitido=True):
+        """
+        Devuelve el valor de `clave` para la generación indicada.
+        `calcular` es una función sin argumentos que produce el valor.
+        """
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] >= generacion:
+                self.aciertos += 1
+                return entrada[1]
+            if entrada is not None and obsoleto_permitido:
+                self.obsoletos += 1
+                if clave not in self._recalculando:
+                    self._recalculando.add(clave)
+                    self._recalcular_en_segundo_plano(clave, generacion, calcular)
+                return entrada[1]
+            self.fallos += 1
+
+        valor = calcular()
+        self._guardar(clave, generacion, valor)
+        return valor
+
+    def buscar(self, clave, generacion):
+        """Valor vigente de `clave` para la generación indicada, o None (sin calcularlo)"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] >= generacion:
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+            return None
+
+    def guardar(self, clave, generacion, valor):
+        self._guardar(clave, generacion, valor)
+
+    def _guardar(self, clave, generacion, valor):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[0] <= generacion:
+                self._entradas.pop(clave, None)
+                self._entradas[clave] = (generacion, valor)
+            # Descartar las claves más antiguas (p. ej. las de días anteriores)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.pop(next(iter(self._entradas)))
+
+    def _recalcular_en_segundo_plano(self, clave, generacion, calcular):
+        app = current_app._get_current_object()
+
+        def tarea():
+            try:
+                with app.app_context():
+                    self._guardar(clave, generacion, calcular())
+            except Exception as e:
+                app.logger.error(f'Error al recalcular la caché {self.nombre} ({clave}): {str(e)}')
+            finally:
+                with self._lock:
+                    self._recalculando.discard(clave)
+
+        # El hilo hereda el contexto (p. ej. las lecturas en réplica de la petición)
+        contexto = contextvars.copy_context()
+        threading.Thread(target=contexto.run, args=(tarea,), daemon=True).start()
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'nombre': self.nombre,
+                'entradas': len(self._entradas),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'obsoletos': self.obsoletos
+            }
+
+
+class CacheTTL:
+    """Caché en memoria cuyos valores caducan a los `ttl` segundos (absorbe ráfagas de peticiones)"""
+
+    def __init__(self, nombre, ttl, max_entradas=128):
+        self.nombre = nombre
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._entradas = {}
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, calcular):
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and ahora - entrada[0] < self.ttl:
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+
+        valor = calcular()
+        with self._lock:
+            self._entradas.pop(clave, None)
+            self._entradas[clave] = (ahora, valor)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.pop(next(iter(self._entradas)))
+        return valor
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._entradas.pop(clave, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'nombre': self.nombre,
+                'entradas': len(self._entradas),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos
+            }
+
+
+class CacheRevisada:
+    """
+    Un único valor por proceso (p. ej. una tabla pequeña cargada entera) que se
+    compara con su versión en la base de datos como mucho cada
+    `config[clave_intervalo]` segundos. Entre revisiones leerlo no hace
+    ninguna consulta; un cambio en otro proceso se ve como mucho tras un intervalo.
+    """
+
+    def __init__(self, nombre, clave_intervalo, intervalo_por_defecto=5):
+        self.nombre = nombre
+        self.clave_intervalo = clave_intervalo
+        self.intervalo_por_defecto = intervalo_por_defecto
+        self._valor = None
+        self._version = None
+        self._proxima_revision = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.revisiones = 0
+        self.cargas = 0
+
+    def obtener(self, version, cargar):
+        """
+        `version` devuelve la versión actual (una consulta barata) y `cargar`
+        el valor completo; solo se llaman al revisar o si el valor cambió.
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            if self._valor is not None and ahora < self._proxima_revision:
+                self.aciertos += 1
+                return self._valor
+            valor, version_cargada = self._valor, self._version
+
+        intervalo = current_app.config.get(self.clave_intervalo, self.intervalo_por_defecto)
+        # La versión se lee antes que el valor: si cambia entre medias se recarga en la siguiente revisión
+        actual = version()
+        if valor is None or actual != version_cargada:
+            valor = cargar()
+            with self._lock:
+                self.cargas += 1
+        with self._lock:
+            self.revisiones += 1
+            self._valor, self._version = valor, actual
+            self._proxima_revision = ahora + intervalo
+        return valor
+
+    def invalidar(self):
+        """Fuerza la recarga en la próxima lectura de este proceso (los demás lo verán al revisar)"""
+        with self._lock:
+            self._valor = None
+
+    def limpiar(self):
+        self.invalidar()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'nombre': self.nombre,
+                'entradas': 0 if self._valor is None else len(self._valor),
+                'aciertos': self.aciertos,
+                'revisiones': self.revisiones,
+                'cargas': self.cargas
+            }
+
+
+cache_dashboard = CacheGeneracional('dashboard')
+cache_ventas = CacheGeneracional('ventas')
+# Totales de ventanas de días ya cerradas para las comparaciones entre períodos
+cache_periodos = CacheGeneracional('periodos_cerrados')
+# Validador (última venta) por rango de la API de estadísticas: unos segundos bastan
+cache_validadores = CacheTTL('validadores_estadisticas', ttl=5)
+# Usuarios en sesión: un cambio hecho en otro proceso (p. ej. desactivar) se ve como mucho a los 30 s
+cache_usuarios = CacheTTL('usuarios', ttl=30, max_entradas=1024)
+# Tabla `configuraciones` completa, revisada con la generación 'configuracion'
+cache_configuracion = CacheRevisada('configuracion', 'CONFIGURACION_REVISION_SEGUNDOS')
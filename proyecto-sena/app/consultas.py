@@ -0,0 +1,99 @@
+"""
+Utilidades compartidas para construir consultas de ventas.
+
+Los filtros por fecha se expresan siempre como rangos semiabiertos
+[desde, hasta) sobre la columna original, sin envolverla en funciones como
+DATE(), para que la base de datos pueda usar los índices de `fecha`.
+"""
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import and_, func, select, text
+from app import db
+from app.models import Venta, DetalleVenta, Producto
+
+
+def rango_dias(inicio, fin):
+    """Convierte los días [inicio, fin] (ambos incluidos) en el rango de datetimes [desde, hasta)"""
+    if isinstance(inicio, datetime):
+        inicio = inicio.date()
+    if isinstance(fin, datetime):
+        fin = fin.date()
+    desde = datetime.combine(inicio, time.min)
+    hasta = datetime.combine(fin, time.min) + timedelta(days=1)
+    return desde, hasta
+
+
+def en_rango(columna, desde, hasta):
+    """Predicado semiabierto: columna >= desde AND columna < hasta"""
+    return and_(columna >= desde, columna < hasta)
+
+
+def ventas_en_dias(inicio, fin):
+    """Filtro de ventas cuya fecha cae entre los días inicio y fin (ambos incluidos)"""
+    return en_rango(Venta.fecha, *rango_dias(inicio, fin))
+
+
+def validador_ventas(inicio, fin):
+    """
+    (id máximo, fecha máxima, número de ventas) de los días [inicio, fin]. Cambia
+    cuando se registra o se borra una venta del rango; se resuelve con el índice
+    (fecha, id) sin leer las filas ni las tablas de detalle.
+    """
+    fila = db.session.query(
+        func.max(Venta.id), func.max(Venta.fecha), func.count(Venta.id)
+    ).filter(ventas_en_dias(inicio, fin)).one()
+    return tuple(fila)
+
+
+def parsear_dia(valor, por_defecto):
+    """Convierte 'YYYY-MM-DD' en date, o devuelve el valor por defecto"""
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        return por_defecto
+
+
+# ================================
+# VERIFICACIÓN DE PLANES DE EJECUCIÓN
+# ================================
+
+def consultas_criticas():
+    """
+    Consultas más frecuentes de los reportes junto con el índice que deben usar.
+    Se usan para comprobar con EXPLAIN que ningún cambio las deja sin índice.
+    """
+    hoy = date.today()
+    filtro = ventas_en_dias(hoy - timedelta(days=30), hoy)
+    return [
+        ('resumen de ventas por rango',
+         select(func.count(Venta.id), func.sum(Venta.total)).where(filtro),
+         'ix_ventas_fecha_estado_pago_total'),
+        ('ventas por día',
+         select(func.date(Venta.fecha), func.count(Venta.id), func.sum(Venta.total))
+         .where(filtro).group_by(func.date(Venta.fecha)),
+         'ix_ventas_fecha_estado_pago_total'),
+        ('listado filtrado por estado',
+         select(Venta).where(filtro, Venta.estado == 'completada')
+         .order_by(Venta.fecha.desc(), Venta.id.desc()),
+         'ix_ventas_fecha_id'),
+        ('detalles de las ventas del rango',
+         select(Producto.categoria, func.sum(DetalleVenta.cantidad), func.sum(DetalleVenta.subtotal))
+         .join(DetalleVenta, DetalleVenta.producto_id == Producto.id)
+         .join(Venta, Venta.id == DetalleVenta.venta_id)
+         .where(filtro).group_by(Producto.categoria),
+         'ix_detalle_ventas_venta_producto'),
+    ]
+
+
+def verificar_planes(engine):
+    """
+    Ejecuta EXPLAIN QUERY PLAN (SQLite) sobre las consultas críticas.
+    Devuelve una lista de (nombre, plan, usa_indice).
+    """
+    resultados = []
+    with engine.connect() as conexion:
+        for nombre, consulta, indice in consultas_criticas():
+            sql = str(consulta.compile(engine, compile_kwargs={'literal_binds': True}))
+            filas = conexion.execute(text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()
+            plan = [fila[-1] for fila in filas]
+            resultados.append((nombre, plan, any(indice in paso for paso in plan)))
+    return resultados
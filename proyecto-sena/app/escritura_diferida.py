@@ -0,0 +1,129 @@
+"""
+Escritura diferida (write-behind) para actualizaciones tipo "último acceso".
+
+En lugar de un commit por cada inicio de sesión, el valor se anota en
+memoria (el último por id gana) y un hilo del proceso los vuelca todos a la
+vez cada ESCRITURA_DIFERIDA_SEGUNDOS con un único UPDATE de varias filas:
+
+    UPDATE usuarios SET ultimo_acceso = CASE id WHEN .. THEN .. END
+    WHERE id IN (..) AND (ultimo_acceso IS NULL OR ultimo_acceso < CASE id ..)
+
+La condición evita que un proceso con un valor más antiguo pise el de otro.
+Lo que se puede perder si el proceso muere sin volcar está acotado: como
+mucho ESCRITURA_DIFERIDA_SEGUNDOS de anotaciones, y nunca más de
+ESCRITURA_DIFERIDA_MAX_PENDIENTES (al llegar a ese número se vuelca en el
+momento). Al salir el proceso se vuelca lo pendiente.
+"""
+import atexit
+import threading
+from flask import current_app
+from sqlalchemy import case, or_, update
+from app import db
+from app.models import Usuario
+
+
+class BufferDiferido:
+
+    def __init__(self, nombre, modelo, columna):
+        self.nombre = nombre
+        self.modelo = modelo
+        self.columna = columna
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+        self._volcado_al_salir = False
+        self.anotaciones = 0
+        self.volcados = 0
+
+    def anotar(self, id, valor):
+        """Anota `valor` para la fila `id`; se escribirá en el próximo volcado"""
+        app = current_app._get_current_object()
+        with self._lock:
+            anterior = self._pendientes.get(id)
+            if anterior is None or valor > anterior:
+                self._pendientes[id] = valor
+            self.anotaciones += 1
+            pendientes = len(self._pendientes)
+
+        if app.config.get('ESCRITURA_DIFERIDA_SEGUNDOS', 5) <= 0 or _en_memoria():
+            # Escritura inmediata (pruebas con SQLite en memoria: la conexión no se comparte con hilos)
+            self.volcar()
+            return
+        self._arrancar(app)
+        if pendientes >= app.config.get('ESCRITURA_DIFERIDA_MAX_PENDIENTES', 500):
+            self._despertar.set()
+
+    def volcar(self):
+        """Escribe lo pendiente con un único UPDATE y hace commit; devuelve las filas anotadas"""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+        if not pendientes:
+            return 0
+        columna = getattr(self.modelo, self.columna)
+        nuevo = case(pendientes, value=self.modelo.id)
+        try:
+            db.session.execute(
+                update(self.modelo)
+                .where(self.modelo.id.in_(list(pendientes)), or_(columna.is_(None), columna < nuevo))
+                .values({self.columna: nuevo})
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Devolverlos al buffer sin pisar anotaciones más recientes
+            with self._lock:
+                for id, valor in pendientes.items():
+                    if id not in self._pendientes or valor > self._pendientes[id]:
+                        self._pendientes[id] = valor
+            raise
+        with self._lock:
+            self.volcados += 1
+        return len(pendientes)
+
+    def _arrancar(self, app):
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._bucle, args=(app,), daemon=True,
+                                          name=f'escritura-{self.nombre}')
+            registrar_salida = not self._volcado_al_salir
+            self._volcado_al_salir = True
+        if registrar_salida:
+            atexit.register(self._volcar_al_salir, app)
+        self._hilo.start()
+
+    def _bucle(self, app):
+        intervalo = app.config.get('ESCRITURA_DIFERIDA_SEGUNDOS', 5)
+        while True:
+            self._despertar.wait(intervalo)
+            self._despertar.clear()
+            try:
+                with app.app_context():
+                    self.volcar()
+            except Exception as e:
+                app.logger.error(f'Error en la escritura diferida {self.nombre}: {str(e)}')
+
+    def _volcar_al_salir(self, app):
+        try:
+            with app.app_context():
+                self.volcar()
+        except Exception as e:
+            app.logger.error(f'Error en la escritura diferida {self.nombre} al salir: {str(e)}')
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'nombre': self.nombre,
+                'pendientes': len(self._pendientes),
+                'anotaciones': self.anotaciones,
+                'volcados': self.volcados
+            }
+
+
+def _en_memoria():
+    return db.engine.dialect.name == 'sqlite' and db.engine.url.database in (None, '', ':memory:')
+
+
+ultimos_accesos = BufferDiferido('ultimo_acceso', Usuario, 'ultimo_acceso')
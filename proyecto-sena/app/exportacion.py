@@ -0,0 +1,108 @@
+"""
+Exportación de datos en CSV o NDJSON por streaming.
+
+Las consultas se ejecutan con `yield_per`, que activa `stream_results` (cursor
+del lado del servidor en MySQL), y las filas se van escribiendo en la respuesta
+en bloques a medida que llegan de la base de datos. Así exportar años de
+`detalle_ventas` no carga nunca el resultado completo en memoria. Con
+`gzip=1` la salida se comprime también por bloques.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from flask import Response, stream_with_context
+from app import db
+
+FILAS_POR_BLOQUE = 1000
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def _valor(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    return valor
+
+
+def filas_en_streaming(consulta, filas_por_bloque=FILAS_POR_BLOQUE):
+    """Itera las filas de un select() leyéndolas en bloques desde un cursor de servidor"""
+    resultado = db.session.execute(consulta.execution_options(yield_per=filas_por_bloque))
+    try:
+        for fila in resultado:
+            yield fila
+    finally:
+        resultado.close()
+
+
+def _bloques_csv(columnas, filas, filas_por_bloque):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(columnas)
+    pendientes = 0
+    for fila in filas:
+        escritor.writerow([_valor(v) for v in fila])
+        pendientes += 1
+        if pendientes >= filas_por_bloque:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pendientes = 0
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _bloques_ndjson(columnas, filas, filas_por_bloque):
+    lineas = []
+    for fila in filas:
+        lineas.append(json.dumps(dict(zip(columnas, (_valor(v) for v in fila))), ensure_ascii=False))
+        if len(lineas) >= filas_por_bloque:
+            yield ('\n'.join(lineas) + '\n').encode('utf-8')
+            lineas = []
+    if lineas:
+        yield ('\n'.join(lineas) + '\n').encode('utf-8')
+
+
+def _comprimir(bloques):
+    """Comprime en formato gzip bloque a bloque"""
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for bloque in bloques:
+        comprimido = compresor.compress(bloque)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+
+def respuesta_exportacion(nombre, columnas, filas, formato='csv', comprimir=False,
+                          filas_por_bloque=FILAS_POR_BLOQUE):
+    """
+    Respuesta HTTP que escribe las filas en streaming como descarga.
+    `filas` debe ser un iterable perezoso (por ejemplo `filas_en_streaming`).
+    """
+    if formato not in FORMATOS:
+        formato = 'csv'
+    generador = _bloques_csv if formato == 'csv' else _bloques_ndjson
+    bloques = generador(columnas, filas, filas_por_bloque)
+    archivo = f'{nombre}.{formato}'
+    tipo = FORMATOS[formato]
+    if comprimir:
+        bloques = _comprimir(bloques)
+        archivo += '.gz'
+        tipo = 'application/gzip'
+
+    response = Response(stream_with_context(bloques), content_type=tipo)
+    response.headers['Content-Disposition'] = f'attachment; filename="{archivo}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def parametros_exportacion(args):
+    """Lee `formato` y `gzip` de los parámetros de la petición"""
+    formato = args.get('formato', 'csv').lower()
+    comprimir = args.get('gzip', '').lower() in ('1', 'true', 'si', 'sí')
+    return formato, comprimir
@@ -167,6 +167,9 @@ class VentaForm(FlaskForm):
     detalles_venta = HiddenField('Detalles de la Venta', validators=[
         DataRequired(message='Debes agregar al menos un producto a la venta')
     ])
+    
+    # Clave única por formulario: un doble envío no registra la venta dos veces
+    clave_idempotencia = HiddenField('Clave de la Venta', validators=[Optional(), Length(max=64)])
 
 
 class ClienteForm(FlaskForm):
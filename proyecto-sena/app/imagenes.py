@@ -0,0 +1,134 @@
+"""
+Derivados redimensionados de las imágenes de productos.
+
+Al subir una imagen se generan, en un pool de hilos fuera de la petición,
+versiones de los anchos usados por las plantillas en el formato original y
+en WebP. Las plantillas los piden con `srcset_imagen` y, mientras no existan
+(o si Pillow no está instalado), se sigue mostrando la imagen original.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, url_for
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow es opcional: sin él solo se sirven los originales
+    Image = None
+
+# Anchos en píxeles (1x y 2x) de cada uso de la imagen en las plantillas
+ANCHOS = {
+    'miniatura': (40, 80),
+    'detalle': (400, 800),
+}
+CARPETA_DERIVADOS = 'derivados'
+
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='imagenes')
+
+
+def carpeta_uploads():
+    return os.path.join(current_app.root_path, 'static/uploads')
+
+
+def _formato_respaldo(nombre):
+    """Formato de los derivados no WebP: JPEG para fotos, PNG para el resto (transparencias)"""
+    extension = os.path.splitext(nombre)[1].lower()
+    if extension in ('.jpg', '.jpeg'):
+        return 'jpg'
+    if extension == '.webp':
+        return None
+    return 'png'
+
+
+def nombre_derivado(nombre, ancho, formato):
+    base = os.path.splitext(nombre)[0]
+    return f'{CARPETA_DERIVADOS}/{base}_{ancho}.{formato}'
+
+
+def _formatos(nombre):
+    return [f for f in ('webp', _formato_respaldo(nombre)) if f]
+
+
+def generar_derivados(carpeta, nombre):
+    """Genera los derivados de una imagen. Devuelve cuántos archivos se escribieron."""
+    if Image is None:
+        return 0
+    ruta_original = os.path.join(carpeta, nombre)
+    escritos = 0
+    with Image.open(ruta_original) as original:
+        original.load()
+        anchos = sorted({a for par in ANCHOS.values() for a in par})
+        for ancho in anchos:
+            # No ampliar imágenes más pequeñas que el ancho pedido
+            if ancho >= original.width:
+                continue
+            alto = max(1, round(original.height * ancho / original.width))
+            reducida = original.resize((ancho, alto), Image.LANCZOS)
+            for formato in _formatos(nombre):
+                destino = os.path.join(carpeta, nombre_derivado(nombre, ancho, formato))
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                imagen = reducida
+                if formato == 'jpg' and imagen.mode != 'RGB':
+                    imagen = imagen.convert('RGB')
+                elif formato == 'png' and imagen.mode == 'P':
+                    imagen = imagen.convert('RGBA')
+                # Escribir en un temporal y renombrar para no servir archivos a medias
+                temporal = destino + '.tmp'
+                imagen.save(temporal, format='JPEG' if formato == 'jpg' else formato.upper(),
+                            quality=82, optimize=True)
+                os.replace(temporal, destino)
+                escritos += 1
+    return escritos
+
+
+def generar_en_lote(carpeta, nombres):
+    """Genera en el pool los derivados de varias imágenes y espera a que terminen"""
+    return sum(_pool.map(lambda nombre: generar_derivados(carpeta, nombre), nombres))
+
+
+def programar_derivados(nombre):
+    """Encola la generación de derivados sin bloquear la petición"""
+    if Image is None or not nombre:
+        return None
+    app = current_app._get_current_object()
+    carpeta = carpeta_uploads()
+
+    def tarea():
+        try:
+            return generar_derivados(carpeta, nombre)
+        except Exception as e:
+            app.logger.error(f'Error al generar derivados de {nombre}: {str(e)}')
+            return 0
+
+    return _pool.submit(tarea)
+
+
+def eliminar_derivados(nombre):
+    if not nombre:
+        return
+    carpeta = carpeta_uploads()
+    for anchos in ANCHOS.values():
+        for ancho in anchos:
+            for formato in _formatos(nombre):
+                try:
+                    os.remove(os.path.join(carpeta, nombre_derivado(nombre, ancho, formato)))
+                except OSError:
+                    pass
+
+
+def srcset_imagen(nombre, uso, formato=None):
+    """
+    Valor de `srcset` con los derivados existentes de la imagen para el uso indicado
+    ('miniatura' o 'detalle'). Devuelve '' si todavía no hay derivados.
+    """
+    if not nombre:
+        return ''
+    formato = formato or _formato_respaldo(nombre)
+    if formato is None:
+        return ''
+    carpeta = carpeta_uploads()
+    candidatos = []
+    for ancho in ANCHOS[uso]:
+        derivado = nombre_derivado(nombre, ancho, formato)
+        if os.path.exists(os.path.join(carpeta, derivado)):
+            candidatos.append(f"{url_for('static', filename='uploads/' + derivado)} {ancho}w")
+    return ', '.join(candidatos)
@@ -0,0 +1,178 @@
+"""
+Importación masiva de productos desde CSV.
+
+El archivo se lee fila a fila; las filas válidas se agrupan en lotes y cada
+lote se guarda con un INSERT que actualiza los productos existentes por
+`codigo` (ON DUPLICATE KEY UPDATE en MySQL, ON CONFLICT en SQLite). La
+memoria usada no depende del tamaño del archivo: solo se guarda el lote en
+curso y, como mucho, `MAX_ERRORES` errores detallados.
+"""
+import csv
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db, kardex
+from app.models import Producto, Generacion
+
+TAMANO_LOTE = 1000
+MAX_ERRORES = 1000
+
+CATEGORIAS = ('Tenis', 'Pádel', 'Accesorios')
+# Precios en Numeric(10, 2)
+CENTAVO = Decimal('0.01')
+PRECIO_MAXIMO = Decimal('99999999.99')
+# Columnas INT de stock
+ENTERO_MAXIMO = 2**31 - 1
+LONGITUDES = {'codigo': 20, 'nombre': 100, 'descripcion': 500, 'marca': 50, 'talla': 10, 'color': 30}
+
+# Columnas que se sobrescriben cuando el código ya existe
+ACTUALIZABLES = ('nombre', 'descripcion', 'precio_compra', 'precio_venta', 'stock', 'stock_minimo',
+                 'categoria', 'marca', 'talla', 'color', 'actualizado_en')
+
+
+class FilaInvalida(ValueError):
+    pass
+
+
+def _texto(fila, campo, requerido=False):
+    valor = (fila.get(campo) or '').strip()
+    if requerido and not valor:
+        raise FilaInvalida(f'El campo {campo} es requerido')
+    if len(valor) > LONGITUDES[campo]:
+        raise FilaInvalida(f'El campo {campo} no puede tener más de {LONGITUDES[campo]} caracteres')
+    return valor or None
+
+
+def _decimal(fila, campo):
+    try:
+        valor = Decimal((fila.get(campo) or '').strip())
+        # NaN e Infinity se leen como Decimal pero fallan al compararlos o redondearlos
+        if not valor.is_finite():
+            raise InvalidOperation
+        if valor < 0:
+            raise FilaInvalida(f'El campo {campo} no puede ser negativo')
+        if valor > PRECIO_MAXIMO:
+            raise FilaInvalida(f'El campo {campo} no puede ser mayor que {PRECIO_MAXIMO}')
+        return valor.quantize(CENTAVO)
+    except InvalidOperation:
+        raise FilaInvalida(f'El campo {campo} debe ser un número')
+
+
+def _entero(fila, campo, por_defecto):
+    texto = (fila.get(campo) or '').strip()
+    if not texto:
+        return por_defecto
+    try:
+        valor = int(texto)
+    except ValueError:
+        raise FilaInvalida(f'El campo {campo} debe ser un número entero')
+    if valor < 0:
+        raise FilaInvalida(f'El campo {campo} no puede ser negativo')
+    if valor > ENTERO_MAXIMO:
+        raise FilaInvalida(f'El campo {campo} no puede ser mayor que {ENTERO_MAXIMO}')
+    return valor
+
+
+def validar_fila(fila, ahora):
+    """Convierte una fila del CSV en los valores de un producto o lanza FilaInvalida"""
+    categoria = (fila.get('categoria') or '').strip()
+    if categoria not in CATEGORIAS:
+        raise FilaInvalida(f'Categoría no válida: {categoria!r}')
+    return {
+        'codigo': _texto(fila, 'codigo', requerido=True),
+        'nombre': _texto(fila, 'nombre', requerido=True),
+        'descripcion': _texto(fila, 'descripcion'),
+        'precio_compra': _decimal(fila, 'precio_compra'),
+        'precio_venta': _decimal(fila, 'precio_venta'),
+        'stock': _entero(fila, 'stock', 0),
+        'stock_minimo': _entero(fila, 'stock_minimo', 5),
+        'categoria': categoria,
+        'marca': _texto(fila, 'marca'),
+        'talla': _texto(fila, 'talla'),
+        'color': _texto(fila, 'color'),
+        'activo': True,
+        'creado_en': ahora,
+        'actualizado_en': ahora,
+    }
+
+
+def _sentencia_upsert():
+    """INSERT ... ON DUPLICATE KEY UPDATE / ON CONFLICT sin valores, para compilarla una sola vez"""
+    tabla = Producto.__table__
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto == 'mysql':
+        sentencia = mysql_insert(tabla)
+        return sentencia.on_duplicate_key_update(
+            {columna: sentencia.inserted[columna] for columna in ACTUALIZABLES})
+    if dialecto == 'sqlite':
+        sentencia = sqlite_insert(tabla)
+        return sentencia.on_conflict_do_update(
+            index_elements=['codigo'],
+            set_={columna: sentencia.excluded[columna] for columna in ACTUALIZABLES})
+    raise RuntimeError(f'Importación no soportada para {dialecto}')
+
+
+def _upsert(filas):
+    """
+    Inserta o actualiza un lote de productos. La sentencia compilada se reutiliza
+    entre lotes; PyMySQL la envía como un único INSERT de varias filas.
+    """
+    db.session.execute(_sentencia_upsert(), filas)
+
+
+def importar_csv(texto, tamano_lote=TAMANO_LOTE):
+    """
+    Importa productos desde un archivo de texto CSV con cabecera.
+    Cada lote se confirma por separado; devuelve un informe con los errores por fila.
+    """
+    informe = {'filas': 0, 'guardadas': 0, 'errores': [], 'errores_omitidos': 0}
+    ahora = datetime.utcnow()
+    lote = {}
+
+    def guardar_lote():
+        if lote:
+            codigos = list(lote)
+            # Stock antes del upsert para anotar la diferencia en el kardex
+            anteriores = {
+                codigo: (producto_id, stock or 0) for codigo, producto_id, stock in db.session.execute(
+                    select(Producto.codigo, Producto.id, Producto.stock).where(Producto.codigo.in_(codigos)))
+            }
+            _upsert(list(lote.values()))
+            nuevos = [codigo for codigo in codigos if codigo not in anteriores]
+            ids_nuevos = dict(db.session.execute(
+                select(Producto.codigo, Producto.id).where(Producto.codigo.in_(nuevos))).all()) if nuevos else {}
+            diferencias = {producto_id: lote[codigo]['stock'] - stock
+                           for codigo, (producto_id, stock) in anteriores.items()}
+            diferencias.update({ids_nuevos[codigo]: lote[codigo]['stock'] for codigo in ids_nuevos})
+            kardex.registrar('importacion', diferencias, notas='Importación CSV')
+            Generacion.incrementar('ventas')
+            db.session.commit()
+            informe['guardadas'] += len(lote)
+            lote.clear()
+
+    lector = csv.DictReader(texto)
+    faltantes = {'codigo', 'nombre', 'precio_compra', 'precio_venta', 'categoria'} - set(lector.fieldnames or [])
+    if faltantes:
+        informe['errores'].append({'fila': 1, 'error': f"Faltan columnas: {', '.join(sorted(faltantes))}"})
+        return informe
+
+    # La fila 1 es la cabecera
+    for numero, fila in enumerate(lector, start=2):
+        informe['filas'] += 1
+        try:
+            valores = validar_fila(fila, ahora)
+        except FilaInvalida as e:
+            if len(informe['errores']) < MAX_ERRORES:
+                informe['errores'].append({'fila': numero, 'codigo': fila.get('codigo'), 'error': str(e)})
+            else:
+                informe['errores_omitidos'] += 1
+            continue
+        # Un mismo código repetido dentro del lote: gana la última fila
+        lote[valores['codigo']] = valores
+        if len(lote) >= tamano_lote:
+            guardar_lote()
+
+    guardar_lote()
+    return informe
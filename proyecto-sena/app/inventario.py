@@ -0,0 +1,102 @@
+"""
+Movimientos de stock atómicos.
+
+El stock nunca se modifica leyendo el producto y guardándolo de nuevo (eso
+pierde actualizaciones cuando varias cajas venden el mismo producto a la
+vez). Se usa un UPDATE condicional que la base de datos resuelve de forma
+atómica:
+
+    UPDATE productos SET stock = stock - :n WHERE id = :id AND stock >= :n
+
+Si no actualiza todas las filas pedidas es que no había stock suficiente.
+"""
+from collections import defaultdict
+from sqlalchemy import case, update
+from app import db
+from app.models import Producto
+
+
+class StockInsuficiente(Exception):
+    """Una o más líneas piden más unidades de las disponibles"""
+
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        super().__init__('; '.join(f['mensaje'] for f in faltantes))
+
+
+class _SinStock(Exception):
+    pass
+
+
+def agrupar_cantidades(lineas):
+    """Suma las cantidades por producto de una lista de (producto_id, cantidad)"""
+    cantidades = defaultdict(int)
+    for producto_id, cantidad in lineas:
+        cantidades[int(producto_id)] += int(cantidad)
+    return dict(cantidades)
+
+
+def descontar_stock(cantidades):
+    """
+    Descuenta {producto_id: cantidad} dentro de la transacción actual (sin commit)
+    con un único UPDATE para todos los productos:
+
+        UPDATE productos SET stock = stock - CASE id WHEN .. THEN .. END
+        WHERE id IN (..) AND stock >= CASE id WHEN .. THEN .. END
+
+    Si alguna fila no cumple la condición no se descuenta nada y se lanza
+    StockInsuficiente con el detalle de cada línea.
+    """
+    cantidades = {producto_id: cantidad for producto_id, cantidad in cantidades.items() if cantidad > 0}
+    if not cantidades:
+        return
+    solicitada = case(cantidades, value=Producto.id)
+    try:
+        # SAVEPOINT: si falta stock se deshacen los productos que sí se descontaron,
+        # sin perder el resto de la transacción (p. ej. otras ventas de un lote)
+        with db.session.begin_nested():
+            resultado = db.session.execute(
+                update(Producto)
+                .where(Producto.id.in_(list(cantidades)), Producto.stock >= solicitada)
+                .values(stock=Producto.stock - solicitada)
+                .execution_options(synchronize_session=False)
+            )
+            if resultado.rowcount != len(cantidades):
+                raise _SinStock()
+    except _SinStock:
+        raise StockInsuficiente(_faltantes(cantidades))
+
+
+def reponer_stock(cantidades):
+    """Devuelve {producto_id: cantidad} al stock (sin commit), p. ej. al anular una venta"""
+    cantidades = {producto_id: cantidad for producto_id, cantidad in cantidades.items() if cantidad > 0}
+    if not cantidades:
+        return
+    db.session.execute(
+        update(Producto)
+        .where(Producto.id.in_(list(cantidades)))
+        .values(stock=Producto.stock + case(cantidades, value=Producto.id))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _faltantes(cantidades):
+    productos = {
+        p.id: p for p in db.session.query(Producto.id, Producto.nombre, Producto.stock)
+        .filter(Producto.id.in_(list(cantidades)))
+    }
+    lineas = []
+    for producto_id in sorted(cantidades):
+        producto = productos.get(producto_id)
+        nombre = producto.nombre if producto else f'#{producto_id}'
+        disponible = producto.stock if producto else 0
+        lineas.append({
+            'producto_id': producto_id,
+            'nombre': nombre,
+            'solicitado': cantidades[producto_id],
+            'disponible': disponible,
+            'mensaje': f'Stock insuficiente para {nombre}: '
+                       f'solicitado {cantidades[producto_id]}, disponible {disponible}',
+        })
+    # Si entretanto alguien repuso stock, informar de todas las líneas
+    return [l for l in lineas if l['disponible'] < l['solicitado']] or lineas
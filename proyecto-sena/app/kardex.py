@@ -0,0 +1,152 @@
+"""
+Kardex: historial de movimientos de inventario de solo inserción.
+
+Cada cambio de `Producto.stock` (venta, anulación, ajuste, edición,
+importación, alta) añade filas a `movimientos_inventario` en la misma
+transacción que el cambio de stock, con un único INSERT de varias filas.
+
+Para no recorrer todo el historial, `cerrar_saldos` (programado a diario
+con cron) guarda en `saldos_inventario` el saldo de cada producto al cierre
+de un día. El stock a una fecha se obtiene con el último cierre anterior más
+los movimientos posteriores, que usan el índice (producto_id, fecha).
+"""
+from datetime import datetime, time, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+from app import db, inventario
+from app.models import MovimientoInventario, SaldoInventario, Producto
+
+
+def registrar(tipo, cantidades, venta_id=None, usuario_id=None, notas=None):
+    """Añade un movimiento por cada {producto_id: cantidad con signo} distinta de cero (sin commit)"""
+    ahora = datetime.utcnow()
+    filas = [
+        {'producto_id': producto_id, 'fecha': ahora, 'tipo': tipo, 'cantidad': cantidad,
+         'venta_id': venta_id, 'usuario_id': usuario_id, 'notas': notas}
+        for producto_id, cantidad in cantidades.items() if cantidad
+    ]
+    if filas:
+        db.session.execute(insert(MovimientoInventario), filas)
+
+
+def ajustar(producto_id, cantidad, usuario_id=None, notas=None):
+    """
+    Suma `cantidad` (con signo) al stock de forma atómica y lo anota en el
+    kardex (sin commit). Lanza inventario.StockInsuficiente si el stock
+    quedaría negativo.
+    """
+    if cantidad < 0:
+        inventario.descontar_stock({producto_id: -cantidad})
+    else:
+        inventario.reponer_stock({producto_id: cantidad})
+    registrar('ajuste', {producto_id: cantidad}, usuario_id=usuario_id, notas=notas)
+
+
+def conciliar(usuario_id=None):
+    """
+    Añade un movimiento de apertura a los productos cuyo kardex no suma su
+    stock actual (productos anteriores al kardex o datos cargados a mano).
+    Devuelve cuántos productos se ajustaron.
+    """
+    sumas = dict(db.session.execute(
+        select(MovimientoInventario.producto_id, func.sum(MovimientoInventario.cantidad))
+        .group_by(MovimientoInventario.producto_id)
+    ).all())
+    diferencias = {
+        producto_id: (stock or 0) - int(sumas.get(producto_id) or 0)
+        for producto_id, stock in db.session.execute(select(Producto.id, Producto.stock))
+    }
+    diferencias = {producto_id: d for producto_id, d in diferencias.items() if d}
+    registrar('apertura', diferencias, usuario_id=usuario_id, notas='Saldo inicial del kardex')
+    return len(diferencias)
+
+
+# ================================
+# SALDOS
+# ================================
+
+def _ultimo_cierre(antes_de):
+    """Último día cerrado cuyo final (medianoche siguiente) no pasa de `antes_de`"""
+    return db.session.query(func.max(SaldoInventario.fecha)).filter(
+        SaldoInventario.fecha <= (antes_de - timedelta(days=1)).date()
+    ).scalar()
+
+
+def saldos(antes_de, producto_ids=None):
+    """
+    Stock de los productos justo antes del instante `antes_de` (exclusivo):
+    saldo del último cierre + movimientos desde ese cierre. Devuelve
+    {producto_id: saldo}; con `producto_ids` solo esos productos.
+    """
+    cierre = _ultimo_cierre(antes_de)
+    resultado = {}
+    movimientos = select(
+        MovimientoInventario.producto_id, func.sum(MovimientoInventario.cantidad)
+    ).where(MovimientoInventario.fecha < antes_de)
+    if cierre is not None:
+        base = select(SaldoInventario.producto_id, SaldoInventario.saldo).where(SaldoInventario.fecha == cierre)
+        if producto_ids is not None:
+            base = base.where(SaldoInventario.producto_id.in_(producto_ids))
+        resultado = dict(db.session.execute(base).all())
+        movimientos = movimientos.where(
+            MovimientoInventario.fecha >= datetime.combine(cierre + timedelta(days=1), time.min))
+    if producto_ids is not None:
+        movimientos = movimientos.where(MovimientoInventario.producto_id.in_(producto_ids))
+    for producto_id, suma in db.session.execute(movimientos.group_by(MovimientoInventario.producto_id)):
+        resultado[producto_id] = resultado.get(producto_id, 0) + int(suma or 0)
+    return resultado
+
+
+def stock_al_cierre(producto_id, dia):
+    """Stock de un producto al final del día `dia`"""
+    return saldos(datetime.combine(dia + timedelta(days=1), time.min), [producto_id]).get(producto_id, 0)
+
+
+def cerrar_saldos(dia=None):
+    """
+    Guarda el saldo de todos los productos con movimientos al cierre de `dia`
+    (por defecto el último día UTC, la zona de las fechas de los movimientos,
+    que ya se puede cerrar). Parte del cierre anterior, así que solo suma los
+    movimientos desde él. Devuelve el número de saldos guardados.
+
+    Un movimiento lleva la hora en que se anotó, no la de su commit: uno de las
+    23:59 puede confirmarse después de medianoche. Por eso un día solo se cierra
+    cuando han pasado KARDEX_MARGEN_CIERRE_MINUTOS desde su final; un cierre
+    anterior dejaría fuera ese movimiento para siempre. Lanza ValueError si `dia`
+    todavía no se puede cerrar.
+    """
+    margen = timedelta(minutes=current_app.config.get('KARDEX_MARGEN_CIERRE_MINUTOS', 60))
+    limite = datetime.utcnow() - margen
+    dia = dia or limite.date() - timedelta(days=1)
+    fin_del_dia = datetime.combine(dia + timedelta(days=1), time.min)
+    if fin_del_dia > limite:
+        raise ValueError(f'El día {dia} no se puede cerrar hasta las {fin_del_dia + margen:%Y-%m-%d %H:%M} UTC')
+    resultado = saldos(fin_del_dia)
+    db.session.execute(delete(SaldoInventario).where(SaldoInventario.fecha == dia))
+    if resultado:
+        db.session.execute(insert(SaldoInventario), [
+            {'fecha': dia, 'producto_id': producto_id, 'saldo': saldo}
+            for producto_id, saldo in resultado.items()
+        ])
+    db.session.commit()
+    return len(resultado)
+
+
+def movimientos(producto_id, desde, hasta):
+    """
+    Kardex de un producto entre los días [desde, hasta]: (saldo inicial,
+    movimientos con el saldo tras cada uno, saldo final).
+    """
+    inicio = datetime.combine(desde, time.min)
+    fin = datetime.combine(hasta + timedelta(days=1), time.min)
+    saldo = saldos(inicio, [producto_id]).get(producto_id, 0)
+    saldo_inicial = saldo
+    filas = []
+    for movimiento in MovimientoInventario.query.filter(
+        MovimientoInventario.producto_id == producto_id,
+        MovimientoInventario.fecha >= inicio,
+        MovimientoInventario.fecha < fin,
+    ).order_by(MovimientoInventario.fecha, MovimientoInventario.id):
+        saldo += movimiento.cantidad
+        filas.append((movimiento, saldo))
+    return saldo_inicial, filas, saldo
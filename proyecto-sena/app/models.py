@@ -1,7 +1,11 @@
+from collections import namedtuple
 from datetime import datetime
 from flask_login import UserMixin
+from sqlalchemy.dialects.mysql import LONGTEXT, insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db, login_manager
+from app.cache import cache_configuracion, cache_usuarios
 
 class Usuario(UserMixin, db.Model):
     __tablename__ = 'usuarios'
@@ -29,12 +33,41 @@ class Usuario(UserMixin, db.Model):
     def __repr__(self):
         return f'<Usuario {self.nombre_usuario}>'
 
+
+class UsuarioSesion(UserMixin, namedtuple('UsuarioSesion', 'id nombre_usuario email es_admin activo')):
+    """
+    Copia de solo lectura del usuario en sesión (`current_user`). Las rutas que
+    modifican al usuario cargan el objeto Usuario con su id.
+    """
+    __slots__ = ()
+
+
+def invalidar_usuario(id):
+    """Descarta la copia en caché del usuario de este proceso tras modificarlo"""
+    cache_usuarios.invalidar(int(id))
+
+
+def _cargar_usuario_sesion(id):
+    fila = db.session.query(
+        Usuario.id, Usuario.nombre_usuario, Usuario.email, Usuario.es_admin, Usuario.activo
+    ).filter(Usuario.id == id).first()
+    return UsuarioSesion(*fila) if fila else None
+
+
 @login_manager.user_loader
 def load_user(id):
-    return Usuario.query.get(int(id))
+    # Sin consulta mientras la copia en caché siga vigente; los usuarios
+    # desactivados o eliminados pierden la sesión al caducar la copia
+    usuario = cache_usuarios.obtener(int(id), lambda: _cargar_usuario_sesion(int(id)))
+    return usuario if usuario is not None and usuario.activo is not False else None
 
 class Producto(db.Model):
     __tablename__ = 'productos'
+    __table_args__ = (
+        # Índices para la paginación por cursor de los listados
+        db.Index('ix_productos_nombre_id', 'nombre', 'id'),
+        db.Index('ix_productos_stock_id', 'stock', 'id'),
+    )
     
     # Usar atributo moderno `id` mapeado a la columna real `productos.id`
     id = db.Column('id', db.Integer, primary_key=True)
@@ -52,7 +85,7 @@ class Producto(db.Model):
     imagen = db.Column(db.String(100))
     activo = db.Column(db.Boolean, default=True)
     creado_en = db.Column(db.DateTime, default=datetime.utcnow)
-    actualizado_en = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    actualizado_en = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relaciones
     detalles_venta = db.relationship('DetalleVenta', backref='producto', lazy='dynamic')
@@ -63,24 +96,37 @@ class Producto(db.Model):
 
 class Venta(db.Model):
     __tablename__ = 'ventas'
+    __table_args__ = (
+        # Índice cubriente para filtros por rango de fechas con totales por estado y método de pago
+        db.Index('ix_ventas_fecha_estado_pago_total', 'fecha', 'estado', 'metodo_pago', 'total'),
+        # Orden estable (fecha, id) para la paginación por cursor
+        db.Index('ix_ventas_fecha_id', 'fecha', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    fecha = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow)
     total = db.Column(db.Numeric(10, 2), nullable=False)
     estado = db.Column(db.Enum('pendiente', 'completada', 'cancelada', 'anulada'))
     metodo_pago = db.Column(db.Enum('efectivo', 'tarjeta', 'transferencia'))
     notas = db.Column(db.Text)
     usuario_id = db.Column(db.Integer)
     cliente_id = db.Column(db.Integer)
+    # Clave enviada por el punto de venta para que un reintento no duplique la venta
+    clave_idempotencia = db.Column(db.String(64), unique=True)
     
-    # Relaciones
-    detalles = db.relationship('DetalleVenta', backref='venta', lazy='dynamic', cascade='all, delete-orphan')
+    # Relaciones (colección normal para poder cargarla con selectinload)
+    detalles = db.relationship('DetalleVenta', backref='venta', lazy='select', cascade='all, delete-orphan',
+                               order_by='DetalleVenta.id')
     
     def __repr__(self):
         return f'<Venta {self.id} - {self.fecha}>'
 
 class DetalleVenta(db.Model):
     __tablename__ = 'detalle_ventas'
+    __table_args__ = (
+        # Índice cubriente para los joins venta -> detalles de los reportes
+        db.Index('ix_detalle_ventas_venta_producto', 'venta_id', 'producto_id', 'cantidad', 'subtotal'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     # Mapear a columnas existentes en BD usando nombres de atributo modernos
@@ -93,6 +139,164 @@ class DetalleVenta(db.Model):
         return f'<DetalleVenta {self.id}>'
 
 
+class ResumenVentaDiaria(db.Model):
+    """Acumulado diario de ventas (una fila por día, método de pago y estado)"""
+    __tablename__ = 'resumen_ventas_diarias'
+    __table_args__ = (
+        db.UniqueConstraint('fecha', 'metodo_pago', 'estado', name='uq_resumen_venta_diaria'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.Date, nullable=False, index=True)
+    metodo_pago = db.Column(db.Enum('efectivo', 'tarjeta', 'transferencia'))
+    estado = db.Column(db.Enum('pendiente', 'completada', 'cancelada', 'anulada'))
+    num_ventas = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ResumenVentaDiaria {self.fecha} {self.metodo_pago} {self.estado}>'
+
+
+class ResumenProductoDiario(db.Model):
+    """Acumulado diario de unidades vendidas por producto, categoría, método de pago y estado"""
+    __tablename__ = 'resumen_productos_diarios'
+    __table_args__ = (
+        db.UniqueConstraint('fecha', 'producto_id', 'metodo_pago', 'estado', name='uq_resumen_producto_diario'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.Date, nullable=False, index=True)
+    producto_id = db.Column(db.Integer, db.ForeignKey('productos.id'), nullable=False)
+    categoria = db.Column(db.Enum('Tenis', 'Pádel', 'Accesorios'))
+    metodo_pago = db.Column(db.Enum('efectivo', 'tarjeta', 'transferencia'))
+    estado = db.Column(db.Enum('pendiente', 'completada', 'cancelada', 'anulada'))
+    num_lineas = db.Column(db.Integer, nullable=False, default=0)
+    cantidad = db.Column(db.Integer, nullable=False, default=0)
+    subtotal = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ResumenProductoDiario {self.fecha} producto={self.producto_id}>'
+
+
+class MovimientoInventario(db.Model):
+    """
+    Kardex: cada cambio de stock de un producto como una fila que nunca se
+    modifica ni se borra. `cantidad` lleva signo (negativa en ventas).
+    """
+    __tablename__ = 'movimientos_inventario'
+    __table_args__ = (
+        db.Index('ix_movimientos_producto_fecha', 'producto_id', 'fecha', 'id'),
+        db.Index('ix_movimientos_fecha', 'fecha'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Sin clave foránea: el historial se conserva aunque se elimine el producto
+    producto_id = db.Column(db.Integer, nullable=False)
+    fecha = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    tipo = db.Column(db.Enum('apertura', 'alta', 'venta', 'anulacion', 'ajuste', 'edicion', 'importacion'),
+                     nullable=False)
+    cantidad = db.Column(db.Integer, nullable=False)
+    venta_id = db.Column(db.Integer)
+    usuario_id = db.Column(db.Integer)
+    notas = db.Column(db.String(255))
+
+    def __repr__(self):
+        return f'<MovimientoInventario {self.tipo} producto={self.producto_id} {self.cantidad:+d}>'
+
+
+class SaldoInventario(db.Model):
+    """Saldo de cada producto al cierre de un día, calculado a partir del kardex"""
+    __tablename__ = 'saldos_inventario'
+
+    fecha = db.Column(db.Date, primary_key=True)
+    producto_id = db.Column(db.Integer, primary_key=True)
+    saldo = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<SaldoInventario {self.fecha} producto={self.producto_id}: {self.saldo}>'
+
+
+class ReposicionProducto(db.Model):
+    """
+    Punto de reorden, días de cobertura y cantidad sugerida de cada producto,
+    calculados por lotes en app.reposicion a partir del historial de ventas
+    """
+    __tablename__ = 'reposicion_productos'
+    __table_args__ = (
+        # Listado de productos a reponer ordenados por urgencia
+        db.Index('ix_reposicion_necesita_prioridad', 'necesita_reposicion', 'prioridad', 'producto_id'),
+    )
+
+    # Sin clave foránea (como el kardex): eliminar un producto no depende de su cálculo
+    producto_id = db.Column(db.Integer, primary_key=True)
+    demanda_diaria = db.Column(db.Float, nullable=False, default=0)
+    desviacion_diaria = db.Column(db.Float, nullable=False, default=0)
+    # None cuando el producto no tiene demanda en la ventana
+    dias_cobertura = db.Column(db.Float)
+    stock_seguridad = db.Column(db.Integer, nullable=False, default=0)
+    punto_reorden = db.Column(db.Integer, nullable=False, default=0)
+    cantidad_sugerida = db.Column(db.Integer, nullable=False, default=0)
+    # Stock con el que se hizo el cálculo
+    stock = db.Column(db.Integer, nullable=False, default=0)
+    necesita_reposicion = db.Column(db.Boolean, nullable=False, default=False)
+    # Menor = más urgente: días de cobertura, o PRIORIDAD_SIN_DEMANDA + stock
+    prioridad = db.Column(db.Float, nullable=False)
+    calculado_en = db.Column(db.DateTime, default=datetime.utcnow)
+
+    producto = db.relationship('Producto', primaryjoin='foreign(ReposicionProducto.producto_id) == Producto.id')
+
+    def __repr__(self):
+        return f'<ReposicionProducto {self.producto_id} cobertura={self.dias_cobertura}>'
+
+
+class ArchivoSubido(db.Model):
+    """Archivo subido guardado una sola vez según su hash SHA-256"""
+    __tablename__ = 'archivos_subidos'
+
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(64), unique=True, nullable=False)
+    # Ruta relativa a static/uploads (la que se guarda en Producto.imagen)
+    nombre = db.Column(db.String(100), unique=True, nullable=False)
+    tamano = db.Column(db.Integer, nullable=False)
+    referencias = db.Column(db.Integer, nullable=False, default=0)
+    creado_en = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ArchivoSubido {self.nombre} refs={self.referencias}>'
+
+
+class TrabajoReporte(db.Model):
+    """
+    Reporte calculado en segundo plano. `clave` resume el tipo, el rango, los
+    filtros y la versión de los datos: mientras no cambien, el resultado guardado
+    se reutiliza sin volver a calcularlo.
+    """
+    __tablename__ = 'trabajos_reporte'
+    __table_args__ = (
+        db.Index('ix_trabajos_reporte_tipo_rango', 'tipo', 'inicio', 'fin'),
+    )
+
+    id = db.Column(db.String(32), primary_key=True)
+    clave = db.Column(db.String(40), unique=True, nullable=False)
+    tipo = db.Column(db.String(30), nullable=False)
+    inicio = db.Column(db.Date, nullable=False)
+    fin = db.Column(db.Date, nullable=False)
+    filtros = db.Column(db.String(200), nullable=False, default='{}')
+    version = db.Column(db.String(100), nullable=False)
+    estado = db.Column(db.Enum('pendiente', 'en_proceso', 'terminado', 'error'),
+                       nullable=False, default='pendiente')
+    resultado = db.Column(db.Text().with_variant(LONGTEXT(), 'mysql'))
+    error = db.Column(db.String(500))
+    # Sin clave foránea, como ventas.usuario_id: eliminar un usuario no depende de sus reportes
+    usuario_id = db.Column(db.Integer)
+    creado_en = db.Column(db.DateTime, default=datetime.utcnow)
+    iniciado_en = db.Column(db.DateTime)
+    terminado_en = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<TrabajoReporte {self.id} {self.tipo} {self.estado}>'
+
+
 class Configuracion(db.Model):
     __tablename__ = 'configuraciones'
     
@@ -103,19 +307,65 @@ class Configuracion(db.Model):
     
     @staticmethod
     def get_config(clave, valor_por_defecto=None):
-        config = Configuracion.query.filter_by(clave=clave).first()
-        return config.valor if config else valor_por_defecto
+        """
+        Lee un valor de la copia en memoria de toda la tabla. Solo consulta la
+        base de datos para revisar la generación 'configuracion' (como mucho
+        cada CONFIGURACION_REVISION_SEGUNDOS) y para recargar si cambió.
+        """
+        valores = cache_configuracion.obtener(
+            lambda: Generacion.obtener('configuracion'),
+            lambda: dict(db.session.query(Configuracion.clave, Configuracion.valor).all()))
+        valor = valores.get(clave)
+        return valor if valor is not None else valor_por_defecto
     
     @staticmethod
     def set_config(clave, valor, descripcion=''):
+        """Guarda el valor y sube la generación para que los demás procesos recarguen"""
         config = Configuracion.query.filter_by(clave=clave).first()
         if config:
             config.valor = valor
         else:
             config = Configuracion(clave=clave, valor=valor, descripcion=descripcion)
             db.session.add(config)
+        Generacion.incrementar('configuracion')
         db.session.commit()
+        cache_configuracion.invalidar()
         return config
     
     def __repr__(self):
         return f'<Configuracion {self.clave}={self.valor}>'
+
+
+class Generacion(db.Model):
+    """Contadores de versión compartidos por todos los procesos para invalidar cachés"""
+    __tablename__ = 'generaciones'
+
+    clave = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def obtener(clave):
+        return db.session.query(Generacion.valor).filter_by(clave=clave).scalar() or 0
+
+    @staticmethod
+    def incrementar(clave):
+        """
+        Incrementa el contador dentro de la transacción actual (no hace commit).
+        Un único INSERT que suma 1 si la clave ya existe, para que dos procesos
+        que crean a la vez el mismo contador no choquen con la clave primaria.
+        """
+        tabla = Generacion.__table__
+        dialecto = db.session.get_bind().dialect.name
+        if dialecto == 'mysql':
+            sentencia = mysql_insert(tabla).values(clave=clave, valor=1)
+            sentencia = sentencia.on_duplicate_key_update(valor=tabla.c.valor + 1)
+        elif dialecto == 'sqlite':
+            sentencia = sqlite_insert(tabla).values(clave=clave, valor=1)
+            sentencia = sentencia.on_conflict_do_update(index_elements=['clave'],
+                                                        set_={'valor': tabla.c.valor + 1})
+        else:
+            raise RuntimeError(f'Generaciones no soportadas para {dialecto}')
+        db.session.execute(sentencia)
+
+    def __repr__(self):
+        return f'<Generacion {self.clave}={self.valor}>'
@@ -0,0 +1,141 @@
+"""
+Paginación por cursor (keyset) para los listados.
+
+En lugar de OFFSET, cada página se pide con un cursor opaco que contiene los
+valores de las columnas de orden del último (o primer) elemento visto, de modo
+que la base de datos salta directamente a esa posición del índice. El total
+de registros es opcional y se guarda en caché unos segundos por consulta.
+"""
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+class PaginaCursor:
+    """Página de resultados con cursores para ir a la página siguiente y a la anterior"""
+
+    por_cursor = True
+
+    def __init__(self, items, per_page, cursor_siguiente=None, cursor_anterior=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.cursor_siguiente = cursor_siguiente
+        self.cursor_anterior = cursor_anterior
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.cursor_siguiente is not None
+
+    @property
+    def has_prev(self):
+        return self.cursor_anterior is not None
+
+
+def _serializar(valor):
+    if isinstance(valor, datetime):
+        return {'dt': valor.isoformat()}
+    return valor
+
+
+def _deserializar(valor):
+    if isinstance(valor, dict) and 'dt' in valor:
+        return datetime.fromisoformat(valor['dt'])
+    return valor
+
+
+def codificar_cursor(valores, direccion):
+    datos = json.dumps({'v': [_serializar(v) for v in valores], 'd': direccion}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Devuelve (valores, dirección) o (None, 's') si el cursor falta o no es válido"""
+    if not cursor:
+        return None, 's'
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        return [_deserializar(v) for v in datos['v']], datos['d']
+    except (ValueError, KeyError, TypeError):
+        return None, 's'
+
+
+def _posteriores_a(columnas, valores, invertir=False):
+    """Filas que van después de `valores` en el orden dado (o antes, si `invertir`)"""
+    condiciones = []
+    for i, (columna, descendente) in enumerate(columnas):
+        iguales = [c == v for (c, _), v in zip(columnas[:i], valores[:i])]
+        if descendente != invertir:
+            condiciones.append(and_(*iguales, columna < valores[i]))
+        else:
+            condiciones.append(and_(*iguales, columna > valores[i]))
+    return or_(*condiciones)
+
+
+def paginar_por_cursor(query, columnas, cursor=None, per_page=10, contar=True):
+    """
+    Pagina `query` por las `columnas` indicadas, una lista de (columna, descendente).
+    La última columna debe ser única (normalmente el id) para que el orden sea total.
+    """
+    valores, direccion = decodificar_cursor(cursor)
+    if valores is not None and len(valores) != len(columnas):
+        valores, direccion = None, 's'
+    hacia_atras = valores is not None and direccion == 'a'
+
+    total = total_en_cache(query) if contar else None
+
+    if valores is not None:
+        query = query.filter(_posteriores_a(columnas, valores, invertir=hacia_atras))
+    orden = [
+        columna.desc() if descendente != hacia_atras else columna.asc()
+        for columna, descendente in columnas
+    ]
+    filas = query.order_by(*orden).limit(per_page + 1).all()
+    hay_mas = len(filas) > per_page
+    filas = filas[:per_page]
+    if hacia_atras:
+        filas.reverse()
+
+    def claves(fila):
+        return [getattr(fila, columna.key) for columna, _ in columnas]
+
+    siguiente = anterior = None
+    if filas:
+        if hay_mas or hacia_atras:
+            siguiente = codificar_cursor(claves(filas[-1]), 's')
+        if valores is not None and (hay_mas or not hacia_atras):
+            anterior = codificar_cursor(claves(filas[0]), 'a')
+
+    return PaginaCursor(filas, per_page, siguiente, anterior, total)
+
+
+# ================================
+# TOTALES EN CACHÉ
+# ================================
+
+TTL_TOTALES = 30
+_totales = {}
+_lock_totales = threading.Lock()
+
+
+def total_en_cache(query, ttl=TTL_TOTALES):
+    """COUNT(*) de la consulta, reutilizado durante `ttl` segundos para la misma consulta y parámetros"""
+    compilada = query.statement.compile()
+    clave = (str(compilada), tuple(sorted((k, repr(v)) for k, v in compilada.params.items())))
+    ahora = time.monotonic()
+    with _lock_totales:
+        entrada = _totales.get(clave)
+        if entrada is not None and ahora - entrada[0] < ttl:
+            return entrada[1]
+
+    total = query.order_by(None).count()
+
+    with _lock_totales:
+        for vieja in [k for k, (momento, _) in _totales.items() if ahora - momento >= ttl]:
+            del _totales[vieja]
+        _totales[clave] = (ahora, total)
+    return total
@@ -0,0 +1,103 @@
+"""
+Registro de ventas con un número constante de sentencias SQL.
+
+Sea cual sea el número de líneas del ticket, una venta se guarda con:
+un SELECT de todos los productos (IN), el INSERT de la venta, un UPDATE de
+stock, un INSERT de varias filas para los detalles, las sentencias de los
+resúmenes diarios (cada una por lotes) y el contador de generación.
+
+Las ventas que llegan con una clave de idempotencia (reintentos del punto de
+venta, doble clic) se deduplican con el índice único de
+`ventas.clave_idempotencia`, no con una consulta previa.
+"""
+from collections import namedtuple
+from decimal import Decimal
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from app import db, inventario, kardex, resumen
+from app.models import Venta, DetalleVenta, Producto, Generacion
+
+CENTAVO = Decimal('0.01')
+
+Linea = namedtuple('Linea', 'producto_id cantidad subtotal')
+
+
+def preparar_lineas(detalles):
+    """
+    Convierte los detalles recibidos ({producto_id, cantidad, precio_unitario}) en
+    líneas con el subtotal en Decimal. Carga todos los productos en una sola
+    consulta; las líneas de productos inexistentes se descartan.
+    Devuelve (lineas, total, categorias por producto).
+    """
+    ids = {int(detalle['producto_id']) for detalle in detalles}
+    categorias = dict(db.session.execute(
+        select(Producto.id, Producto.categoria).where(Producto.id.in_(ids))
+    ).all()) if ids else {}
+
+    lineas = []
+    total = Decimal('0')
+    for detalle in detalles:
+        producto_id = int(detalle['producto_id'])
+        if producto_id not in categorias:
+            continue
+        cantidad = int(detalle['cantidad'])
+        subtotal = (Decimal(str(detalle['precio_unitario'])) * cantidad).quantize(CENTAVO)
+        lineas.append(Linea(producto_id, cantidad, subtotal))
+        total += subtotal
+    return lineas, total, categorias
+
+
+def registrar_venta(detalles, **campos):
+    """
+    Crea una venta con sus detalles, descuenta el stock (anotándolo en el kardex) y
+    actualiza los resúmenes dentro de la transacción actual (sin commit). `campos` son
+    columnas extra de la venta (notas, metodo_pago, clave_idempotencia...). Lanza
+    inventario.StockInsuficiente si algún producto no tiene stock suficiente.
+    """
+    lineas, total, categorias = preparar_lineas(detalles)
+
+    # La venta se inserta primero: si la clave de idempotencia ya existe, el
+    # índice único falla aquí antes de tocar el stock
+    venta = Venta(total=total, **campos)
+    db.session.add(venta)
+    db.session.flush()  # Para obtener el ID de la venta
+
+    cantidades = inventario.agrupar_cantidades((linea.producto_id, linea.cantidad) for linea in lineas)
+    inventario.descontar_stock(cantidades)
+    kardex.registrar('venta', {producto_id: -cantidad for producto_id, cantidad in cantidades.items()},
+                     venta_id=venta.id, usuario_id=venta.usuario_id)
+
+    if lineas:
+        db.session.execute(insert(DetalleVenta), [
+            dict(linea._asdict(), venta_id=venta.id) for linea in lineas
+        ])
+
+    # Actualizar los resúmenes diarios en la misma transacción
+    resumen.aplicar_venta(venta, lineas, categorias=categorias)
+    Generacion.incrementar('ventas')
+    return venta
+
+
+def registrar_venta_idempotente(detalles, clave_idempotencia=None, **campos):
+    """
+    Registra la venta en un SAVEPOINT (sin commit) y devuelve (venta, creada).
+    Si `clave_idempotencia` ya existe (o la está insertando otra transacción, en
+    cuyo caso el INSERT espera a que confirme), el índice único rechaza el INSERT,
+    se deshace solo este SAVEPOINT y se devuelve la venta original con creada=False.
+    Un fallo de stock también deshace solo esta venta y propaga StockInsuficiente.
+    """
+    try:
+        with db.session.begin_nested():
+            venta = registrar_venta(detalles, clave_idempotencia=clave_idempotencia, **campos)
+        return venta, True
+    except IntegrityError:
+        if not clave_idempotencia:
+            raise
+        # Lectura con bloqueo: en MySQL (REPEATABLE READ) una lectura normal usa la
+        # instantánea de la transacción y no vería la venta que otra petición con la
+        # misma clave acaba de confirmar (doble envío mientras la primera seguía en curso)
+        existente = Venta.query.filter_by(clave_idempotencia=clave_idempotencia).with_for_update(
+            read=True).first()
+        if existente is None:
+            raise
+        return existente, False
@@ -0,0 +1,147 @@
+"""
+Lecturas de reportes en una réplica (o en un pool de conexiones aparte).
+
+Con `SQLALCHEMY_BINDS = {'replica': url}` las consultas SELECT hechas dentro
+de `lecturas_en_replica()` (o de una ruta con `@en_replica`) van al motor
+'replica'; todo lo demás (escrituras, flush, SQL de texto) sigue yendo a la
+base de datos principal. Sin bind 'replica' no cambia nada.
+
+Dentro del bloque se lee lo que tenga la réplica, así que solo debe usarse
+para lecturas que toleren unos segundos de retraso, nunca para leer algo
+que se acaba de escribir en la misma petición.
+
+Retraso: un hilo de cada proceso escribe cada REPLICA_REVISION_SEGUNDOS un
+latido (la hora actual) en la generación 'latido_replica' de la principal y
+lee el que tiene la réplica. Si la réplica no tiene el último latido de la
+principal y el suyo es más antiguo que REPLICA_RETRASO_MAXIMO segundos, las
+lecturas vuelven a la principal hasta la siguiente revisión. Las peticiones
+solo consultan el resultado en memoria.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql import Select
+
+BIND = 'replica'
+LATIDO = 'latido_replica'
+
+_en_replica = ContextVar('en_replica', default=False)
+
+
+class SesionEnrutada(Session):
+    """Sesión de `db` que manda a la réplica los SELECT hechos dentro de `lecturas_en_replica()`"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and _en_replica.get() and not self._flushing
+                and isinstance(clause, Select) and BIND in self._db.engines):
+            return self._db.engines[BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class _Estado:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.utilizable = False
+        self.retraso = None
+        self.hilo = None
+
+
+_estado = _Estado()
+
+
+def configurada():
+    return BIND in (current_app.config.get('SQLALCHEMY_BINDS') or {})
+
+
+def utilizable():
+    """
+    True si hay réplica y su retraso en la última revisión estaba dentro del
+    límite. No hace consultas: la revisión la hace un hilo del proceso.
+    """
+    if not configurada():
+        return False
+    with _estado.lock:
+        if _estado.hilo is None or not _estado.hilo.is_alive():
+            _estado.hilo = threading.Thread(target=_vigilar, args=(current_app._get_current_object(),),
+                                            daemon=True, name='vigilancia-replica')
+            _estado.hilo.start()
+        return _estado.utilizable
+
+
+def _vigilar(app):
+    while True:
+        with app.app_context():
+            revisar()
+        time.sleep(app.config.get('REPLICA_REVISION_SEGUNDOS', 5))
+
+
+def revisar():
+    """Mide el retraso de la réplica y decide si se puede leer de ella; devuelve si es utilizable"""
+    try:
+        retraso = medir_retraso()
+        utilizable = retraso <= current_app.config.get('REPLICA_RETRASO_MAXIMO', 30)
+    except Exception as e:
+        current_app.logger.warning(f'No se pudo comprobar la réplica: {str(e)}')
+        retraso, utilizable = None, False
+    with _estado.lock:
+        if _estado.utilizable and not utilizable:
+            current_app.logger.warning(f'Réplica retrasada ({retraso} s): los reportes leen de la principal')
+        _estado.utilizable, _estado.retraso = utilizable, retraso
+    return utilizable
+
+
+def medir_retraso():
+    """
+    Segundos que lleva retrasada la réplica: 0 si ya tiene el último latido
+    escrito en la principal. Escribe un latido nuevo en la principal.
+    """
+    from app import db
+    from app.models import Generacion
+    tabla = Generacion.__table__
+    ahora = int(time.time())
+    consulta = tabla.select().with_only_columns(tabla.c.valor).where(tabla.c.clave == LATIDO)
+
+    with db.engines[None].begin() as conexion:
+        principal = conexion.execute(consulta).scalar()
+        if principal is None:
+            conexion.execute(tabla.insert().values(clave=LATIDO, valor=ahora))
+        else:
+            conexion.execute(tabla.update().where(tabla.c.clave == LATIDO).values(valor=ahora))
+    with db.engines[BIND].connect() as conexion:
+        replica = conexion.execute(consulta).scalar()
+
+    if replica is not None and principal is not None and replica >= principal:
+        return 0
+    return ahora - replica if replica is not None else float('inf')
+
+
+@contextmanager
+def lecturas_en_replica():
+    """
+    Bloque `with` cuyas consultas SELECT van a la réplica si está al día;
+    si no, se quedan en la principal.
+    """
+    token = _en_replica.set(utilizable())
+    try:
+        yield
+    finally:
+        _en_replica.reset(token)
+
+
+def en_replica(f):
+    """Decorador de rutas de solo lectura que ejecuta la vista con `lecturas_en_replica()`"""
+    @wraps(f)
+    def envoltura(*args, **kwargs):
+        with lecturas_en_replica():
+            return f(*args, **kwargs)
+    return envoltura
+
+
+def estadisticas():
+    with _estado.lock:
+        return {'configurada': configurada(), 'utilizable': _estado.utilizable, 'retraso': _estado.retraso}
@@ -0,0 +1,439 @@
+"""
+Cálculo del reporte de ventas y su ejecución en segundo plano.
+
+Un reporte de un año sobre `detalle_ventas` puede tardar varios segundos; en
+modo asíncrono la petición solo registra un `TrabajoReporte` y devuelve su id,
+y el cálculo se hace en un pool de procesos que guarda el resultado en la base
+de datos. El trabajo se identifica por (rango, filtros, versión de los datos):
+
+- la versión combina `validador_ventas` del rango (cambia si se registra o se
+  borra una venta de esos días) y el contador `estados_venta` (cambia al anular),
+- si ya existe un trabajo terminado con la misma clave se devuelve al instante,
+  así que volver a pedir un período cerrado no recalcula nada.
+"""
+import hashlib
+import json
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import case, func, or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Producto, Venta, DetalleVenta, Generacion, TrabajoReporte
+from app.cache import cache_periodos
+from app.consultas import ventas_en_dias, validador_ventas
+
+ESTADOS_VENTA = ('pendiente', 'completada', 'cancelada', 'anulada')
+METODOS_PAGO = ('efectivo', 'tarjeta', 'transferencia')
+
+# Un trabajo pendiente durante más de este tiempo se da por perdido (p. ej. el
+# servidor se reinició) y se vuelve a encolar
+TIEMPO_MAXIMO = timedelta(minutes=10)
+
+_pool = None
+_pool_lock = threading.Lock()
+_app_proceso = None
+
+
+# ================================
+# CÁLCULO
+# ================================
+
+def filtros_reporte(args):
+    """Lee los filtros admitidos (estado, metodo_pago) descartando valores desconocidos"""
+    filtros = {}
+    if args.get('estado') in ESTADOS_VENTA:
+        filtros['estado'] = args['estado']
+    if args.get('metodo_pago') in METODOS_PAGO:
+        filtros['metodo_pago'] = args['metodo_pago']
+    return filtros
+
+
+def condiciones_reporte(filtros):
+    """Condiciones sobre `Venta` de los filtros de `filtros_reporte`"""
+    condiciones = []
+    if 'estado' in filtros:
+        condiciones.append(Venta.estado == filtros['estado'])
+    if 'metodo_pago' in filtros:
+        condiciones.append(Venta.metodo_pago == filtros['metodo_pago'])
+    return condiciones
+
+
+def ventas_diarias(inicio, fin, filtros=None):
+    """Número de ventas y total por día (para el gráfico)"""
+    dia = func.date(Venta.fecha)
+    filas = db.session.query(
+        dia.label('fecha'), func.count(Venta.id), func.sum(Venta.total)
+    ).filter(ventas_en_dias(inicio, fin), *condiciones_reporte(filtros or {})).group_by(dia).order_by('fecha').all()
+    # func.date devuelve date en MySQL y texto en SQLite
+    return [
+        {'fecha': str(fecha)[:10] if fecha else '', 'cantidad': cantidad or 0, 'total': float(total or 0)}
+        for fecha, cantidad, total in filas
+    ]
+
+
+def calcular_reporte_ventas(inicio, fin, filtros=None):
+    """
+    Resumen, productos más vendidos y ventas por día de los días [inicio, fin].
+    Devuelve solo tipos serializables en JSON para poder guardarlo.
+    """
+    filtros = filtros or {}
+    condiciones = [ventas_en_dias(inicio, fin)] + condiciones_reporte(filtros)
+
+    resumen = db.session.query(
+        func.count(Venta.id).label('total_ventas'),
+        func.sum(Venta.total).label('ingresos_totales'),
+        func.avg(Venta.total).label('ticket_promedio')
+    ).filter(*condiciones).one()
+
+    def top_productos(columna):
+        return db.session.query(
+            Producto.nombre, func.sum(columna)
+        ).join(
+            DetalleVenta, DetalleVenta.producto_id == Producto.id
+        ).join(
+            Venta, Venta.id == DetalleVenta.venta_id
+        ).filter(
+            *condiciones
+        ).group_by(
+            Producto.id, Producto.nombre
+        ).order_by(
+            func.sum(columna).desc()
+        ).limit(10).all()
+
+    return {
+        'resumen': {
+            'total_ventas': resumen.total_ventas or 0,
+            'ingresos_totales': float(resumen.ingresos_totales or 0),
+            'ticket_promedio': float(resumen.ticket_promedio or 0),
+        },
+        'top_cantidad': [
+            {'nombre': nombre, 'cantidad_total': int(cantidad or 0)}
+            for nombre, cantidad in top_productos(DetalleVenta.cantidad)
+        ],
+        'top_ingresos': [
+            {'nombre': nombre, 'ingresos_totales': float(ingresos or 0)}
+            for nombre, ingresos in top_productos(DetalleVenta.subtotal)
+        ],
+        'ventas_diarias': ventas_diarias(inicio, fin, filtros),
+    }
+
+
+# ================================
+# COMPARACIÓN ENTRE PERÍODOS
+# ================================
+
+MODOS_COMPARACION = {
+    'anterior': 'Período anterior',
+    'anio': 'Mismo período del año anterior',
+}
+
+
+def _menos_un_anio(dia):
+    try:
+        return dia.replace(year=dia.year - 1)
+    except ValueError:  # 29 de febrero
+        return dia.replace(year=dia.year - 1, day=28)
+
+
+def ventana_previa(inicio, fin, modo):
+    """Días [inicio, fin] con los que se compara: los inmediatamente anteriores o los del año pasado"""
+    if modo == 'anio':
+        return _menos_un_anio(inicio), _menos_un_anio(fin)
+    dias = (fin - inicio).days + 1
+    return inicio - timedelta(days=dias), inicio - timedelta(days=1)
+
+
+def _cerrada(fin):
+    # Las ventas se fechan con utcnow: un día está cerrado cuando ya pasó en UTC y en hora local
+    return fin < min(date.today(), datetime.utcnow().date())
+
+
+def _metricas_ventanas(ventanas, filtros):
+    """
+    Totales de varias ventanas de días con una sola consulta de agregación
+    condicional para el resumen y otra para los productos:
+
+        SELECT COUNT(CASE WHEN <ventana 1> THEN id END), SUM(CASE WHEN <ventana 1> THEN total END),
+               COUNT(CASE WHEN <ventana 2> ...
+        WHERE <ventana 1> OR <ventana 2>
+
+    Devuelve, por ventana, {'ventas', 'ingresos', 'productos': {id: (nombre, cantidad, ingresos)}}.
+    """
+    en_ventana = [ventas_en_dias(inicio, fin) for inicio, fin in ventanas]
+    condiciones = [or_(*en_ventana)] + condiciones_reporte(filtros)
+
+    columnas = []
+    for en in en_ventana:
+        columnas += [func.count(case((en, Venta.id))), func.sum(case((en, Venta.total), else_=0))]
+    totales = db.session.query(*columnas).filter(*condiciones).one()
+
+    columnas = []
+    for en in en_ventana:
+        columnas += [func.sum(case((en, DetalleVenta.cantidad), else_=0)),
+                     func.sum(case((en, DetalleVenta.subtotal), else_=0))]
+    productos = db.session.query(
+        Producto.id, Producto.nombre, *columnas
+    ).join(
+        DetalleVenta, DetalleVenta.producto_id == Producto.id
+    ).join(
+        Venta, Venta.id == DetalleVenta.venta_id
+    ).filter(
+        *condiciones
+    ).group_by(
+        Producto.id, Producto.nombre
+    ).all()
+
+    metricas = []
+    for i in range(len(ventanas)):
+        por_producto = {}
+        for fila in productos:
+            cantidad, ingresos = int(fila[2 + 2 * i] or 0), float(fila[3 + 2 * i] or 0)
+            if cantidad or ingresos:
+                por_producto[fila[0]] = (fila[1], cantidad, ingresos)
+        metricas.append({
+            'ventas': totales[2 * i] or 0,
+            'ingresos': float(totales[2 * i + 1] or 0),
+            'productos': por_producto,
+        })
+    return metricas
+
+
+def _variacion(actual, previo):
+    delta = actual - previo
+    return {
+        'actual': actual,
+        'previo': previo,
+        'delta': delta,
+        'variacion': round(delta / previo * 100, 1) if previo else None,
+    }
+
+
+def _mejores(productos, indice):
+    return sorted(productos.items(), key=lambda item: (-item[1][indice], item[0]))[:10]
+
+
+def _top_comparado(actual, previo, indice, campo, nombres=None):
+    """
+    Los 10 primeros productos del período actual con su valor en el período previo.
+    `nombres` ({producto_id: nombre}) sustituye a los guardados con las métricas.
+    """
+    return [
+        dict(_variacion(valores[indice], previo.get(producto_id, (None, 0, 0))[indice]),
+             nombre=(nombres or {}).get(producto_id, valores[0]), **{campo: valores[indice]})
+        for producto_id, valores in _mejores(actual, indice)
+    ]
+
+
+def comparar_periodos(inicio, fin, modo='anterior', filtros=None):
+    """
+    Compara los días [inicio, fin] con la ventana previa según `modo`. Las
+    ventanas ya cerradas se guardan en caché y solo se consultan las abiertas;
+    si hay que consultar las dos, se hace en la misma consulta de agregación
+    condicional. La caché de cada ventana se versiona con su `validador_ventas`
+    (una venta fechada en el pasado, p. ej. del punto de venta sin conexión) y con
+    el contador `estados_venta` (anulaciones). Los nombres de los productos del
+    top se leen siempre de `productos`, así que un cambio de nombre se ve enseguida.
+    """
+    filtros = filtros or {}
+    previo_inicio, previo_fin = ventana_previa(inicio, fin, modo)
+    ventanas = [(inicio, fin), (previo_inicio, previo_fin)]
+    cerradas = [_cerrada(ventana[1]) for ventana in ventanas]
+    generacion = Generacion.obtener('estados_venta')
+    claves = [
+        ('ventana', ventana, tuple(sorted(filtros.items())), validador_ventas(*ventana) if cerrada else None)
+        for ventana, cerrada in zip(ventanas, cerradas)
+    ]
+
+    metricas = [
+        cache_periodos.buscar(clave, generacion) if cerrada else None
+        for clave, cerrada in zip(claves, cerradas)
+    ]
+    pendientes = [i for i, valor in enumerate(metricas) if valor is None]
+    if pendientes:
+        calculadas = _metricas_ventanas([ventanas[i] for i in pendientes], filtros)
+        for i, valor in zip(pendientes, calculadas):
+            metricas[i] = valor
+            if cerradas[i]:
+                cache_periodos.guardar(claves[i], generacion, valor)
+
+    actual, previo = metricas
+
+    nombres = None
+    if 0 not in pendientes:
+        # Métricas del período actual de la caché: nombres actuales de los productos del top
+        ids = {producto_id for indice in (1, 2) for producto_id, _ in _mejores(actual['productos'], indice)}
+        nombres = dict(db.session.query(Producto.id, Producto.nombre).filter(Producto.id.in_(ids))) if ids else {}
+
+    def ticket(m):
+        return m['ingresos'] / m['ventas'] if m['ventas'] else 0
+
+    return {
+        'modo': modo,
+        'previo_inicio': previo_inicio,
+        'previo_fin': previo_fin,
+        'resumen': {
+            'total_ventas': _variacion(actual['ventas'], previo['ventas']),
+            'ingresos_totales': _variacion(actual['ingresos'], previo['ingresos']),
+            'ticket_promedio': _variacion(ticket(actual), ticket(previo)),
+        },
+        'top_cantidad': _top_comparado(actual['productos'], previo['productos'], 1, 'cantidad_total', nombres),
+        'top_ingresos': _top_comparado(actual['productos'], previo['productos'], 2, 'ingresos_totales', nombres),
+    }
+
+
+# ================================
+# TRABAJOS EN SEGUNDO PLANO
+# ================================
+
+def version_datos(inicio, fin):
+    """Versión de los datos de ventas del rango; cambia cuando el reporte dejaría de ser válido"""
+    max_id, max_fecha, cantidad = validador_ventas(inicio, fin)
+    return f"{max_id or 0}:{cantidad}:{max_fecha or ''}:{Generacion.obtener('estados_venta')}"
+
+
+def _clave(tipo, inicio, fin, filtros, version):
+    datos = json.dumps([tipo, inicio.isoformat(), fin.isoformat(), filtros, version], sort_keys=True)
+    return hashlib.sha1(datos.encode('utf-8')).hexdigest()
+
+
+def solicitar_reporte_ventas(inicio, fin, filtros=None, usuario_id=None):
+    """
+    Devuelve el trabajo del reporte para (rango, filtros, versión actual). Si no
+    existe lo crea y lo encola; si ya está terminado no se vuelve a calcular.
+    """
+    filtros_json = json.dumps(filtros or {}, sort_keys=True)
+    version = version_datos(inicio, fin)
+    clave = _clave('ventas', inicio, fin, filtros or {}, version)
+
+    trabajo = TrabajoReporte.query.filter_by(clave=clave).first()
+    if trabajo is not None:
+        perdido = (trabajo.estado in ('pendiente', 'en_proceso')
+                   and trabajo.creado_en < datetime.utcnow() - TIEMPO_MAXIMO)
+        if trabajo.estado == 'error' or perdido:
+            trabajo.estado = 'pendiente'
+            trabajo.error = None
+            trabajo.creado_en = datetime.utcnow()
+            db.session.commit()
+            _encolar(trabajo.id)
+        return trabajo
+
+    # Los resultados de versiones anteriores del mismo reporte ya no sirven
+    TrabajoReporte.query.filter(
+        TrabajoReporte.tipo == 'ventas',
+        TrabajoReporte.inicio == inicio,
+        TrabajoReporte.fin == fin,
+        TrabajoReporte.filtros == filtros_json,
+        TrabajoReporte.version != version,
+        TrabajoReporte.estado.in_(('terminado', 'error')),
+    ).delete(synchronize_session=False)
+
+    trabajo = TrabajoReporte(id=uuid.uuid4().hex, clave=clave, tipo='ventas', inicio=inicio, fin=fin,
+                             filtros=filtros_json, version=version, usuario_id=usuario_id)
+    db.session.add(trabajo)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Otra petición encoló el mismo reporte a la vez
+        db.session.rollback()
+        return TrabajoReporte.query.filter_by(clave=clave).one()
+    _encolar(trabajo.id)
+    return trabajo
+
+
+def resultado(trabajo):
+    """Resultado guardado de un trabajo terminado"""
+    return json.loads(trabajo.resultado) if trabajo.resultado else None
+
+
+def ejecutar_trabajo(trabajo_id):
+    """Calcula un trabajo pendiente y guarda su resultado (requiere contexto de aplicación)"""
+    filas = TrabajoReporte.query.filter_by(id=trabajo_id, estado='pendiente').update(
+        {TrabajoReporte.estado: 'en_proceso', TrabajoReporte.iniciado_en: datetime.utcnow()},
+        synchronize_session=False)
+    db.session.commit()
+    if not filas:
+        return  # Ya lo tomó otro proceso
+    trabajo = db.session.get(TrabajoReporte, trabajo_id)
+    try:
+        datos = calcular_reporte_ventas(trabajo.inicio, trabajo.fin, json.loads(trabajo.filtros))
+    except Exception as e:
+        db.session.rollback()
+        _marcar_error(trabajo_id, e)
+        return
+    trabajo.resultado = json.dumps(datos, ensure_ascii=False)
+    trabajo.estado = 'terminado'
+    trabajo.terminado_en = datetime.utcnow()
+    db.session.commit()
+
+
+def _marcar_error(trabajo_id, error):
+    TrabajoReporte.query.filter_by(id=trabajo_id).update(
+        {TrabajoReporte.estado: 'error', TrabajoReporte.error: str(error)[:500],
+         TrabajoReporte.terminado_en: datetime.utcnow()},
+        synchronize_session=False)
+    db.session.commit()
+
+
+def _ejecutar_en_proceso(trabajo_id, ajustes):
+    """Punto de entrada en los procesos del pool: cada uno crea su propia aplicación una vez"""
+    global _app_proceso
+    if _app_proceso is None:
+        from app import create_app
+        from config import Config
+        _app_proceso = create_app(type('ConfigTrabajos', (Config,), ajustes))
+    with _app_proceso.app_context():
+        ejecutar_trabajo(trabajo_id)
+
+
+def _en_memoria():
+    return db.engine.dialect.name == 'sqlite' and db.engine.url.database in (None, '', ':memory:')
+
+
+def _obtener_pool(app):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: los procesos no heredan conexiones ni hilos del servidor
+            _pool = ProcessPoolExecutor(max_workers=app.config.get('REPORTES_PROCESOS', 2),
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _encolar(trabajo_id):
+    global _pool
+    app = current_app._get_current_object()
+    if _en_memoria():
+        # Pruebas con SQLite en memoria: otro proceso no vería la base de datos
+        ejecutar_trabajo(trabajo_id)
+        return
+    pool = _obtener_pool(app)
+    ajustes = {
+        'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+        'SQLALCHEMY_ENGINE_OPTIONS': app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+    }
+    try:
+        futuro = pool.submit(_ejecutar_en_proceso, trabajo_id, ajustes)
+    except BrokenProcessPool:
+        # Un proceso murió: se descarta el pool y el próximo trabajo crea otro
+        with _pool_lock:
+            _pool = None
+        _marcar_error(trabajo_id, 'El pool de procesos de reportes no está disponible')
+        return
+
+    def _al_terminar(futuro):
+        global _pool
+        error = futuro.exception()
+        if error is not None:
+            if isinstance(error, BrokenProcessPool):
+                with _pool_lock:
+                    if _pool is pool:
+                        _pool = None
+            with app.app_context():
+                _marcar_error(trabajo_id, error)
+
+    futuro.add_done_callback(_al_terminar)
@@ -0,0 +1,155 @@
+"""
+Cálculo de reposición: demanda diaria, días de cobertura, punto de reorden y
+cantidad sugerida de todos los productos a la vez.
+
+Se ejecuta por lotes (`flask calcular-reposicion`, por ejemplo cada hora con
+cron) y guarda el resultado en `reposicion_productos`; la página de bajo
+stock y el dashboard solo leen esa tabla, ya ordenada por urgencia.
+
+Para cada producto, con las unidades vendidas por día en la ventana (de los
+resúmenes diarios, sin ventas anuladas ni canceladas):
+
+    demanda       = unidades / días con el producto dado de alta (como mucho la ventana)
+    seguridad     = z · desviación diaria · √plazo
+    punto_reorden = max(stock_minimo, demanda · plazo + seguridad)
+    cobertura     = stock / demanda
+    sugerida      = demanda · (plazo + días objetivo) + seguridad − stock   (si stock <= punto_reorden)
+
+Todo se calcula con NumPy sobre arrays de todos los productos: la consulta
+devuelve una fila por (producto, día) y las sumas se hacen con `np.bincount`.
+"""
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, insert, or_, select
+from sqlalchemy.orm import contains_eager
+from app import db
+from app.models import Producto, ResumenProductoDiario, ReposicionProducto
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él se usa el umbral global de stock
+    np = None
+
+# Los productos sin demanda van detrás de todos los que se venden, por stock
+PRIORIDAD_SIN_DEMANDA = 1e6
+
+
+def disponible():
+    return np is not None
+
+
+def calculada():
+    """True si ya hay resultados guardados del cálculo por lotes"""
+    return db.session.query(select(ReposicionProducto.producto_id).exists()).scalar()
+
+
+def calcular(hoy=None):
+    """
+    Calcula la reposición de todos los productos activos. Devuelve un dict de
+    arrays de NumPy indexados igual que `producto_id` (no guarda nada).
+    """
+    if np is None:
+        raise RuntimeError('NumPy no está instalado')
+    config = current_app.config
+    ventana = config['REPOSICION_VENTANA_DIAS']
+    plazo = config['REPOSICION_PLAZO_DIAS']
+    objetivo = config['REPOSICION_DIAS_OBJETIVO']
+    z = config['REPOSICION_FACTOR_SEGURIDAD']
+    hoy = hoy or date.today()
+    desde = hoy - timedelta(days=ventana - 1)
+
+    productos = db.session.execute(
+        select(Producto.id, Producto.stock, Producto.stock_minimo, Producto.creado_en)
+        .where(Producto.activo.is_(True)).order_by(Producto.id)
+    ).all()
+    ids = np.array([p.id for p in productos], dtype='int64')
+    stock = np.array([p.stock or 0 for p in productos], dtype='int64')
+    stock_minimo = np.array([p.stock_minimo or 0 for p in productos], dtype='int64')
+    # Días que lleva el producto dado de alta dentro de la ventana (al menos uno)
+    dias_activo = np.clip(np.array(
+        [(hoy - p.creado_en.date()).days + 1 if p.creado_en else ventana for p in productos],
+        dtype='float64'), 1, ventana)
+
+    # Unidades vendidas por producto y día; los días sin ventas cuentan como cero
+    ventas = db.session.execute(
+        select(ResumenProductoDiario.producto_id, func.sum(ResumenProductoDiario.cantidad))
+        .where(ResumenProductoDiario.fecha >= desde, ResumenProductoDiario.fecha <= hoy,
+               or_(ResumenProductoDiario.estado.is_(None),
+                   ResumenProductoDiario.estado.notin_(('anulada', 'cancelada'))))
+        .group_by(ResumenProductoDiario.producto_id, ResumenProductoDiario.fecha)
+    ).all()
+    n = len(ids)
+    if ventas and n:
+        producto_venta = np.array([v[0] for v in ventas], dtype='int64')
+        unidades = np.array([v[1] or 0 for v in ventas], dtype='float64')
+        posicion = np.searchsorted(ids, producto_venta)
+        # Descartar productos inactivos o borrados
+        validas = (posicion < n) & (ids[np.minimum(posicion, n - 1)] == producto_venta)
+        posicion, unidades = posicion[validas], unidades[validas]
+        suma = np.bincount(posicion, weights=unidades, minlength=n)
+        suma_cuadrados = np.bincount(posicion, weights=unidades ** 2, minlength=n)
+    else:
+        suma = suma_cuadrados = np.zeros(n)
+
+    demanda = suma / dias_activo
+    desviacion = np.sqrt(np.maximum(suma_cuadrados / dias_activo - demanda ** 2, 0))
+    seguridad = np.ceil(z * desviacion * np.sqrt(plazo)).astype('int64')
+    punto_reorden = np.maximum(stock_minimo, np.ceil(demanda * plazo).astype('int64') + seguridad)
+    necesita = stock <= punto_reorden
+    nivel_objetivo = np.maximum(np.ceil(demanda * (plazo + objetivo)).astype('int64') + seguridad,
+                                punto_reorden + 1)
+    sugerida = np.where(necesita, np.maximum(nivel_objetivo - stock, 0), 0)
+
+    con_demanda = demanda > 0
+    cobertura = np.divide(np.maximum(stock, 0), demanda, out=np.full(n, np.nan), where=con_demanda)
+    prioridad = np.where(con_demanda, cobertura, PRIORIDAD_SIN_DEMANDA + stock)
+
+    return {
+        'producto_id': ids,
+        'demanda_diaria': demanda,
+        'desviacion_diaria': desviacion,
+        'dias_cobertura': cobertura,
+        'stock_seguridad': seguridad,
+        'punto_reorden': punto_reorden,
+        'cantidad_sugerida': sugerida,
+        'stock': stock,
+        'necesita_reposicion': necesita,
+        'prioridad': prioridad,
+    }
+
+
+def recalcular(hoy=None):
+    """Calcula la reposición y reemplaza la tabla en una sola transacción; devuelve el resultado"""
+    resultado = calcular(hoy)
+    ahora = datetime.utcnow()
+    filas = [
+        {
+            'producto_id': int(resultado['producto_id'][i]),
+            'demanda_diaria': round(float(resultado['demanda_diaria'][i]), 4),
+            'desviacion_diaria': round(float(resultado['desviacion_diaria'][i]), 4),
+            'dias_cobertura': (None if np.isnan(resultado['dias_cobertura'][i])
+                               else round(float(resultado['dias_cobertura'][i]), 2)),
+            'stock_seguridad': int(resultado['stock_seguridad'][i]),
+            'punto_reorden': int(resultado['punto_reorden'][i]),
+            'cantidad_sugerida': int(resultado['cantidad_sugerida'][i]),
+            'stock': int(resultado['stock'][i]),
+            'necesita_reposicion': bool(resultado['necesita_reposicion'][i]),
+            'prioridad': float(resultado['prioridad'][i]),
+            'calculado_en': ahora,
+        }
+        for i in range(len(resultado['producto_id']))
+    ]
+    db.session.execute(delete(ReposicionProducto))
+    if filas:
+        db.session.execute(insert(ReposicionProducto), filas)
+    db.session.commit()
+    return resultado
+
+
+def consulta_a_reponer():
+    """Productos que necesitan reposición con su cálculo, para ordenar por (prioridad, producto_id)"""
+    return ReposicionProducto.query.join(
+        Producto, Producto.id == ReposicionProducto.producto_id
+    ).filter(
+        ReposicionProducto.necesita_reposicion.is_(True)
+    ).options(contains_eager(ReposicionProducto.producto))
@@ -0,0 +1,314 @@
+"""
+Tablas de resumen diario de ventas.
+
+Las ventas y anulaciones actualizan los acumulados dentro de la misma
+transacción, de modo que el dashboard lee unas pocas filas por día en lugar
+de recorrer todo el historial de `ventas` y `detalle_ventas`.
+"""
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from sqlalchemy import and_, bindparam, func, insert, or_, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db
+from app.models import Venta, DetalleVenta, Producto, ResumenVentaDiaria, ResumenProductoDiario, Generacion
+
+
+def _decimal(valor):
+    return Decimal(str(valor or 0))
+
+
+def _sentencia_acumular(tabla, nombres_claves, campos):
+    """
+    INSERT que, si la fila ya existe (índice único de las claves), suma los
+    incrementos: ON DUPLICATE KEY UPDATE col = col + VALUES(col) en MySQL,
+    ON CONFLICT DO UPDATE en SQLite.
+    """
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto == 'mysql':
+        sentencia = mysql_insert(tabla)
+        return sentencia.on_duplicate_key_update(
+            {campo: tabla.c[campo] + sentencia.inserted[campo] for campo in campos})
+    if dialecto == 'sqlite':
+        sentencia = sqlite_insert(tabla)
+        return sentencia.on_conflict_do_update(
+            index_elements=nombres_claves,
+            set_={campo: tabla.c[campo] + sentencia.excluded[campo] for campo in campos})
+    raise RuntimeError(f'Resúmenes no soportados para {dialecto}')
+
+
+def _acumular(modelo, filas):
+    """
+    Suma los incrementos a las filas de resumen indicadas, creando las que no existan.
+    `filas` es una lista de (claves, incrementos, atributos).
+
+    Las filas con todas las claves informadas se escriben con un único INSERT que
+    suma sobre la fila existente (executemany), así dos cajas que hacen a la vez la
+    primera venta del día no chocan con el índice único. El índice no iguala los
+    NULL (p. ej. ventas sin método de pago), así que esas filas se buscan con un
+    SELECT y se actualizan o insertan; si dos transacciones crean a la vez la misma
+    fila con claves nulas quedan dos filas, que las consultas suman igual.
+    """
+    if not filas:
+        return
+    tabla = modelo.__table__
+    nombres_claves = list(filas[0][0])
+    campos = list(filas[0][1])
+
+    completas = [fila for fila in filas if None not in fila[0].values()]
+    if completas:
+        db.session.execute(_sentencia_acumular(tabla, nombres_claves, campos), [
+            dict(claves, **(atributos or {}), **incrementos) for claves, incrementos, atributos in completas
+        ])
+
+    filas = [fila for fila in filas if None in fila[0].values()]
+    if not filas:
+        return
+    columnas_claves = [tabla.c[nombre] for nombre in nombres_claves]
+
+    # `columna == None` se traduce a IS NULL, así que las claves nulas también coinciden
+    existentes = {
+        tuple(fila[1:]): fila[0]
+        for fila in db.session.execute(
+            select(tabla.c.id, *columnas_claves).where(or_(*[
+                and_(*[columna == claves[columna.name] for columna in columnas_claves])
+                for claves, _, _ in filas
+            ]))
+        )
+    }
+
+    actualizar, insertar = [], []
+    for claves, incrementos, atributos in filas:
+        fila_id = existentes.get(tuple(claves[nombre] for nombre in nombres_claves))
+        if fila_id is None:
+            insertar.append(dict(claves, **(atributos or {}), **incrementos))
+        else:
+            actualizar.append(dict({f'inc_{campo}': valor for campo, valor in incrementos.items()},
+                                   fila_id=fila_id))
+
+    if actualizar:
+        # Expresiones SQL (columna = columna + n) para no perder actualizaciones concurrentes
+        db.session.execute(
+            update(tabla)
+            .where(tabla.c.id == bindparam('fila_id'))
+            .values({campo: tabla.c[campo] + bindparam(f'inc_{campo}') for campo in campos}),
+            actualizar
+        )
+    if insertar:
+        db.session.execute(insert(tabla), insertar)
+
+
+def aplicar_venta(venta, detalles, signo=1, categorias=None):
+    """
+    Suma (signo=1) o resta (signo=-1) una venta y sus detalles en los resúmenes.
+    `detalles` puede ser cualquier objeto con producto_id, cantidad y subtotal;
+    `categorias` ({producto_id: categoria}) evita volver a leerlas si ya se tienen.
+    No hace commit: debe llamarse dentro de la transacción que modifica la venta.
+    """
+    claves_venta = {
+        'fecha': venta.fecha.date(),
+        'metodo_pago': venta.metodo_pago,
+        'estado': venta.estado
+    }
+
+    _acumular(ResumenVentaDiaria, [(claves_venta, {
+        'num_ventas': signo,
+        'total': signo * _decimal(venta.total)
+    }, None)])
+
+    # Agrupar las líneas por producto para escribir una sola fila por producto
+    por_producto = defaultdict(lambda: {'num_lineas': 0, 'cantidad': 0, 'subtotal': Decimal('0')})
+    for detalle in detalles:
+        acumulado = por_producto[detalle.producto_id]
+        acumulado['num_lineas'] += 1
+        acumulado['cantidad'] += int(detalle.cantidad or 0)
+        acumulado['subtotal'] += _decimal(detalle.subtotal)
+
+    # Las categorías de todos los productos en una sola consulta
+    if categorias is None and por_producto:
+        categorias = dict(
+            db.session.query(Producto.id, Producto.categoria)
+            .filter(Producto.id.in_(list(por_producto)))
+        )
+    _acumular(ResumenProductoDiario, [
+        (dict(claves_venta, producto_id=producto_id),
+         {campo: signo * valor for campo, valor in acumulado.items()},
+         {'categoria': (categorias or {}).get(producto_id)})
+        for producto_id, acumulado in por_producto.items()
+    ])
+
+
+def cambiar_estado(venta, nuevo_estado):
+    """Mueve una venta de su estado actual a `nuevo_estado` en los resúmenes"""
+    detalles = list(venta.detalles)
+    aplicar_venta(venta, detalles, signo=-1)
+    venta.estado = nuevo_estado
+    aplicar_venta(venta, detalles)
+    # Versión de los datos de los reportes guardados (app.reportes)
+    Generacion.incrementar('estados_venta')
+
+
+def reconstruir():
+    """Vacía y recalcula los resúmenes a partir de las tablas de ventas"""
+    db.session.query(ResumenProductoDiario).delete()
+    db.session.query(ResumenVentaDiaria).delete()
+
+    dia = func.date(Venta.fecha)
+    db.session.execute(insert(ResumenVentaDiaria).from_select(
+        ['fecha', 'metodo_pago', 'estado', 'num_ventas', 'total'],
+        select(
+            dia, Venta.metodo_pago, Venta.estado,
+            func.count(Venta.id), func.coalesce(func.sum(Venta.total), 0)
+        ).group_by(dia, Venta.metodo_pago, Venta.estado)
+    ))
+    db.session.execute(insert(ResumenProductoDiario).from_select(
+        ['fecha', 'producto_id', 'categoria', 'metodo_pago', 'estado', 'num_lineas', 'cantidad', 'subtotal'],
+        select(
+            dia, DetalleVenta.producto_id, Producto.categoria, Venta.metodo_pago, Venta.estado,
+            func.count(DetalleVenta.id),
+            func.coalesce(func.sum(DetalleVenta.cantidad), 0),
+            func.coalesce(func.sum(DetalleVenta.subtotal), 0)
+        ).join(
+            Venta, Venta.id == DetalleVenta.venta_id
+        ).join(
+            Producto, Producto.id == DetalleVenta.producto_id
+        ).group_by(dia, DetalleVenta.producto_id, Producto.categoria, Venta.metodo_pago, Venta.estado)
+    ))
+    Generacion.incrementar('ventas')
+    db.session.commit()
+
+
+def totales_ventas(desde, hasta=None):
+    """Devuelve (cantidad de ventas, total vendido) entre `desde` y `hasta` (excluido)"""
+    query = db.session.query(
+        func.sum(ResumenVentaDiaria.num_ventas),
+        func.sum(ResumenVentaDiaria.total)
+    ).filter(ResumenVentaDiaria.fecha >= desde)
+    if hasta is not None:
+        query = query.filter(ResumenVentaDiaria.fecha < hasta)
+    cantidad, total = query.first()
+    return {
+        'cantidad': int(cantidad or 0),
+        'total': float(total) if total else 0
+    }
+
+
+def totales_dia(dia):
+    return totales_ventas(dia, dia + timedelta(days=1))
+
+
+def productos_mas_vendidos(desde, limite=5):
+    """Productos con más unidades vendidas desde la fecha indicada"""
+    return db.session.query(
+        Producto.nombre,
+        func.sum(ResumenProductoDiario.cantidad).label('cantidad_vendida'),
+        func.sum(ResumenProductoDiario.subtotal).label('total_vendido')
+    ).join(
+        Producto, Producto.id == ResumenProductoDiario.producto_id
+    ).filter(
+        ResumenProductoDiario.fecha >= desde
+    ).group_by(
+        Producto.id, Producto.nombre
+    ).having(
+        func.sum(ResumenProductoDiario.num_lineas) > 0
+    ).order_by(
+        func.sum(ResumenProductoDiario.cantidad).desc()
+    ).limit(limite).all()
+
+
+def ventas_por_categoria(desde, hasta=None):
+    """Unidades y total vendido por categoría desde la fecha indicada (hasta `hasta`, excluido)"""
+    query = db.session.query(
+        ResumenProductoDiario.categoria,
+        func.sum(ResumenProductoDiario.cantidad).label('cantidad'),
+        func.sum(ResumenProductoDiario.subtotal).label('total')
+    ).filter(
+        ResumenProductoDiario.fecha >= desde
+    )
+    if hasta is not None:
+        query = query.filter(ResumenProductoDiario.fecha < hasta)
+    return query.group_by(
+        ResumenProductoDiario.categoria
+    ).having(
+        func.sum(ResumenProductoDiario.num_lineas) > 0
+    ).all()
+
+
+def ventas_por_dia(desde, hasta):
+    """Número de ventas y total por día entre `desde` y `hasta` (excluido)"""
+    return db.session.query(
+        ResumenVentaDiaria.fecha,
+        func.sum(ResumenVentaDiaria.num_ventas).label('cantidad'),
+        func.sum(ResumenVentaDiaria.total).label('total')
+    ).filter(
+        ResumenVentaDiaria.fecha >= desde,
+        ResumenVentaDiaria.fecha < hasta
+    ).group_by(
+        ResumenVentaDiaria.fecha
+    ).having(
+        func.sum(ResumenVentaDiaria.num_ventas) > 0
+    ).order_by(
+        ResumenVentaDiaria.fecha
+    ).all()
+
+
+EstadisticaCategoria = namedtuple('EstadisticaCategoria', 'categoria cantidad total')
+EstadisticaProducto = namedtuple('EstadisticaProducto', 'producto_id nombre cantidad total')
+
+
+def estadisticas_filtradas(inicio, fin, estado=None, metodo_pago=None, limite=5):
+    """
+    Total vendido, desglose por categoría y productos más vendidos de los días
+    [inicio, fin] con los filtros del listado de ventas. Los filtros (días completos,
+    estado y método de pago) son dimensiones de los resúmenes, así que basta con
+    una pasada sobre `resumen_productos_diarios` y la suma de `resumen_ventas_diarias`.
+    """
+    def filtrar(query, modelo):
+        query = query.filter(modelo.fecha >= inicio, modelo.fecha <= fin)
+        if estado:
+            query = query.filter(modelo.estado == estado)
+        if metodo_pago:
+            query = query.filter(modelo.metodo_pago == metodo_pago)
+        return query
+
+    total = filtrar(db.session.query(func.sum(ResumenVentaDiaria.total)), ResumenVentaDiaria).scalar()
+
+    filas = filtrar(db.session.query(
+        ResumenProductoDiario.producto_id,
+        Producto.nombre,
+        ResumenProductoDiario.categoria,
+        func.sum(ResumenProductoDiario.cantidad),
+        func.sum(ResumenProductoDiario.subtotal)
+    ).outerjoin(
+        Producto, Producto.id == ResumenProductoDiario.producto_id
+    ), ResumenProductoDiario).group_by(
+        ResumenProductoDiario.producto_id, Producto.nombre, ResumenProductoDiario.categoria
+    ).having(
+        func.sum(ResumenProductoDiario.num_lineas) > 0
+    ).all()
+
+    # Una sola pasada: acumular por categoría y por producto a la vez
+    categorias = defaultdict(lambda: [0, Decimal('0')])
+    productos = {}
+    for producto_id, nombre, categoria, cantidad, subtotal in filas:
+        cantidad = int(cantidad or 0)
+        subtotal = _decimal(subtotal)
+        categorias[categoria][0] += cantidad
+        categorias[categoria][1] += subtotal
+        acumulado = productos.setdefault(producto_id, [nombre, 0, Decimal('0')])
+        acumulado[1] += cantidad
+        acumulado[2] += subtotal
+
+    return {
+        'total': float(total) if total else 0,
+        'categorias': [
+            EstadisticaCategoria(categoria, cantidad, subtotal)
+            for categoria, (cantidad, subtotal) in sorted(categorias.items(), key=lambda c: c[0] or '')
+        ],
+        'productos': sorted(
+            (EstadisticaProducto(producto_id, nombre, cantidad, subtotal)
+             for producto_id, (nombre, cantidad, subtotal) in productos.items()),
+            key=lambda p: (-p.cantidad, p.producto_id)
+        )[:limite]
+    }
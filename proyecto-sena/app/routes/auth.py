@@ -2,8 +2,9 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_user, logout_user, login_required, current_user
 from datetime import datetime
 from app import db
-from app.models import Usuario
+from app.models import Usuario, invalidar_usuario
 from app.forms import LoginForm, RegistrationForm, ProfileForm
+from app.escritura_diferida import ultimos_accesos
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -18,12 +19,14 @@ def login():
         if user is None or not user.check_password(form.password.data):
             flash('Correo o contraseña inválidos', 'danger')
             return redirect(url_for('auth.login'))
+        if user.activo is False:
+            flash('Tu cuenta está desactivada. Contacta con un administrador.', 'danger')
+            return redirect(url_for('auth.login'))
         
         login_user(user, remember=form.remember_me.data)
         
-        # Actualizar último acceso
-        user.ultimo_acceso = datetime.utcnow()
-        db.session.commit()
+        # Actualizar último acceso (se escribe por lotes, sin commit por cada login)
+        ultimos_accesos.anotar(user.id, datetime.utcnow())
         
         next_page = request.args.get('next')
         return redirect(next_page or url_for('main.index'))
@@ -71,20 +74,23 @@ def manage_users():
 @auth_bp.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
-    form = ProfileForm(current_user.nombre_usuario, current_user.email)
+    # current_user es una copia de solo lectura: el perfil usa el objeto completo
+    usuario = Usuario.query.get_or_404(current_user.id)
+    form = ProfileForm(usuario.nombre_usuario, usuario.email)
     if form.validate_on_submit():
-        current_user.nombre_usuario = form.nombre_usuario.data
-        current_user.email = form.email.data
+        usuario.nombre_usuario = form.nombre_usuario.data
+        usuario.email = form.email.data
         if form.password.data:
-            current_user.set_password(form.password.data)
+            usuario.set_password(form.password.data)
         db.session.commit()
+        invalidar_usuario(usuario.id)
         flash('Tu perfil ha sido actualizado.', 'success')
         return redirect(url_for('auth.profile'))
     elif request.method == 'GET':
-        form.nombre_usuario.data = current_user.nombre_usuario
-        form.email.data = current_user.email
+        form.nombre_usuario.data = usuario.nombre_usuario
+        form.email.data = usuario.email
     
-    return render_template('auth/profile.html', title='Mi Perfil', form=form)
+    return render_template('auth/profile.html', title='Mi Perfil', form=form, usuario=usuario)
 
 @auth_bp.route('/edit-user/<int:id>', methods=['POST'])
 @login_required
@@ -106,6 +112,7 @@ def edit_user(id):
     user.activo = 'activo' in request.form
     
     db.session.commit()
+    invalidar_usuario(user.id)
     flash(f'Usuario {user.nombre_usuario} actualizado correctamente.', 'success')
     return redirect(url_for('auth.manage_users'))
 
@@ -133,6 +140,7 @@ def delete_user(id):
     nombre = user.nombre_usuario
     db.session.delete(user)
     db.session.commit()
+    invalidar_usuario(id)
     flash(f'Usuario {nombre} eliminado correctamente.', 'success')
     return redirect(url_for('auth.manage_users'))
 
@@ -159,6 +167,7 @@ def toggle_status(id):
     
     user.activo = nuevo_estado
     db.session.commit()
+    invalidar_usuario(user.id)
     
     estado_texto = 'activado' if nuevo_estado else 'desactivado'
     return jsonify({'success': True, 'message': f'Usuario {estado_texto} correctamente.'})
@@ -1,9 +1,15 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta, date
 from sqlalchemy import func, and_
 from app import db
-from app.models import Producto, Venta, DetalleVenta
+from app.models import Producto, Venta, DetalleVenta, Generacion, ReposicionProducto
+from app import reposicion, resumen
+from app.escritura_diferida import ultimos_accesos
+from app.replica import en_replica
+from app.cache import (
+    cache_dashboard, cache_ventas, cache_validadores, cache_periodos, cache_configuracion, cache_usuarios
+)
 
 main_bp = Blueprint('main', __name__)
 
@@ -14,107 +20,76 @@ def index():
         return redirect(url_for('main.dashboard'))
     return render_template('landing.html', title='Court-Side Tennis Club')
 
+def _calcular_estadisticas(hoy):
+    """Totales de ventas del día, semana y mes, y valor del inventario"""
+    inicio_mes = hoy.replace(day=1)
+    inicio_semana = hoy - timedelta(days=hoy.weekday())
+    
+    # Estadísticas de productos
+    total_productos = Producto.query.count()
+    valor_inventario = db.session.query(
+        func.sum(Producto.stock * Producto.precio_venta)
+    ).scalar() or 0
+    
+    # Estadísticas de ventas (leídas de los resúmenes diarios)
+    return {
+        'ventas_mes': resumen.totales_ventas(inicio_mes),
+        'ventas_semana': resumen.totales_ventas(inicio_semana),
+        'ventas_hoy': resumen.totales_dia(hoy),
+        'total_productos': total_productos,
+        'valor_inventario': float(valor_inventario)
+    }
+
 @main_bp.route('/dashboard')
 @login_required
+@en_replica
 def dashboard():
     """Dashboard principal con estadísticas y resumen"""
     
     # Obtener fechas para estadísticas
     hoy = datetime.now().date()
     inicio_mes = hoy.replace(day=1)
-    inicio_semana = hoy - timedelta(days=hoy.weekday())
     
-    # Estadísticas de ventas del mes
-    ventas_mes = db.session.query(
-        func.count(Venta.id).label('cantidad'),
-        func.sum(Venta.total).label('total')
-    ).filter(
-        Venta.fecha >= inicio_mes
-    ).first()
+    # Los bloques calculados se guardan en caché hasta que cambie la generación de ventas
+    generacion = Generacion.obtener('ventas')
+    obsoleto_permitido = current_app.config.get('DASHBOARD_CACHE_SWR', True)
     
-    # Estadísticas de ventas de la semana
-    ventas_semana = db.session.query(
-        func.count(Venta.id).label('cantidad'),
-        func.sum(Venta.total).label('total')
-    ).filter(
-        Venta.fecha >= inicio_semana
-    ).first()
+    estadisticas = dict(cache_dashboard.obtener(
+        ('estadisticas', hoy), generacion,
+        lambda: _calcular_estadisticas(hoy),
+        obsoleto_permitido=obsoleto_permitido))
     
-    # Estadísticas de ventas de hoy
-    ventas_hoy = db.session.query(
-        func.count(Venta.id).label('cantidad'),
-        func.sum(Venta.total).label('total')
-    ).filter(
-        func.date(Venta.fecha) == hoy
-    ).first()
+    # Productos más vendidos del mes
+    productos_mas_vendidos = cache_dashboard.obtener(
+        ('productos_mas_vendidos', inicio_mes), generacion,
+        lambda: resumen.productos_mas_vendidos(inicio_mes),
+        obsoleto_permitido=obsoleto_permitido)
     
-    # Productos con bajo stock
-    productos_bajo_stock = Producto.query.filter(
-        Producto.stock <= 5
-    ).order_by(Producto.stock.asc()).limit(10).all()
+    # Ventas por categoría del mes
+    ventas_por_categoria = cache_dashboard.obtener(
+        ('ventas_por_categoria', inicio_mes), generacion,
+        lambda: resumen.ventas_por_categoria(inicio_mes),
+        obsoleto_permitido=obsoleto_permitido)
     
-    # Productos más vendidos del mes
-    productos_mas_vendidos = db.session.query(
-        Producto.nombre,
-        func.sum(DetalleVenta.cantidad).label('cantidad_vendida'),
-        func.sum(DetalleVenta.subtotal).label('total_vendido')
-    ).join(
-        DetalleVenta, DetalleVenta.producto_id == Producto.id
-    ).join(
-        Venta, Venta.id == DetalleVenta.venta_id
-    ).filter(
-        Venta.fecha >= inicio_mes
-    ).group_by(
-        Producto.id, Producto.nombre
-    ).order_by(
-        func.sum(DetalleVenta.cantidad).desc()
-    ).limit(5).all()
+    # Productos con bajo stock: los más urgentes según el último cálculo de reposición
+    if reposicion.calculada():
+        consulta = reposicion.consulta_a_reponer()
+        productos_bajo_stock = [
+            r.producto for r in consulta.order_by(
+                ReposicionProducto.prioridad, ReposicionProducto.producto_id).limit(10)
+        ]
+        estadisticas['productos_bajo_stock_count'] = consulta.count()
+    else:
+        productos_bajo_stock = Producto.query.filter(
+            Producto.stock <= 5
+        ).order_by(Producto.stock.asc()).limit(10).all()
+        estadisticas['productos_bajo_stock_count'] = len(productos_bajo_stock)
     
     # Últimas ventas
     ultimas_ventas = Venta.query.order_by(
         Venta.fecha.desc()
     ).limit(5).all()
     
-    # Estadísticas de productos
-    total_productos = Producto.query.count()
-    valor_inventario = db.session.query(
-        func.sum(Producto.stock * Producto.precio_venta)
-    ).scalar() or 0
-    
-    # Ventas por categoría del mes
-    ventas_por_categoria = db.session.query(
-        Producto.categoria,
-        func.sum(DetalleVenta.cantidad).label('cantidad'),
-        func.sum(DetalleVenta.subtotal).label('total')
-    ).join(
-        DetalleVenta, DetalleVenta.producto_id == Producto.id
-    ).join(
-        Venta, Venta.id == DetalleVenta.venta_id
-    ).filter(
-        Venta.fecha >= inicio_mes
-    ).group_by(
-        Producto.categoria
-    ).all()
-    
-    # Preparar datos para el template
-    estadisticas = {
-        'ventas_mes': {
-            'cantidad': ventas_mes.cantidad or 0,
-            'total': float(ventas_mes.total) if ventas_mes.total else 0
-        },
-        'ventas_semana': {
-            'cantidad': ventas_semana.cantidad or 0,
-            'total': float(ventas_semana.total) if ventas_semana.total else 0
-        },
-        'ventas_hoy': {
-            'cantidad': ventas_hoy.cantidad or 0,
-            'total': float(ventas_hoy.total) if ventas_hoy.total else 0
-        },
-        'total_productos': total_productos,
-        'valor_inventario': float(valor_inventario),
-        'productos_bajo_stock_count': len(productos_bajo_stock)
-    }
-    
     return render_template('dashboard.html',
                          title='Dashboard',
                          estadisticas=estadisticas,
@@ -123,6 +98,14 @@ def dashboard():
                          ultimas_ventas=ultimas_ventas,
                          ventas_por_categoria=ventas_por_categoria)
 
+@main_bp.route('/api/cache')
+@login_required
+def api_cache():
+    """API con los contadores de aciertos y fallos de las cachés en memoria"""
+    caches = (cache_dashboard, cache_ventas, cache_validadores, cache_periodos, cache_configuracion,
+              cache_usuarios, ultimos_accesos)
+    return jsonify([cache.estadisticas() for cache in caches])
+
 @main_bp.route('/reportes')
 @login_required
 def reportes():
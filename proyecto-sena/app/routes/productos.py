@@ -1,12 +1,16 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
 from flask_login import login_required, current_user
-from sqlalchemy import or_
 from app import db
-from app.models import Producto, Configuracion
+from app.models import Producto, Configuracion, Generacion, ReposicionProducto, MovimientoInventario
 from app.forms import ProductoForm, AjusteInventarioForm
-from datetime import datetime
-import os
-from werkzeug.utils import secure_filename
+from app import almacen, busqueda, importacion, inventario, kardex, reposicion
+from app.autocompletado import indice_productos, stock_actual
+from app.consultas import parsear_dia
+from app.paginacion import paginar_por_cursor
+from app.exportacion import filas_en_streaming, parametros_exportacion, respuesta_exportacion
+from sqlalchemy import select
+from datetime import date, timedelta
+import io
 
 productos_bp = Blueprint('productos', __name__)
 
@@ -24,19 +28,22 @@ def listar():
     query = Producto.query
     
     if search:
-        search = f"%{search}%"
-        query = query.filter(
-            or_(
-                Producto.nombre.like(search),
-                Producto.descripcion.like(search)
-            )
-        )
+        # Índice de texto completo (ordenado por relevancia) o LIKE como respaldo
+        query = busqueda.filtrar(query, search)
     
     if categoria:
         query = query.filter_by(categoria=categoria)
     
-    productos = query.order_by(Producto.nombre).paginate(
-        page=page, per_page=current_app.config['ITEMS_POR_PAGINA'], error_out=False)
+    if search or not current_app.config.get('PAGINACION_POR_CURSOR'):
+        # Los resultados de búsqueda se ordenan por relevancia: paginación por número de página
+        productos = query.order_by(Producto.nombre).paginate(
+            page=page, per_page=current_app.config['ITEMS_POR_PAGINA'], error_out=False)
+    else:
+        productos = paginar_por_cursor(
+            query,
+            [(Producto.nombre, False), (Producto.id, False)],
+            cursor=request.args.get('cursor'),
+            per_page=current_app.config['ITEMS_POR_PAGINA'])
     
     return render_template('productos/listar.html', 
                          title='Productos', 
@@ -51,44 +58,41 @@ def agregar():
     
     if form.validate_on_submit():
         # Manejar la carga de la imagen
-        imagen_nombre = None
+        subida = None
         if 'imagen' in request.files:
             archivo = request.files['imagen']
             if archivo and allowed_file(archivo.filename):
-                filename = secure_filename(archivo.filename)
-                # Guardar con un nombre único basado en la fecha y hora
-                nombre_base, extension = os.path.splitext(filename)
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                filename = f"{nombre_base}_{timestamp}{extension}"
-                
-                # Crear directorio de uploads si no existe
-                upload_folder = os.path.join(current_app.root_path, 'static/uploads')
-                os.makedirs(upload_folder, exist_ok=True)
-                
-                # Guardar el archivo
-                archivo.save(os.path.join(upload_folder, filename))
-                imagen_nombre = filename
-        
-        # Crear el producto (guardar imagen si se cargó)
-        producto = Producto(
-            codigo=form.codigo.data,
-            nombre=form.nombre.data,
-            descripcion=form.descripcion.data,
-            precio_compra=form.precio_compra.data,
-            precio_venta=form.precio_venta.data,
-            stock=form.stock_inicial.data,
-            stock_minimo=form.stock_minimo.data,
-            categoria=form.categoria.data,
-            marca=form.marca.data,
-            talla=form.talla.data,
-            color=form.color.data,
-            imagen=imagen_nombre,
-            activo=True
-        )
-        
-        db.session.add(producto)
+                # Guardar una sola vez por contenido; el archivo entra en el almacén tras el commit
+                subida = almacen.guardar_subida(archivo)
         
-        db.session.commit()
+        try:
+            # Crear el producto (guardar imagen si se cargó)
+            producto = Producto(
+                codigo=form.codigo.data,
+                nombre=form.nombre.data,
+                descripcion=form.descripcion.data,
+                precio_compra=form.precio_compra.data,
+                precio_venta=form.precio_venta.data,
+                stock=form.stock_inicial.data,
+                stock_minimo=form.stock_minimo.data,
+                categoria=form.categoria.data,
+                marca=form.marca.data,
+                talla=form.talla.data,
+                color=form.color.data,
+                imagen=subida.nombre if subida else None,
+                activo=True
+            )
+            
+            db.session.add(producto)
+            db.session.flush()  # Para obtener el ID del producto
+            kardex.registrar('alta', {producto.id: producto.stock or 0}, usuario_id=current_user.id)
+            Generacion.incrementar('ventas')
+            
+            db.session.commit()
+            # Mover la imagen al almacén y generar las miniaturas en segundo plano
+            almacen.confirmar_subida(subida)
+        finally:
+            almacen.descartar_subida(subida)
         
         flash('Producto agregado correctamente.', 'success')
         return redirect(url_for('productos.detalle', id=producto.id))
@@ -101,10 +105,13 @@ def agregar():
 @login_required
 def detalle(id):
     producto = Producto.query.get_or_404(id)
+    movimientos_recientes = MovimientoInventario.query.filter_by(producto_id=producto.id).order_by(
+        MovimientoInventario.fecha.desc(), MovimientoInventario.id.desc()).limit(10).all()
     
     return render_template('productos/detalle.html', 
                          title=producto.nombre, 
-                         producto=producto)
+                         producto=producto,
+                         movimientos_recientes=movimientos_recientes)
 
 @productos_bp.route('/editar/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -114,46 +121,51 @@ def editar(id):
     
     if form.validate_on_submit():
         # Manejar la carga de la imagen
+        imagen_anterior = None
+        subida = None
         if 'imagen' in request.files:
             archivo = request.files['imagen']
             if archivo and allowed_file(archivo.filename):
-                # Eliminar la imagen anterior si existe
-                if producto.imagen:
-                    try:
-                        os.remove(os.path.join(
-                            current_app.root_path, 
-                            'static/uploads', 
-                            producto.imagen
-                        ))
-                    except OSError:
-                        pass
-                
-                # Guardar la nueva imagen
-                filename = secure_filename(archivo.filename)
-                nombre_base, extension = os.path.splitext(filename)
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                filename = f"{nombre_base}_{timestamp}{extension}"
-                
-                upload_folder = os.path.join(current_app.root_path, 'static/uploads')
-                os.makedirs(upload_folder, exist_ok=True)
-                
-                archivo.save(os.path.join(upload_folder, filename))
-                producto.imagen = filename
+                # Guardar la nueva imagen y liberar la anterior
+                subida = almacen.guardar_subida(archivo)
+                if producto.imagen != subida.nombre:
+                    almacen.liberar(producto.imagen)
+                    imagen_anterior = producto.imagen
+                else:
+                    # Mismo contenido: no sumar una referencia de más
+                    almacen.liberar(subida.nombre)
+                producto.imagen = subida.nombre
         
-        # Actualizar los demás campos
-        producto.codigo = form.codigo.data
-        producto.nombre = form.nombre.data
-        producto.descripcion = form.descripcion.data
-        producto.precio_compra = form.precio_compra.data
-        producto.precio_venta = form.precio_venta.data
-        producto.stock = form.stock_inicial.data if form.stock_inicial.data is not None else producto.stock
-        producto.stock_minimo = form.stock_minimo.data
-        producto.categoria = form.categoria.data
-        producto.marca = form.marca.data
-        producto.talla = form.talla.data
-        producto.color = form.color.data
+        try:
+            # Actualizar los demás campos
+            producto.codigo = form.codigo.data
+            producto.nombre = form.nombre.data
+            producto.descripcion = form.descripcion.data
+            producto.precio_compra = form.precio_compra.data
+            producto.precio_venta = form.precio_venta.data
+            if form.stock_inicial.data is not None:
+                # Stock leído con bloqueo: una venta confirmada desde la carga del formulario
+                # no se pisa, y el kardex anota la diferencia que de verdad se aplica
+                stock_actual = db.session.query(Producto.stock).filter(
+                    Producto.id == producto.id).with_for_update().scalar() or 0
+                if form.stock_inicial.data != stock_actual:
+                    kardex.registrar('edicion', {producto.id: form.stock_inicial.data - stock_actual},
+                                     usuario_id=current_user.id)
+                producto.stock = form.stock_inicial.data
+            producto.stock_minimo = form.stock_minimo.data
+            producto.categoria = form.categoria.data
+            producto.marca = form.marca.data
+            producto.talla = form.talla.data
+            producto.color = form.color.data
+            Generacion.incrementar('ventas')
+            
+            db.session.commit()
+            almacen.confirmar_subida(subida)
+        finally:
+            almacen.descartar_subida(subida)
         
-        db.session.commit()
+        # Borrar la imagen anterior solo si ningún otro producto la usa
+        almacen.eliminar_si_huerfano(imagen_anterior)
         
         flash('Producto actualizado correctamente.', 'success')
         return redirect(url_for('productos.detalle', id=producto.id))
@@ -163,6 +175,52 @@ def editar(id):
                          form=form, 
                          producto=producto)
 
+@productos_bp.route('/ajustar/<int:id>', methods=['GET', 'POST'])
+@login_required
+def ajustar_inventario(id):
+    """Entrada o salida manual de unidades, anotada en el kardex"""
+    producto = Producto.query.get_or_404(id)
+    form = AjusteInventarioForm()
+    
+    if form.validate_on_submit():
+        try:
+            kardex.ajustar(producto.id, form.cantidad.data,
+                           usuario_id=current_user.id, notas=form.notas.data or None)
+        except inventario.StockInsuficiente:
+            db.session.rollback()
+            flash(f'No se pueden quitar {-form.cantidad.data} unidades: '
+                  f'solo hay {producto.stock} en stock.', 'danger')
+        else:
+            Generacion.incrementar('ventas')
+            db.session.commit()
+            flash('Inventario ajustado correctamente.', 'success')
+            return redirect(url_for('productos.detalle', id=producto.id))
+    
+    return render_template('productos/ajustar_inventario.html',
+                         title='Ajustar Inventario',
+                         form=form,
+                         producto=producto)
+
+@productos_bp.route('/<int:id>/kardex')
+@login_required
+def kardex_producto(id):
+    """Movimientos de un producto con su saldo (parámetros: desde, hasta)"""
+    producto = Producto.query.get_or_404(id)
+    hasta = parsear_dia(request.args.get('hasta'), date.today())
+    desde = parsear_dia(request.args.get('desde'), hasta - timedelta(days=30))
+    if desde > hasta:
+        desde, hasta = hasta, desde
+    saldo_inicial, movimientos, saldo_final = kardex.movimientos(producto.id, desde, hasta)
+    
+    return render_template('productos/kardex.html',
+                         title=f'Kardex: {producto.nombre}',
+                         producto=producto,
+                         desde=desde,
+                         hasta=hasta,
+                         saldo_inicial=saldo_inicial,
+                         movimientos=movimientos,
+                         saldo_final=saldo_final)
+
 @productos_bp.route('/eliminar/<int:id>', methods=['POST'])
 @login_required
 def eliminar(id):
@@ -172,28 +230,86 @@ def eliminar(id):
     
     producto = Producto.query.get_or_404(id)
     
-    # Eliminar la imagen si existe
-    if producto.imagen:
-        try:
-            os.remove(os.path.join(
-                current_app.root_path, 
-                'static/uploads', 
-                producto.imagen
-            ))
-        except OSError:
-            pass
+    imagen = producto.imagen
+    almacen.liberar(imagen)
     
+    ReposicionProducto.query.filter_by(producto_id=producto.id).delete(synchronize_session=False)
     db.session.delete(producto)
+    Generacion.incrementar('ventas')
     db.session.commit()
     
+    # Eliminar la imagen si ya ningún producto la usa
+    almacen.eliminar_si_huerfano(imagen)
+    
     flash('Producto eliminado correctamente.', 'success')
     return redirect(url_for('productos.listar'))
 
 
+@productos_bp.route('/importar', methods=['POST'])
+@login_required
+def importar():
+    """Importación masiva de productos desde un archivo CSV"""
+    if not current_user.es_admin:
+        return jsonify({'success': False, 'message': 'No tienes permiso para realizar esta acción.'}), 403
+    
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename.lower().endswith('.csv'):
+        return jsonify({'success': False, 'message': 'Debes enviar un archivo CSV.'}), 400
+    
+    # Leer el archivo en streaming, sin cargarlo entero en memoria
+    texto = io.TextIOWrapper(archivo.stream, encoding='utf-8-sig', newline='')
+    try:
+        informe = importacion.importar_csv(texto)
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'El archivo debe estar codificado en UTF-8.'}), 400
+    
+    return jsonify(dict(informe, success=True))
+
+@productos_bp.route('/exportar')
+@login_required
+def exportar():
+    """Exporta el catálogo en CSV o NDJSON (parámetros: formato, gzip, categoria)"""
+    formato, comprimir = parametros_exportacion(request.args)
+    columnas = ['id', 'codigo', 'nombre', 'descripcion', 'categoria', 'marca', 'talla', 'color',
+                'precio_compra', 'precio_venta', 'stock', 'stock_minimo', 'activo',
+                'creado_en', 'actualizado_en']
+    consulta = select(*[getattr(Producto, c) for c in columnas]).order_by(Producto.id)
+    categoria = request.args.get('categoria', '')
+    if categoria:
+        consulta = consulta.where(Producto.categoria == categoria)
+    
+    return respuesta_exportacion('productos', columnas, filas_en_streaming(consulta),
+                                 formato=formato, comprimir=comprimir)
+
 @productos_bp.route('/bajo-stock')
 @login_required
 def bajo_stock():
+    """
+    Productos a reponer ordenados por urgencia (días de cobertura) según el
+    último cálculo de reposición. Mientras no se haya calculado, se usa el
+    umbral global de stock de la configuración.
+    """
     page = request.args.get('page', 1, type=int)
+    per_page = current_app.config['ITEMS_POR_PAGINA']
+    
+    if reposicion.calculada():
+        query = reposicion.consulta_a_reponer()
+        if current_app.config.get('PAGINACION_POR_CURSOR'):
+            productos = paginar_por_cursor(
+                query,
+                [(ReposicionProducto.prioridad, False), (ReposicionProducto.producto_id, False)],
+                cursor=request.args.get('cursor'),
+                per_page=per_page)
+        else:
+            productos = query.order_by(
+                ReposicionProducto.prioridad, ReposicionProducto.producto_id
+            ).paginate(page=page, per_page=per_page, error_out=False)
+        return render_template('productos/bajo_stock.html',
+                             title='Productos con Bajo Stock',
+                             productos=productos,
+                             reposiciones=True,
+                             umbral=None)
     
     # Obtener el umbral de stock mínimo (puede configurarse en la base de datos)
     umbral = Configuracion.get_config('umbral_alerta_stock', '5')
@@ -203,19 +319,28 @@ def bajo_stock():
         umbral = 5
     
     # Filtrar productos con stock menor o igual al umbral
-    productos = Producto.query.filter(
+    query = Producto.query.filter(
         Producto.stock <= umbral
-    ).order_by(
-        Producto.stock.asc()
-    ).paginate(
-        page=page, 
-        per_page=current_app.config['ITEMS_POR_PAGINA'], 
-        error_out=False
     )
+    if current_app.config.get('PAGINACION_POR_CURSOR'):
+        productos = paginar_por_cursor(
+            query,
+            [(Producto.stock, False), (Producto.id, False)],
+            cursor=request.args.get('cursor'),
+            per_page=per_page)
+    else:
+        productos = query.order_by(
+            Producto.stock.asc()
+        ).paginate(
+            page=page, 
+            per_page=per_page, 
+            error_out=False
+        )
     
     return render_template('productos/bajo_stock.html',
                          title='Productos con Bajo Stock',
                          productos=productos,
+                         reposiciones=False,
                          umbral=umbral)
 
 @productos_bp.route('/api/productos')
@@ -224,19 +349,31 @@ def api_productos():
     """API para autocompletado en formularios de ventas"""
     search = request.args.get('q', '')
     
-    query = Producto.query.filter(
-        or_(
-            Producto.nombre.ilike(f'%{search}%')
-        )
-    ).limit(10)
-    
-    productos = [{
-        'id': p.id,
-        'codigo': p.codigo,
-        'nombre': p.nombre,
-        'precio': float(p.precio_venta) if p.precio_venta else 0,
-        'stock': p.stock,
-        'imagen': p.imagen
-    } for p in query]
-    
-    return jsonify(productos)
+    # Índice en memoria sobre nombre, código y marca
+    indice_productos.refrescar()
+    encontrados = indice_productos.buscar(search)
+    
+    # El stock se lee en cada petición para que siempre esté al día
+    stock = stock_actual([p[0] for p in encontrados])
+    
+    productos = []
+    for producto_id, codigo, nombre, precio, imagen, _ in encontrados:
+        if producto_id not in stock:
+            # Producto eliminado desde el último refresco
+            indice_productos.quitar(producto_id)
+            continue
+        productos.append({
+            'id': producto_id,
+            'codigo': codigo,
+            'nombre': nombre,
+            'precio': precio,
+            'stock': stock[producto_id],
+            'imagen': imagen
+        })
+    
+    # Respuestas idénticas se contestan con 304 gracias al ETag
+    response = jsonify(productos)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
@@ -1,17 +1,18 @@
-from flask import Blueprint, render_template, request
-from flask_login import login_required
+import json
+from flask import Blueprint, jsonify, render_template, request, url_for
+from flask_login import current_user, login_required
 from datetime import datetime, timedelta, date
-from sqlalchemy import func
-from app import db
-from app.models import Producto, Venta, DetalleVenta
+from sqlalchemy import func, select
+from app import db, analitica, reportes
+from app.models import Producto, Venta, DetalleVenta, TrabajoReporte
+from app.consultas import ventas_en_dias, parsear_dia
+from app.exportacion import filas_en_streaming, parametros_exportacion, respuesta_exportacion
+from app.replica import lecturas_en_replica
 
 reportes_bp = Blueprint('reportes', __name__)
 
-@reportes_bp.route('/reportes/ventas')
-@login_required
-def reporte_ventas():
-    """Reporte detallado de ventas por período"""
-    # Valores por defecto (último mes)
+def _periodo():
+    """Período del reporte a partir de los parámetros inicio y fin (por defecto, el último mes)"""
     hoy = date.today()
     periodo_inicio = request.args.get('inicio', (hoy.replace(day=1) - timedelta(days=30)).strftime('%Y-%m-%d'))
     periodo_fin = request.args.get('fin', hoy.strftime('%Y-%m-%d'))
@@ -22,76 +23,196 @@ def reporte_ventas():
     except ValueError:
         inicio_dt = hoy.replace(day=1) - timedelta(days=30)
         fin_dt = hoy
+    return inicio_dt, fin_dt
 
-    # Resumen general
-    resumen = db.session.query(
-        func.count(Venta.id).label('total_ventas'),
-        func.sum(Venta.total).label('ingresos_totales'),
-        func.avg(Venta.total).label('ticket_promedio')
-    ).filter(
-        Venta.fecha.between(inicio_dt, fin_dt + timedelta(days=1))
-    ).first()
-
-    # Productos más vendidos por cantidad
-    top_cantidad = db.session.query(
-        Producto.nombre,
-        func.sum(DetalleVenta.cantidad).label('cantidad_total')
-    ).join(
-        DetalleVenta, DetalleVenta.producto_id == Producto.id
-    ).join(
-        Venta, Venta.id == DetalleVenta.venta_id
-    ).filter(
-        Venta.fecha.between(inicio_dt, fin_dt + timedelta(days=1))
-    ).group_by(
-        Producto.id, Producto.nombre
-    ).order_by(
-        func.sum(DetalleVenta.cantidad).desc()
-    ).limit(10).all()
-
-    # Productos con mayores ingresos
-    top_ingresos = db.session.query(
-        Producto.nombre,
-        func.sum(DetalleVenta.subtotal).label('ingresos_totales')
-    ).join(
-        DetalleVenta, DetalleVenta.producto_id == Producto.id
-    ).join(
-        Venta, Venta.id == DetalleVenta.venta_id
-    ).filter(
-        Venta.fecha.between(inicio_dt, fin_dt + timedelta(days=1))
-    ).group_by(
-        Producto.id, Producto.nombre
-    ).order_by(
-        func.sum(DetalleVenta.subtotal).desc()
-    ).limit(10).all()
-
-    # Ventas por día (para gráfico)
-    ventas_diarias = db.session.query(
-        func.date(Venta.fecha).label('fecha'),
-        func.count(Venta.id).label('cantidad'),
-        func.sum(Venta.total).label('total')
-    ).filter(
-        Venta.fecha.between(inicio_dt, fin_dt + timedelta(days=1))
-    ).group_by(
-        func.date(Venta.fecha)
-    ).order_by(
-        'fecha'
-    ).all()
-    
-    # Convertir fechas a strings para el template
-    ventas_diarias = [
-        {
-            'fecha': v.fecha.strftime('%Y-%m-%d') if v.fecha else '',
-            'cantidad': v.cantidad or 0,
-            'total': float(v.total) if v.total else 0
-        }
-        for v in ventas_diarias
-    ]
+@reportes_bp.route('/reportes/ventas')
+@login_required
+def reporte_ventas():
+    """
+    Reporte detallado de ventas por período. Con `trabajo=<id>` muestra el
+    resultado guardado de un reporte calculado en segundo plano; con
+    `comparar=anterior|anio`, las variaciones frente al período previo.
+    """
+    trabajo_id = request.args.get('trabajo')
+    comparar = request.args.get('comparar')
+    comparacion = None
+    if trabajo_id:
+        trabajo = TrabajoReporte.query.filter_by(id=trabajo_id, estado='terminado').first_or_404()
+        inicio_dt, fin_dt = trabajo.inicio, trabajo.fin
+        filtros = json.loads(trabajo.filtros)
+        datos = reportes.resultado(trabajo)
+    else:
+        # El cálculo del período lee de la réplica si hay una al día
+        with lecturas_en_replica():
+            inicio_dt, fin_dt = _periodo()
+            filtros = reportes.filtros_reporte(request.args)
+            if comparar in reportes.MODOS_COMPARACION:
+                # El resumen y los productos del período salen de la misma comparación
+                comparacion = reportes.comparar_periodos(inicio_dt, fin_dt, comparar, filtros)
+                datos = {
+                    'resumen': {metrica: valores['actual'] for metrica, valores in comparacion['resumen'].items()},
+                    'top_cantidad': comparacion['top_cantidad'],
+                    'top_ingresos': comparacion['top_ingresos'],
+                    'ventas_diarias': reportes.ventas_diarias(inicio_dt, fin_dt, filtros),
+                }
+            else:
+                datos = reportes.calcular_reporte_ventas(inicio_dt, fin_dt, filtros)
 
     return render_template('reportes/ventas.html',
                          title='Reporte de Ventas',
-                         resumen=resumen,
-                         top_cantidad=top_cantidad,
-                         top_ingresos=top_ingresos,
-                         ventas_diarias=ventas_diarias,
                          periodo_inicio=inicio_dt,
-                         periodo_fin=fin_dt)
+                         periodo_fin=fin_dt,
+                         filtros=filtros,
+                         comparacion=comparacion,
+                         modos_comparacion=reportes.MODOS_COMPARACION,
+                         **datos)
+
+def _estado_trabajo(trabajo):
+    return {
+        'id': trabajo.id,
+        'estado': trabajo.estado,
+        'inicio': trabajo.inicio.isoformat(),
+        'fin': trabajo.fin.isoformat(),
+        'filtros': json.loads(trabajo.filtros),
+        'creado_en': trabajo.creado_en.isoformat() if trabajo.creado_en else None,
+        'terminado_en': trabajo.terminado_en.isoformat() if trabajo.terminado_en else None,
+        'error': trabajo.error,
+        'url_estado': url_for('reportes.estado_trabajo', id=trabajo.id),
+        'url_resultado': url_for('reportes.resultado_trabajo', id=trabajo.id),
+        'url_reporte': url_for('reportes.reporte_ventas', trabajo=trabajo.id),
+    }
+
+@reportes_bp.route('/reportes/ventas/trabajos', methods=['POST'])
+@login_required
+def solicitar_trabajo():
+    """
+    Encola el reporte de ventas de un período (inicio, fin, estado, metodo_pago
+    por formulario o JSON). Responde 202 con el id del trabajo, o 200 si el
+    resultado para los datos actuales ya estaba calculado.
+    """
+    parametros = request.get_json(silent=True) or request.form
+    hoy = date.today()
+    inicio_dt = parsear_dia(parametros.get('inicio'), None)
+    fin_dt = parsear_dia(parametros.get('fin'), hoy)
+    if inicio_dt is None or inicio_dt > fin_dt:
+        return jsonify({'error': 'Período no válido'}), 400
+
+    trabajo = reportes.solicitar_reporte_ventas(inicio_dt, fin_dt, reportes.filtros_reporte(parametros),
+                                                usuario_id=current_user.id)
+    codigo = 200 if trabajo.estado == 'terminado' else 202
+    response = jsonify(_estado_trabajo(trabajo))
+    response.status_code = codigo
+    response.headers['Location'] = url_for('reportes.estado_trabajo', id=trabajo.id)
+    return response
+
+@reportes_bp.route('/reportes/ventas/trabajos/<id>')
+@login_required
+def estado_trabajo(id):
+    """Estado de un trabajo de reporte (pendiente, en_proceso, terminado o error)"""
+    trabajo = TrabajoReporte.query.get_or_404(id)
+    return jsonify(_estado_trabajo(trabajo))
+
+@reportes_bp.route('/reportes/ventas/trabajos/<id>/resultado')
+@login_required
+def resultado_trabajo(id):
+    """Resultado guardado del trabajo; 202 mientras se calcula y 409 si falló"""
+    trabajo = TrabajoReporte.query.get_or_404(id)
+    if trabajo.estado == 'terminado':
+        return jsonify(reportes.resultado(trabajo))
+    if trabajo.estado == 'error':
+        return jsonify(_estado_trabajo(trabajo)), 409
+    response = jsonify(_estado_trabajo(trabajo))
+    response.status_code = 202
+    response.headers['Retry-After'] = '2'
+    return response
+
+@reportes_bp.route('/api/analitica')
+@login_required
+def api_analitica():
+    """
+    Totales ad hoc desde la instantánea columnar. `por` = producto, categoria,
+    metodo_pago, estado, dia, semana o mes; filtros opcionales desde, hasta,
+    estado, metodo_pago y categoria; con `top=N` solo los N mayores según
+    `medida` (total, unidades, lineas o ventas).
+    """
+    if not analitica.disponible():
+        return jsonify({'error': 'NumPy no está instalado'}), 503
+
+    por = request.args.get('por', 'categoria')
+    medida = request.args.get('medida', 'total')
+    if por not in analitica.AGRUPACIONES and por not in analitica.PERIODOS:
+        return jsonify({'error': f'Agrupación no válida: {por}'}), 400
+    if medida not in analitica.Grupo._fields[1:]:
+        return jsonify({'error': f'Medida no válida: {medida}'}), 400
+    filtros = {
+        'desde': parsear_dia(request.args.get('desde'), None),
+        'hasta': parsear_dia(request.args.get('hasta'), None),
+        'estado': request.args.get('estado') or None,
+        'metodo_pago': request.args.get('metodo_pago') or None,
+        'categoria': request.args.get('categoria') or None,
+    }
+
+    instantanea = analitica.instantanea()
+    if por in analitica.PERIODOS:
+        grupos = instantanea.por_periodo(por, **filtros)
+    elif request.args.get('top', type=int):
+        grupos = instantanea.top(por, request.args.get('top', type=int), medida, **filtros)
+    else:
+        grupos = instantanea.agrupar(por, **filtros)
+
+    filas = [dict(g._asdict(), total=float(g.total)) for g in grupos]
+    if por in analitica.PERIODOS:
+        for fila in filas:
+            fila['clave'] = fila['clave'].isoformat()
+    elif por == 'producto' and filas:
+        nombres = dict(db.session.query(Producto.id, Producto.nombre)
+                       .filter(Producto.id.in_([f['clave'] for f in filas])))
+        for fila in filas:
+            fila['nombre'] = nombres.get(fila['clave'])
+    return jsonify({'por': por, 'lineas_instantanea': len(instantanea), 'grupos': filas})
+
+@reportes_bp.route('/reportes/ventas/exportar')
+@login_required
+def exportar_ventas():
+    """
+    Exporta los agregados del reporte de ventas en CSV o NDJSON.
+    `agrupar=dia` (por defecto) da las ventas por día; `agrupar=producto`, las
+    unidades e ingresos por producto del período. Aplica los mismos filtros
+    (estado, metodo_pago) que el reporte y los añade al nombre del archivo.
+    """
+    inicio_dt, fin_dt = _periodo()
+    formato, comprimir = parametros_exportacion(request.args)
+    filtros = reportes.filtros_reporte(request.args)
+    condiciones = [ventas_en_dias(inicio_dt, fin_dt)] + reportes.condiciones_reporte(filtros)
+
+    if request.args.get('agrupar') == 'producto':
+        columnas = ['producto_id', 'codigo', 'producto', 'categoria', 'cantidad_total', 'ingresos_totales']
+        consulta = select(
+            Producto.id, Producto.codigo, Producto.nombre, Producto.categoria,
+            func.sum(DetalleVenta.cantidad), func.sum(DetalleVenta.subtotal)
+        ).join(
+            DetalleVenta, DetalleVenta.producto_id == Producto.id
+        ).join(
+            Venta, Venta.id == DetalleVenta.venta_id
+        ).where(
+            *condiciones
+        ).group_by(
+            Producto.id, Producto.codigo, Producto.nombre, Producto.categoria
+        ).order_by(func.sum(DetalleVenta.subtotal).desc())
+        nombre = 'reporte_productos'
+    else:
+        columnas = ['fecha', 'cantidad', 'total', 'ticket_promedio']
+        consulta = select(
+            func.date(Venta.fecha).label('fecha'),
+            func.count(Venta.id), func.sum(Venta.total), func.avg(Venta.total)
+        ).where(
+            *condiciones
+        ).group_by(
+            func.date(Venta.fecha)
+        ).order_by('fecha')
+        nombre = 'reporte_ventas_diarias'
+
+    nombre = '_'.join([nombre, f'{inicio_dt:%Y%m%d}', f'{fin_dt:%Y%m%d}']
+                      + [filtros[clave] for clave in sorted(filtros)])
+    return respuesta_exportacion(nombre, columnas, filas_en_streaming(consulta),
+                                 formato=formato, comprimir=comprimir)
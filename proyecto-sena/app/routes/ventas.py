@@ -1,13 +1,24 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
-from datetime import datetime, timedelta
-from sqlalchemy import func, extract, and_, or_
+from werkzeug.http import is_resource_modified
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import func, extract, and_, or_, select
+from sqlalchemy.orm import selectinload
 from app import db
 from app.models import (
-    Venta, DetalleVenta, Producto, Usuario, Configuracion
+    Venta, DetalleVenta, Producto, Usuario, Configuracion, Generacion
 )
 from app.forms import VentaForm, ClienteForm, FiltroVentasForm
+from app import inventario, kardex, registro_ventas, resumen
+from app.consultas import parsear_dia, ventas_en_dias, validador_ventas
+from app.paginacion import paginar_por_cursor
+from app.replica import en_replica, lecturas_en_replica
+from app.cache import cache_ventas, cache_validadores
+from app.exportacion import filas_en_streaming, parametros_exportacion, respuesta_exportacion
+import hashlib
 import json
+import uuid
 
 ventas_bp = Blueprint('ventas', __name__)
 
@@ -22,24 +33,17 @@ def listar():
     inicio_mes = hoy.replace(day=1)
     
     # Obtener fechas del formulario o usar valores por defecto (mes actual)
-    fecha_inicio = request.args.get('fecha_inicio', inicio_mes.strftime('%Y-%m-%d'))
-    fecha_fin = request.args.get('fecha_fin', hoy.strftime('%Y-%m-%d'))
-    
-    # Convertir a objetos de fecha para la consulta
-    try:
-        fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d')
-        fecha_fin_dt = datetime.strptime(fecha_fin, '%Y-%m-%d') + timedelta(days=1)  # Incluir todo el día
-    except (ValueError, TypeError):
-        fecha_inicio_dt = inicio_mes
-        fecha_fin_dt = hoy + timedelta(days=1)
+    fecha_inicio = parsear_dia(request.args.get('fecha_inicio'), inicio_mes)
+    fecha_fin = parsear_dia(request.args.get('fecha_fin'), hoy)
+    filtro_fecha = ventas_en_dias(fecha_inicio, fecha_fin)
     
     # Obtener filtros adicionales
-    estado = request.args.get('estado', '')
-    metodo_pago = request.args.get('metodo_pago', '')
+    estado = request.args.get('estado', '').strip()
+    metodo_pago = request.args.get('metodo_pago', '').strip()
     
     # Construir la consulta base
     query = Venta.query.filter(
-        Venta.fecha.between(fecha_inicio_dt, fecha_fin_dt)
+        filtro_fecha
     )
     
     # Aplicar filtros adicionales si existen
@@ -49,67 +53,32 @@ def listar():
         query = query.filter(Venta.metodo_pago == metodo_pago)
     
     # Ordenar por fecha más reciente primero
-    ventas = query.order_by(Venta.fecha.desc()).paginate(
-        page=page, per_page=current_app.config['ITEMS_POR_PAGINA'], error_out=False)
+    if current_app.config.get('PAGINACION_POR_CURSOR'):
+        ventas = paginar_por_cursor(
+            query,
+            [(Venta.fecha, True), (Venta.id, True)],
+            cursor=request.args.get('cursor'),
+            per_page=current_app.config['ITEMS_POR_PAGINA'])
+    else:
+        ventas = query.order_by(Venta.fecha.desc()).paginate(
+            page=page, per_page=current_app.config['ITEMS_POR_PAGINA'], error_out=False)
     
-    # Calcular totales
-    total_query = db.session.query(func.sum(Venta.total)).filter(
-        Venta.fecha.between(fecha_inicio_dt, fecha_fin_dt)
-    )
-    if estado:
-        total_query = total_query.filter(Venta.estado == estado)
-    if metodo_pago:
-        total_query = total_query.filter(Venta.metodo_pago == metodo_pago)
-    total_ventas = total_query.scalar() or 0
-    
-    total_ventas = float(total_ventas)
-    
-    # Obtener estadísticas por categoría
-    stats_query = db.session.query(
-        Producto.categoria,
-        func.sum(DetalleVenta.cantidad).label('cantidad'),
-        func.sum(DetalleVenta.subtotal).label('total')
-    ).join(
-        DetalleVenta, DetalleVenta.producto_id == Producto.id
-    ).join(
-        Venta, Venta.id == DetalleVenta.venta_id
-    ).filter(
-        Venta.fecha.between(fecha_inicio_dt, fecha_fin_dt)
-    )
-    if estado:
-        stats_query = stats_query.filter(Venta.estado == estado)
-    if metodo_pago:
-        stats_query = stats_query.filter(Venta.metodo_pago == metodo_pago)
-    stats_categorias = stats_query.group_by(
-        Producto.categoria
-    ).all()
-    
-    # Obtener los 5 productos más vendidos
-    top_productos_query = db.session.query(
-        Producto.nombre,
-        func.sum(DetalleVenta.cantidad).label('cantidad'),
-        func.sum(DetalleVenta.subtotal).label('total')
-    ).join(
-        DetalleVenta, DetalleVenta.producto_id == Producto.id
-    ).join(
-        Venta, Venta.id == DetalleVenta.venta_id
-    ).filter(
-        Venta.fecha.between(fecha_inicio_dt, fecha_fin_dt)
-    )
-    if estado:
-        top_productos_query = top_productos_query.filter(Venta.estado == estado)
-    if metodo_pago:
-        top_productos_query = top_productos_query.filter(Venta.metodo_pago == metodo_pago)
-    productos_mas_vendidos = top_productos_query.group_by(
-        Producto.id, Producto.nombre
-    ).order_by(
-        func.sum(DetalleVenta.cantidad).desc()
-    ).limit(5).all()
+    # Total, desglose por categoría y top 5 en una pasada sobre los resúmenes diarios.
+    # Se guardan por filtro normalizado: al paginar no se recalculan.
+    clave = ('listado', fecha_inicio, fecha_fin, estado or None, metodo_pago or None)
+    with lecturas_en_replica():
+        estadisticas = cache_ventas.obtener(
+            clave, Generacion.obtener('ventas'),
+            lambda: resumen.estadisticas_filtradas(fecha_inicio, fecha_fin, estado, metodo_pago),
+            obsoleto_permitido=False)
+    total_ventas = estadisticas['total']
+    stats_categorias = estadisticas['categorias']
+    productos_mas_vendidos = estadisticas['productos']
     
     # Pasar los filtros al template
     filtros = {
-        'fecha_inicio': fecha_inicio_dt.strftime('%Y-%m-%d'),
-        'fecha_fin': (fecha_fin_dt - timedelta(days=1)).strftime('%Y-%m-%d'),
+        'fecha_inicio': fecha_inicio.strftime('%Y-%m-%d'),
+        'fecha_fin': fecha_fin.strftime('%Y-%m-%d'),
         'estado': estado,
         'metodo_pago': metodo_pago
     }
@@ -137,54 +106,31 @@ def nueva():
     
     if form.validate_on_submit():
         try:
-            # Crear la venta
-            venta = Venta(
-                total=0  # Se calculará con los detalles
-            )
-            
-            db.session.add(venta)
-            db.session.flush()  # Para obtener el ID de la venta
-            
-            # Procesar los detalles de la venta
-            total_venta = 0
+            # Crear la venta con sus detalles y descontar el stock
             detalles = json.loads(form.detalles_venta.data)
-            
-            for detalle in detalles:
-                producto = Producto.query.get(detalle['producto_id'])
-                if not producto:
-                    continue
-                
-                cantidad = int(detalle['cantidad'])
-                precio_unitario = float(detalle['precio_unitario'])
-                subtotal = cantidad * precio_unitario
-                
-                # Crear el detalle de la venta
-                detalle_venta = DetalleVenta(
-                    venta_id=venta.id,
-                    producto_id=producto.id,
-                    cantidad=cantidad,
-                    subtotal=subtotal
-                )
-                
-                db.session.add(detalle_venta)
-                total_venta += subtotal
-                
-                # Actualizar el stock del producto
-                producto.stock -= cantidad
-            
-            # Actualizar el total de la venta
-            venta.total = total_venta
+            venta, creada = registro_ventas.registrar_venta_idempotente(
+                detalles, clave_idempotencia=form.clave_idempotencia.data or None)
             
             db.session.commit()
             
-            flash('Venta registrada exitosamente!', 'success')
+            if creada:
+                flash('Venta registrada exitosamente!', 'success')
+            else:
+                flash('Esta venta ya estaba registrada.', 'info')
             return redirect(url_for('ventas.detalle', id=venta.id))
             
+        except inventario.StockInsuficiente as e:
+            db.session.rollback()
+            for faltante in e.faltantes:
+                flash(faltante['mensaje'], 'warning')
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f'Error al registrar la venta: {str(e)}')
             flash('Ocurrió un error al registrar la venta. Por favor, inténtalo de nuevo.', 'danger')
     
+    if not form.clave_idempotencia.data:
+        form.clave_idempotencia.data = uuid.uuid4().hex
+    
     return render_template('ventas/nueva.html',
                          title='Nueva Venta',
                          form=form)
@@ -192,30 +138,82 @@ def nueva():
 @ventas_bp.route('/<int:id>')
 @login_required
 def detalle(id):
-    venta = Venta.query.get_or_404(id)
+    # Venta + (detalles JOIN productos) en dos sentencias, sin importar el número de líneas
+    venta = Venta.query.options(
+        selectinload(Venta.detalles).joinedload(DetalleVenta.producto)
+    ).filter_by(id=id).first_or_404()
     return render_template('ventas/detalle.html',
                          title=f'Venta #{venta.id}',
                          venta=venta)
 
 
+@ventas_bp.route('/exportar')
+@login_required
+def exportar():
+    """
+    Exporta las ventas del período con sus líneas de detalle, una fila por línea.
+    Acepta los mismos filtros que el listado y los parámetros formato y gzip.
+    """
+    formato, comprimir = parametros_exportacion(request.args)
+    hoy = datetime.now().date()
+    fecha_inicio = parsear_dia(request.args.get('fecha_inicio'), hoy.replace(day=1))
+    fecha_fin = parsear_dia(request.args.get('fecha_fin'), hoy)
+    
+    consulta = select(
+        Venta.id, Venta.fecha, Venta.estado, Venta.metodo_pago, Venta.total,
+        DetalleVenta.id, Producto.codigo, Producto.nombre, DetalleVenta.cantidad, DetalleVenta.subtotal
+    ).outerjoin(
+        DetalleVenta, DetalleVenta.venta_id == Venta.id
+    ).outerjoin(
+        Producto, Producto.id == DetalleVenta.producto_id
+    ).where(
+        ventas_en_dias(fecha_inicio, fecha_fin)
+    ).order_by(Venta.fecha, Venta.id, DetalleVenta.id)
+    
+    estado = request.args.get('estado', '')
+    metodo_pago = request.args.get('metodo_pago', '')
+    if estado:
+        consulta = consulta.where(Venta.estado == estado)
+    if metodo_pago:
+        consulta = consulta.where(Venta.metodo_pago == metodo_pago)
+    
+    columnas = ['venta_id', 'fecha', 'estado', 'metodo_pago', 'total_venta',
+                'detalle_id', 'codigo_producto', 'producto', 'cantidad', 'subtotal']
+    nombre = f'ventas_{fecha_inicio:%Y%m%d}_{fecha_fin:%Y%m%d}'
+    return respuesta_exportacion(nombre, columnas, filas_en_streaming(consulta),
+                                 formato=formato, comprimir=comprimir)
+
 
 @ventas_bp.route('/anular/<int:id>', methods=['POST'])
 @login_required
 def anular(id):
     venta = Venta.query.get_or_404(id)
     try:
-        # Actualizar estado si existe el atributo
-        if hasattr(venta, 'estado'):
-            venta.estado = 'anulada'
+        # Cambio de estado condicional: un segundo envío (doble clic, reintento) espera
+        # al primero y no encuentra la venta sin anular, así que no repone el stock dos veces
+        anuladas = Venta.query.filter(
+            Venta.id == venta.id,
+            or_(Venta.estado.is_(None), Venta.estado != 'anulada')
+        ).update({Venta.estado: 'anulada'}, synchronize_session=False)
+        if not anuladas:
+            db.session.rollback()
+            flash('La venta ya estaba anulada.', 'info')
+            return redirect(url_for('ventas.detalle', id=id))
+        
+        # `venta` conserva el estado anterior, que es el que se resta de los resúmenes
+        resumen.cambiar_estado(venta, 'anulada')
+        Generacion.incrementar('ventas')
         # Guardar motivo si corresponde
         motivo = request.form.get('motivo', '').strip()
         if motivo and hasattr(venta, 'notas'):
             venta.notas = motivo
         
         # Revertir stock de productos vendidos
-        for detalle in venta.detalles:
-            if hasattr(detalle, 'producto') and detalle.producto:
-                detalle.producto.stock += int(detalle.cantidad or 0)
+        cantidades = inventario.agrupar_cantidades(
+            (d.producto_id, d.cantidad or 0) for d in venta.detalles)
+        inventario.reponer_stock(cantidades)
+        kardex.registrar('anulacion', cantidades, venta_id=venta.id,
+                         usuario_id=current_user.id, notas=motivo or None)
         
         db.session.commit()
         flash('La venta ha sido anulada y el stock ha sido revertido.', 'success')
@@ -226,80 +224,208 @@ def anular(id):
     
     return redirect(url_for('ventas.detalle', id=id))
 
+# ================================
+# API DE VENTAS (PUNTOS DE VENTA)
+# ================================
+
+MAX_VENTAS_POR_LOTE = 1000
+METODOS_PAGO = ('efectivo', 'tarjeta', 'transferencia')
+
+def _leer_venta_json(datos):
+    """
+    Valida una venta recibida en JSON y devuelve (detalles, campos de la venta).
+    Lanza ValueError con el motivo si no es válida.
+    """
+    if not isinstance(datos, dict):
+        raise ValueError('La venta debe ser un objeto JSON')
+    
+    detalles = datos.get('detalles')
+    if not isinstance(detalles, list) or not detalles:
+        raise ValueError('Debes enviar al menos un detalle')
+    for detalle in detalles:
+        try:
+            if int(detalle['cantidad']) <= 0 or Decimal(str(detalle['precio_unitario'])) < 0:
+                raise ValueError
+            int(detalle['producto_id'])
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            raise ValueError('Cada detalle necesita producto_id, cantidad > 0 y precio_unitario >= 0')
+    
+    campos = {}
+    clave = datos.get('clave_idempotencia')
+    if clave is not None:
+        clave = str(clave).strip()
+        if not clave or len(clave) > 64:
+            raise ValueError('La clave de idempotencia debe tener entre 1 y 64 caracteres')
+        campos['clave_idempotencia'] = clave
+    
+    metodo_pago = datos.get('metodo_pago')
+    if metodo_pago is not None:
+        if metodo_pago not in METODOS_PAGO:
+            raise ValueError(f'Método de pago no válido: {metodo_pago}')
+        campos['metodo_pago'] = metodo_pago
+    
+    notas = datos.get('notas')
+    if notas:
+        if len(str(notas)) > 500:
+            raise ValueError('Las notas no pueden tener más de 500 caracteres')
+        campos['notas'] = str(notas)
+    
+    # Hora real de la venta cuando el punto de venta la envía más tarde (sin conexión)
+    fecha = datos.get('fecha')
+    if fecha:
+        try:
+            campos['fecha'] = datetime.fromisoformat(str(fecha))
+        except ValueError:
+            raise ValueError('La fecha debe estar en formato ISO 8601')
+    
+    campos['usuario_id'] = current_user.id
+    return detalles, campos
+
+def _registrar_venta_json(datos):
+    """Registra una venta del API dentro de la transacción actual y devuelve su resultado"""
+    try:
+        detalles, campos = _leer_venta_json(datos)
+    except ValueError as e:
+        return {'estado': 'invalida', 'error': str(e)}
+    
+    try:
+        venta, creada = registro_ventas.registrar_venta_idempotente(detalles, **campos)
+    except inventario.StockInsuficiente as e:
+        return {'estado': 'rechazada', 'error': 'Stock insuficiente', 'faltantes': [
+            {k: v for k, v in f.items() if k != 'mensaje'} for f in e.faltantes
+        ]}
+    
+    return {
+        'estado': 'creada' if creada else 'duplicada',
+        'venta_id': venta.id,
+        'total': float(venta.total)
+    }
+
+@ventas_bp.route('/api/ventas', methods=['POST'])
+@login_required
+def api_crear_venta():
+    """
+    Registra una venta enviada por un punto de venta. Con `clave_idempotencia`
+    (o la cabecera Idempotency-Key) un reintento devuelve la venta original.
+    """
+    datos = request.get_json(silent=True)
+    if isinstance(datos, dict) and 'clave_idempotencia' not in datos and request.headers.get('Idempotency-Key'):
+        datos['clave_idempotencia'] = request.headers['Idempotency-Key']
+    
+    try:
+        resultado = _registrar_venta_json(datos)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'Error al registrar la venta por API: {str(e)}')
+        return jsonify({'success': False, 'message': 'Ocurrió un error al registrar la venta.'}), 500
+    
+    codigos = {'creada': 201, 'duplicada': 200, 'rechazada': 409, 'invalida': 400}
+    return jsonify(dict(resultado, success=resultado['estado'] in ('creada', 'duplicada'))), \
+        codigos[resultado['estado']]
+
+@ventas_bp.route('/api/ventas/lote', methods=['POST'])
+@login_required
+def api_crear_ventas_lote():
+    """
+    Registra muchas ventas en una sola transacción (sincronización tras una caída
+    de red). Cada venta va en su propio SAVEPOINT: una duplicada o sin stock no
+    afecta a las demás. Devuelve el resultado de cada venta en el mismo orden.
+    """
+    datos = request.get_json(silent=True) or {}
+    ventas = datos.get('ventas') if isinstance(datos, dict) else None
+    if not isinstance(ventas, list) or not ventas:
+        return jsonify({'success': False, 'message': 'Debes enviar una lista de ventas.'}), 400
+    if len(ventas) > MAX_VENTAS_POR_LOTE:
+        return jsonify({'success': False,
+                        'message': f'Máximo {MAX_VENTAS_POR_LOTE} ventas por lote.'}), 400
+    
+    try:
+        resultados = []
+        for indice, venta in enumerate(ventas):
+            resultado = _registrar_venta_json(venta)
+            resultado['indice'] = indice
+            if isinstance(venta, dict) and venta.get('clave_idempotencia') is not None:
+                resultado['clave_idempotencia'] = venta['clave_idempotencia']
+            resultados.append(resultado)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'Error al registrar el lote de ventas: {str(e)}')
+        return jsonify({'success': False, 'message': 'Ocurrió un error al registrar el lote.'}), 500
+    
+    resumen_lote = {estado: sum(1 for r in resultados if r['estado'] == estado)
+                    for estado in ('creada', 'duplicada', 'rechazada', 'invalida')}
+    return jsonify({'success': True, 'resumen': resumen_lote, 'resultados': resultados})
+
 @ventas_bp.route('/api/ventas/estadisticas')
 @login_required
+@en_replica
 def api_estadisticas():
-    """API para obtener estadísticas de ventas"""
+    """
+    API para obtener estadísticas de ventas. Responde 304 si el cliente ya tiene
+    la versión actual (ETag / Last-Modified según la última venta del rango).
+    """
     # Obtener parámetros de fecha (últimos 30 días por defecto)
     hoy = datetime.now().date()
-    fecha_inicio = request.args.get('fecha_inicio', (hoy - timedelta(days=30)).strftime('%Y-%m-%d'))
-    fecha_fin = request.args.get('fecha_fin', hoy.strftime('%Y-%m-%d'))
+    fecha_inicio = parsear_dia(request.args.get('fecha_inicio'), hoy - timedelta(days=30))
+    fecha_fin = parsear_dia(request.args.get('fecha_fin'), hoy)
     
-    try:
-        fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d')
-        fecha_fin_dt = datetime.strptime(fecha_fin, '%Y-%m-%d') + timedelta(days=1)  # Incluir todo el día
-    except (ValueError, TypeError):
-        fecha_inicio_dt = hoy - timedelta(days=30)
-        fecha_fin_dt = hoy + timedelta(days=1)
-    
-    # Ventas por día
-    ventas_por_dia = db.session.query(
-        func.date(Venta.fecha).label('fecha'),
-        func.count(Venta.id).label('cantidad'),
-        func.sum(Venta.total).label('total')
-    ).filter(
-        Venta.fecha.between(fecha_inicio_dt, fecha_fin_dt)
-    ).group_by(
-        func.date(Venta.fecha)
-    ).order_by(
-        'fecha'
-    ).all()
+    # Validador del rango: una consulta sobre el índice (fecha, id), compartida
+    # durante unos segundos por todos los dashboards abiertos
+    validador = cache_validadores.obtener(
+        (fecha_inicio, fecha_fin), lambda: validador_ventas(fecha_inicio, fecha_fin))
+    ultimo_id, ultima_fecha, cantidad = validador
+    etag = hashlib.sha1(
+        f'{fecha_inicio}|{fecha_fin}|{ultimo_id}|{ultima_fecha}|{cantidad}'.encode()
+    ).hexdigest()[:20]
+    ultima_modificacion = ultima_fecha.replace(tzinfo=timezone.utc) if ultima_fecha else None
+    
+    if not is_resource_modified(request.environ, etag=etag, last_modified=ultima_modificacion):
+        response = current_app.response_class(status=304)
+    else:
+        datos = cache_ventas.obtener(
+            ('estadisticas', fecha_inicio, fecha_fin, validador), 0,
+            lambda: _calcular_estadisticas_api(fecha_inicio, fecha_fin),
+            obsoleto_permitido=False)
+        response = jsonify(datos)
+    
+    response.set_etag(etag)
+    if ultima_modificacion:
+        response.last_modified = ultima_modificacion
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def _calcular_estadisticas_api(fecha_inicio, fecha_fin):
+    """Estadísticas del rango a partir de los resúmenes diarios (sin leer ventas ni detalles)"""
+    desde, hasta = fecha_inicio, fecha_fin + timedelta(days=1)
+    
+    # Ventas por día; el resumen del período se obtiene de las mismas filas
+    ventas_por_dia = resumen.ventas_por_dia(desde, hasta)
+    total = sum((v.total or 0 for v in ventas_por_dia), Decimal('0'))
+    num_ventas = sum(int(v.cantidad or 0) for v in ventas_por_dia)
     
     # Ventas por categoría
-    ventas_por_categoria = db.session.query(
-        Producto.categoria,
-        func.sum(DetalleVenta.cantidad).label('cantidad'),
-        func.sum(DetalleVenta.subtotal).label('total')
-    ).join(
-        DetalleVenta, DetalleVenta.producto_id == Producto.id
-    ).join(
-        Venta, Venta.id == DetalleVenta.venta_id
-    ).filter(
-        Venta.fecha.between(fecha_inicio_dt, fecha_fin_dt)
-    ).group_by(
-        Producto.categoria
-    ).all()
+    ventas_por_categoria = resumen.ventas_por_categoria(desde, hasta)
     
     # Preparar datos para la respuesta
-    datos = {
+    return {
         'ventas_por_dia': [{
             'fecha': v.fecha.strftime('%Y-%m-%d'),
-            'cantidad': v.cantidad or 0,
+            'cantidad': int(v.cantidad or 0),
             'total': float(v.total) if v.total else 0
         } for v in ventas_por_dia],
         
         'ventas_por_categoria': [{
             'categoria': v.categoria,
-            'cantidad': v.cantidad or 0,
+            'cantidad': int(v.cantidad or 0),
             'total': float(v.total) if v.total else 0
         } for v in ventas_por_categoria],
         
-        
         'resumen': {
-            'total_ventas': float(db.session.query(func.sum(Venta.total)).filter(
-                Venta.fecha.between(fecha_inicio_dt, fecha_fin_dt)
-            ).scalar() or 0),
-            
-            'total_ventas_count': db.session.query(func.count(Venta.id)).filter(
-                Venta.fecha.between(fecha_inicio_dt, fecha_fin_dt)
-            ).scalar() or 0,
-            
-            'ticket_promedio': float(db.session.query(
-                func.avg(Venta.total)
-            ).filter(
-                Venta.fecha.between(fecha_inicio_dt, fecha_fin_dt)
-            ).scalar() or 0)
+            'total_ventas': float(total),
+            'total_ventas_count': num_ventas,
+            'ticket_promedio': float(total / num_ventas) if num_ventas else 0
         }
     }
-    
-    return jsonify(datos)
@@ -1,4 +1,5 @@
 import os
+import click
 from app import create_app, db
 from app.models import Usuario, Producto, Venta, DetalleVenta, Configuracion
 
@@ -115,5 +116,604 @@ def create_sample_data():
     db.session.commit()
     print("Datos de ejemplo creados correctamente!")
 
+@app.cli.command()
+def reconstruir_resumen():
+    """Recalcula desde cero los resúmenes diarios de ventas"""
+    from app import resumen
+    print("Reconstruyendo resúmenes de ventas...")
+    resumen.reconstruir()
+    print("Resúmenes reconstruidos correctamente!")
+
+@app.cli.command()
+def verificar_indices():
+    """Comprueba con EXPLAIN (SQLite) que las consultas críticas usan sus índices"""
+    from sqlalchemy import create_engine
+    from app.consultas import verificar_planes
+    
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    
+    fallos = 0
+    for nombre, plan, usa_indice in verificar_planes(engine):
+        print(f"[{'OK' if usa_indice else 'FALLO'}] {nombre}")
+        for paso in plan:
+            print(f"    {paso}")
+        if not usa_indice:
+            fallos += 1
+    
+    if fallos:
+        print(f"{fallos} consulta(s) no usan el índice esperado.")
+        raise SystemExit(1)
+    print("Todas las consultas críticas usan sus índices.")
+
+@app.cli.command()
+def crear_indice_busqueda():
+    """Crea el índice de texto completo de productos en una base de datos existente"""
+    from app import busqueda
+    with db.engine.begin() as conexion:
+        if busqueda.crear_indice(conexion):
+            print("Índice de búsqueda disponible.")
+        else:
+            print("El motor de base de datos no soporta el índice; se usará LIKE.")
+
+@app.cli.command()
+def generar_miniaturas():
+    """Genera los derivados (miniaturas y WebP) de las imágenes ya subidas"""
+    from app import imagenes
+    if imagenes.Image is None:
+        print("Pillow no está instalado; no se pueden generar miniaturas.")
+        return
+    
+    carpeta = imagenes.carpeta_uploads()
+    nombres = [
+        nombre for nombre in sorted(os.listdir(carpeta))
+        if os.path.isfile(os.path.join(carpeta, nombre))
+        and nombre.rsplit('.', 1)[-1].lower() in app.config['ALLOWED_EXTENSIONS']
+    ]
+    print(f"Generando derivados de {len(nombres)} imágenes...")
+    total = imagenes.generar_en_lote(carpeta, nombres)
+    print(f"{total} archivos generados.")
+
+@app.cli.command()
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--lote', default=1000, help='Filas por cada INSERT de varias filas')
+def importar_productos(archivo, lote):
+    """Importa o actualiza productos desde un archivo CSV (por código)"""
+    from app.importacion import importar_csv
+    with open(archivo, encoding='utf-8-sig', newline='') as texto:
+        informe = importar_csv(texto, tamano_lote=lote)
+    
+    print(f"Filas leídas: {informe['filas']}, productos guardados: {informe['guardadas']}")
+    for error in informe['errores']:
+        print(f"  Fila {error['fila']}: {error['error']}")
+    if informe['errores_omitidos']:
+        print(f"  ... y {informe['errores_omitidos']} errores más")
+
+@app.cli.command()
+@click.option('--ventas', default=300, help='Número de ventas simultáneas a lanzar')
+@click.option('--hilos', default=16, help='Hilos (cajas) vendiendo a la vez')
+@click.option('--stock', default=200, help='Stock inicial del producto de prueba')
+@click.option('--url', default=None, help='Base de datos de pruebas (por defecto, un SQLite temporal)')
+def prueba_stock_concurrente(ventas, hilos, stock, url):
+    """
+    Lanza ventas concurrentes del mismo producto y comprueba que el stock cuadra;
+    después envía a la vez la misma venta del API (misma clave de idempotencia)
+    """
+    import json
+    import random
+    import tempfile
+    import threading
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import func
+    from config import TestingConfig
+    
+    carpeta = tempfile.mkdtemp(prefix='prueba_stock_')
+    
+    class ConfigPrueba(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = url or f"sqlite:///{os.path.join(carpeta, 'prueba.db')}"
+        SQLALCHEMY_ENGINE_OPTIONS = {} if url else {'connect_args': {'timeout': 30}}
+    
+    prueba = create_app(ConfigPrueba)
+    sufijo = uuid.uuid4().hex[:8]
+    email = f'prueba_{sufijo}@example.com'
+    with prueba.app_context():
+        usuario = Usuario(nombre_usuario=f'prueba_{sufijo}', email=email)
+        usuario.set_password(sufijo)
+        producto = Producto(codigo=f'PRUEBA-{sufijo}', nombre='Producto de prueba', precio_compra=1,
+                            precio_venta=10, stock=stock, categoria='Accesorios')
+        db.session.add_all([usuario, producto])
+        db.session.commit()
+        producto_id = producto.id
+    
+    cantidades = [random.randint(1, 3) for _ in range(ventas)]
+    resultados = {'vendidas': 0, 'ok': 0, 'sin_stock': 0, 'errores': 0}
+    candado = threading.Lock()
+    local = threading.local()
+    
+    def vender(cantidad):
+        # Un cliente (sesión) por hilo, como una caja distinta
+        if not hasattr(local, 'cliente'):
+            local.cliente = prueba.test_client()
+            r = local.cliente.post('/auth/login', data={'email': email, 'password': sufijo})
+            if r.headers.get('Location', '').endswith('/auth/login'):
+                raise RuntimeError('No se pudo iniciar sesión con el usuario de prueba')
+        detalles = json.dumps([{'producto_id': producto_id, 'cantidad': cantidad, 'precio_unitario': 10}])
+        r = local.cliente.post('/ventas/nueva', data={'metodo_pago': 'efectivo', 'detalles_venta': detalles})
+        with candado:
+            if r.status_code == 302 and '/ventas/' in r.headers.get('Location', ''):
+                resultados['ok'] += 1
+                resultados['vendidas'] += cantidad
+            elif b'Stock insuficiente' in r.data:
+                resultados['sin_stock'] += 1
+            else:
+                resultados['errores'] += 1
+    
+    print(f"Lanzando {ventas} ventas con {hilos} hilos sobre un stock de {stock}...")
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        list(pool.map(vender, cantidades))
+    
+    with prueba.app_context():
+        stock_final = db.session.get(Producto, producto_id).stock
+        registradas = db.session.query(func.coalesce(func.sum(DetalleVenta.cantidad), 0)).filter(
+            DetalleVenta.producto_id == producto_id).scalar()
+    
+    print(f"Ventas aceptadas: {resultados['ok']}, rechazadas por stock: {resultados['sin_stock']}, "
+          f"errores: {resultados['errores']}")
+    print(f"Unidades vendidas: {resultados['vendidas']}, registradas: {registradas}, stock final: {stock_final}")
+    
+    correcto = (stock_final >= 0
+                and stock_final == stock - registradas
+                and registradas == resultados['vendidas'])
+    if not correcto:
+        print("FALLO: el stock final no cuadra con las ventas registradas.")
+        raise SystemExit(1)
+    print("OK: el stock final cuadra exactamente con las ventas registradas.")
+    
+    # Doble envío: la misma venta del API (misma clave) desde todos los hilos a la vez
+    with prueba.app_context():
+        producto = db.session.get(Producto, producto_id)
+        producto.stock = hilos
+        db.session.commit()
+    clave = f'duplicada-{sufijo}'
+    venta_json = {'clave_idempotencia': clave, 'metodo_pago': 'efectivo',
+                  'detalles': [{'producto_id': producto_id, 'cantidad': 1, 'precio_unitario': 10}]}
+    barrera = threading.Barrier(hilos)
+    
+    def enviar_duplicada(_):
+        cliente = prueba.test_client()
+        cliente.post('/auth/login', data={'email': email, 'password': sufijo})
+        barrera.wait()
+        r = cliente.post('/ventas/api/ventas', json=venta_json)
+        return r.status_code, (r.get_json() or {}).get('venta_id')
+    
+    print(f"Enviando la misma venta (clave {clave}) desde {hilos} hilos a la vez...")
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        respuestas = list(pool.map(enviar_duplicada, range(hilos)))
+    
+    with prueba.app_context():
+        guardadas = Venta.query.filter_by(clave_idempotencia=clave).count()
+        stock_final = db.session.get(Producto, producto_id).stock
+    codigos = sorted(codigo for codigo, _ in respuestas)
+    print(f"Respuestas: {codigos}, ventas guardadas: {guardadas}, stock final: {stock_final}")
+    
+    correcto = (codigos.count(201) == 1 and codigos.count(200) == hilos - 1
+                and len({venta_id for _, venta_id in respuestas}) == 1
+                and guardadas == 1 and stock_final == hilos - 1)
+    if not correcto:
+        print("FALLO: los envíos simultáneos de la misma clave no devolvieron una única venta.")
+        raise SystemExit(1)
+    print("OK: los envíos simultáneos de la misma clave devolvieron la misma venta.")
+
+@app.cli.command()
+@click.option('--lineas', default='1,5,20,100', help='Tamaños de ticket a medir, separados por comas')
+def medir_venta(lineas):
+    """Cuenta las sentencias SQL que ejecuta el registro de una venta según su número de líneas"""
+    import time
+    from sqlalchemy import event
+    from config import TestingConfig
+    from app.registro_ventas import registrar_venta
+    
+    tamanos = [int(n) for n in lineas.split(',')]
+    prueba = create_app(TestingConfig)
+    with prueba.app_context():
+        db.session.add_all([
+            Producto(codigo=f'MED-{i}', nombre=f'Producto {i}', precio_compra=1, precio_venta=10,
+                     stock=1000000, categoria=('Tenis', 'Pádel', 'Accesorios')[i % 3])
+            for i in range(max(tamanos))
+        ])
+        db.session.commit()
+        ids = [p.id for p in Producto.query.order_by(Producto.id)]
+        
+        sentencias = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: sentencias.append(args[2]))
+        
+        def vender(n):
+            detalles = [{'producto_id': ids[i], 'cantidad': 2, 'precio_unitario': '10.50'} for i in range(n)]
+            sentencias.clear()
+            inicio = time.perf_counter()
+            registrar_venta(detalles)
+            db.session.commit()
+            return len(sentencias), (time.perf_counter() - inicio) * 1000
+        
+        # Primera venta del día: crea las filas de resumen y el contador de generación
+        vender(max(tamanos))
+        print(f"{'Líneas':>8} {'Sentencias':>11} {'Tiempo (ms)':>12}")
+        for n in tamanos:
+            cantidad, ms = vender(n)
+            print(f"{n:>8} {cantidad:>11} {ms:>12.2f}")
+
+@app.cli.command()
+@click.option('--lineas', default='1,10,50', help='Tamaños de ticket a comprobar, separados por comas')
+def verificar_detalle_venta(lineas):
+    """Comprueba que la página de detalle de una venta usa las mismas sentencias SQL sin importar sus líneas"""
+    from sqlalchemy import event
+    from config import TestingConfig
+    from app.registro_ventas import registrar_venta
+    
+    tamanos = [int(n) for n in lineas.split(',')]
+    prueba = create_app(TestingConfig)
+    with prueba.app_context():
+        usuario = Usuario(nombre_usuario='verificacion', email='verificacion@example.com')
+        usuario.set_password('verificacion')
+        db.session.add(usuario)
+        db.session.add_all([
+            Producto(codigo=f'VER-{i}', nombre=f'Producto {i}', precio_compra=1, precio_venta=10,
+                     stock=1000, categoria='Tenis')
+            for i in range(max(tamanos))
+        ])
+        db.session.commit()
+        ids = [p.id for p in Producto.query.order_by(Producto.id)]
+        ventas = {}
+        for n in tamanos:
+            venta = registrar_venta([{'producto_id': ids[i], 'cantidad': 1, 'precio_unitario': 10}
+                                     for i in range(n)])
+            db.session.commit()
+            ventas[n] = venta.id
+        
+        cliente = prueba.test_client()
+        cliente.post('/auth/login', data={'email': 'verificacion@example.com', 'password': 'verificacion'})
+        sentencias = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: sentencias.append(args[2]))
+    
+    # Primera petición: deja el usuario en la caché de sesiones para que no cuente en ninguna
+    cliente.get(f'/ventas/{ventas[tamanos[0]]}')
+    conteos = {}
+    for n in tamanos:
+        sentencias.clear()
+        respuesta = cliente.get(f'/ventas/{ventas[n]}')
+        if respuesta.status_code != 200:
+            print(f"FALLO: /ventas/{ventas[n]} respondió {respuesta.status_code}")
+            raise SystemExit(1)
+        conteos[n] = len(sentencias)
+        print(f"{n:>4} líneas: {conteos[n]} sentencias")
+    
+    if len(set(conteos.values())) != 1:
+        print("FALLO: el número de sentencias crece con las líneas de la venta (N+1).")
+        raise SystemExit(1)
+    print("OK: el detalle de la venta usa un número constante de sentencias.")
+
+@app.cli.command()
+def calcular_reposicion():
+    """Recalcula la reposición de todos los productos (pensado para ejecutarse con cron)"""
+    import time
+    from app import reposicion
+    if not reposicion.disponible():
+        print("NumPy no está instalado; bajo stock seguirá usando el umbral global.")
+        raise SystemExit(1)
+    
+    inicio = time.perf_counter()
+    resultado = reposicion.recalcular()
+    print(f"{len(resultado['producto_id'])} productos calculados en {time.perf_counter() - inicio:.2f} s; "
+          f"{int(resultado['necesita_reposicion'].sum())} necesitan reposición.")
+
+@app.cli.command()
+@click.argument('archivo', required=False)
+def guardar_analitica(archivo):
+    """Construye la instantánea columnar de ventas y la guarda (por defecto en ANALITICA_ARCHIVO)"""
+    import time
+    from app import analitica
+    if not analitica.disponible():
+        print("NumPy no está instalado; no se puede construir la instantánea.")
+        raise SystemExit(1)
+    archivo = archivo or app.config.get('ANALITICA_ARCHIVO')
+    if not archivo:
+        print("Indica el archivo o configura ANALITICA_ARCHIVO.")
+        raise SystemExit(1)
+    
+    inicio = time.perf_counter()
+    instantanea = analitica.construir()
+    instantanea.guardar(archivo)
+    print(f"{len(instantanea)} líneas guardadas en {archivo} en {time.perf_counter() - inicio:.2f} s")
+
+@app.cli.command()
+@click.option('--lineas', default=1000000, help='Líneas de venta de la base de datos de prueba')
+@click.option('--productos', default=500, help='Productos distintos')
+@click.option('--dias', default=730, help='Días de historial')
+@click.option('--repeticiones', default=3, help='Repeticiones de cada consulta (se toma la mejor)')
+def medir_analitica(lineas, productos, dias, repeticiones):
+    """Compara las agrupaciones por SQL con la instantánea NumPy y comprueba que coinciden"""
+    import tempfile
+    import time
+    from datetime import datetime, timedelta
+    from sqlalchemy import func, insert, select
+    from config import TestingConfig
+    from app import analitica
+    from app.consultas import ventas_en_dias
+    
+    if not analitica.disponible():
+        print("NumPy no está instalado; no se puede medir la instantánea.")
+        raise SystemExit(1)
+    np = analitica.np
+    
+    carpeta = tempfile.mkdtemp(prefix='medir_analitica_')
+    
+    class ConfigPrueba(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(carpeta, 'analitica.db')}"
+    
+    prueba = create_app(ConfigPrueba)
+    azar = np.random.default_rng(2024)
+    hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    with prueba.app_context():
+        print(f"Generando {lineas} líneas de venta en {carpeta}...")
+        inicio = time.perf_counter()
+        categorias = ('Tenis', 'Pádel', 'Accesorios')
+        db.session.execute(insert(Producto), [
+            {'codigo': f'AN-{i}', 'nombre': f'Producto {i}', 'precio_compra': 1, 'precio_venta': 10,
+             'stock': 0, 'categoria': categorias[i % 3], 'activo': True}
+            for i in range(productos)
+        ])
+        ids_producto = np.array(db.session.scalars(select(Producto.id).order_by(Producto.id)).all())
+        
+        # Entre 1 y 5 líneas por venta
+        por_venta = azar.integers(1, 6, size=lineas)
+        por_venta = por_venta[np.cumsum(por_venta) <= lineas]
+        if por_venta.sum() < lineas:
+            por_venta = np.append(por_venta, lineas - por_venta.sum())
+        num_ventas = len(por_venta)
+        venta_de_linea = np.repeat(np.arange(1, num_ventas + 1), por_venta)
+        cantidades = azar.integers(1, 4, size=lineas)
+        centimos = cantidades * azar.integers(500, 50000, size=lineas)
+        totales = np.bincount(venta_de_linea, weights=centimos, minlength=num_ventas + 1)[1:]
+        segundos = azar.integers(0, dias * 86400, size=num_ventas)
+        metodos = azar.integers(0, 3, size=num_ventas)
+        estados = np.where(azar.random(num_ventas) < 0.05, 3, 1)
+        
+        for desde in range(0, num_ventas, 50000):
+            db.session.execute(insert(Venta), [
+                {'id': i + 1, 'fecha': hoy - timedelta(seconds=int(segundos[i])),
+                 'total': int(totales[i]) / 100, 'metodo_pago': analitica.METODOS_PAGO[metodos[i]],
+                 'estado': analitica.ESTADOS[estados[i]]}
+                for i in range(desde, min(desde + 50000, num_ventas))
+            ])
+        producto_de_linea = ids_producto[azar.integers(0, productos, size=lineas)]
+        for desde in range(0, lineas, 50000):
+            db.session.execute(insert(DetalleVenta), [
+                {'venta_id': int(venta_de_linea[i]), 'producto_id': int(producto_de_linea[i]),
+                 'cantidad': int(cantidades[i]), 'subtotal': int(centimos[i]) / 100}
+                for i in range(desde, min(desde + 50000, lineas))
+            ])
+        db.session.commit()
+        print(f"  {num_ventas} ventas en {time.perf_counter() - inicio:.1f} s")
+        
+        def mejor(funcion):
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                resultado = funcion()
+                tiempos.append(time.perf_counter() - inicio)
+            return resultado, min(tiempos) * 1000
+        
+        instantanea, ms_construir = mejor(analitica.construir)
+        ruta = os.path.join(carpeta, 'analitica.npz')
+        _, ms_guardar = mejor(lambda: instantanea.guardar(ruta))
+        _, ms_cargar = mejor(lambda: analitica.Instantanea.cargar(ruta))
+        
+        desde_dia = (hoy - timedelta(days=365)).date()
+        hasta_dia = hoy.date()
+        filtro = ventas_en_dias(desde_dia, hasta_dia)
+        lineas_join = select().select_from(DetalleVenta).join(
+            Venta, Venta.id == DetalleVenta.venta_id).join(Producto, Producto.id == DetalleVenta.producto_id)
+        centimos_sql = lambda valor: int(round(float(valor or 0) * 100))
+        
+        def sql_categoria():
+            consulta = lineas_join.add_columns(
+                Producto.categoria, func.sum(DetalleVenta.cantidad), func.sum(DetalleVenta.subtotal)
+            ).where(filtro, Venta.estado == 'completada').group_by(Producto.categoria)
+            return sorted((c, int(u), centimos_sql(t)) for c, u, t in db.session.execute(consulta))
+        
+        def np_categoria():
+            return sorted((g.clave, g.unidades, int(g.total * 100)) for g in instantanea.agrupar(
+                'categoria', desde=desde_dia, hasta=hasta_dia, estado='completada'))
+        
+        def sql_top():
+            consulta = lineas_join.add_columns(
+                DetalleVenta.producto_id, func.sum(DetalleVenta.subtotal)
+            ).where(filtro).group_by(DetalleVenta.producto_id).order_by(
+                func.sum(DetalleVenta.subtotal).desc(), DetalleVenta.producto_id).limit(10)
+            return [(p, centimos_sql(t)) for p, t in db.session.execute(consulta)]
+        
+        def np_top():
+            return [(g.clave, int(g.total * 100)) for g in instantanea.top(
+                'producto', 10, desde=desde_dia, hasta=hasta_dia)]
+        
+        def sql_dia():
+            dia = func.date(Venta.fecha)
+            consulta = lineas_join.add_columns(
+                dia, func.count(func.distinct(Venta.id)), func.sum(DetalleVenta.subtotal)
+            ).where(filtro).group_by(dia).order_by(dia)
+            return [(str(d)[:10], int(v), centimos_sql(t)) for d, v, t in db.session.execute(consulta)]
+        
+        def np_dia():
+            return [(g.clave.isoformat(), g.ventas, int(g.total * 100)) for g in instantanea.por_periodo(
+                'dia', desde=desde_dia, hasta=hasta_dia)]
+        
+        def sql_metodo():
+            consulta = select(Venta.metodo_pago, func.count(Venta.id), func.sum(Venta.total)).where(
+                filtro).group_by(Venta.metodo_pago)
+            return sorted((m, int(v), centimos_sql(t)) for m, v, t in db.session.execute(consulta))
+        
+        def np_metodo():
+            return sorted((g.clave, g.ventas, int(g.total * 100)) for g in instantanea.agrupar(
+                'metodo_pago', desde=desde_dia, hasta=hasta_dia))
+        
+        print(f"Instantánea: {len(instantanea)} líneas, construir {ms_construir:.0f} ms, "
+              f"guardar {ms_guardar:.0f} ms, cargar {ms_cargar:.0f} ms")
+        print(f"{'Consulta (último año)':<32} {'SQL (ms)':>10} {'NumPy (ms)':>11} {'Veces':>7}")
+        fallos = 0
+        for nombre, con_sql, con_numpy in (
+            ('por categoría (completadas)', sql_categoria, np_categoria),
+            ('top 10 productos por ingresos', sql_top, np_top),
+            ('ventas e ingresos por día', sql_dia, np_dia),
+            ('por método de pago', sql_metodo, np_metodo),
+        ):
+            esperado, ms_sql = mejor(con_sql)
+            obtenido, ms_numpy = mejor(con_numpy)
+            coincide = esperado == obtenido
+            fallos += not coincide
+            print(f"{nombre:<32} {ms_sql:>10.1f} {ms_numpy:>11.1f} {ms_sql / max(ms_numpy, 0.001):>6.0f}x"
+                  f"{'' if coincide else '  FALLO: resultados distintos'}")
+        
+        # Añadir una venta nueva solo lee las líneas posteriores a la última cargada
+        siguiente = num_ventas + 1
+        db.session.execute(insert(Venta), [{'id': siguiente, 'fecha': hoy, 'total': 10,
+                                            'metodo_pago': 'efectivo', 'estado': 'completada'}])
+        db.session.execute(insert(DetalleVenta), [{'venta_id': siguiente, 'producto_id': int(ids_producto[0]),
+                                                   'cantidad': 1, 'subtotal': 10}])
+        db.session.commit()
+        inicio = time.perf_counter()
+        anadidas = instantanea.actualizar()
+        print(f"Actualización incremental: {anadidas} línea(s) en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+        if anadidas != 1:
+            fallos += 1
+            print("FALLO: la actualización incremental no añadió exactamente la línea nueva.")
+    
+    if fallos:
+        raise SystemExit(1)
+    print("OK: la instantánea coincide con SQL en todas las consultas.")
+
+@app.cli.command()
+def iniciar_kardex():
+    """Crea los movimientos de apertura para que el kardex cuadre con el stock actual"""
+    from app import kardex
+    ajustados = kardex.conciliar()
+    db.session.commit()
+    print(f"{ajustados} producto(s) con movimiento de apertura.")
+
+@app.cli.command()
+@click.option('--dia', default=None, help='Día a cerrar (YYYY-MM-DD); por defecto, el último que ya se puede cerrar')
+def cerrar_saldos(dia):
+    """Guarda el saldo de cada producto al cierre del día (pensado para ejecutarse con cron)"""
+    from datetime import datetime
+    from app import kardex
+    try:
+        dia = datetime.strptime(dia, '%Y-%m-%d').date() if dia else None
+    except ValueError:
+        print("El día debe tener el formato YYYY-MM-DD.")
+        raise SystemExit(1)
+    try:
+        guardados = kardex.cerrar_saldos(dia)
+    except ValueError as e:
+        print(str(e))
+        raise SystemExit(1)
+    print(f"{guardados} saldo(s) guardados.")
+
+@app.cli.command()
+def verificar_replica():
+    """Comprueba con dos SQLite (principal y réplica) que los reportes leen de la réplica y vuelven si se retrasa"""
+    import shutil
+    import tempfile
+    import time
+    from sqlalchemy import event
+    from config import TestingConfig
+    from app import replica
+    from app.escritura_diferida import ultimos_accesos
+    from app.models import Generacion
+    from app.registro_ventas import registrar_venta
+
+    carpeta = tempfile.mkdtemp(prefix='prueba_replica_')
+    principal = os.path.join(carpeta, 'principal.db')
+    copia = os.path.join(carpeta, 'replica.db')
+
+    class ConfigPrueba(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{principal}'
+        SQLALCHEMY_BINDS = {'replica': f'sqlite:///{copia}'}
+        # La prueba revisa la réplica a mano con replica.revisar()
+        REPLICA_REVISION_SEGUNDOS = 3600
+        REPLICA_RETRASO_MAXIMO = 30
+
+    fallos = []
+    def comprobar(condicion, mensaje):
+        print(f"{'OK   ' if condicion else 'FALLO'} {mensaje}")
+        if not condicion:
+            fallos.append(mensaje)
+
+    prueba = create_app(ConfigPrueba)
+    with prueba.app_context():
+        usuario = Usuario(nombre_usuario='replica', email='replica@example.com')
+        usuario.set_password('replica')
+        producto = Producto(codigo='REP-1', nombre='Producto', precio_compra=1, precio_venta=10,
+                            stock=100, categoria='Tenis')
+        db.session.add_all([usuario, producto])
+        db.session.commit()
+        detalles = [{'producto_id': producto.id, 'cantidad': 1, 'precio_unitario': 10}]
+        registrar_venta(detalles)
+        db.session.add(Generacion(clave=replica.LATIDO, valor=int(time.time())))
+        db.session.commit()
+
+        # "Replicar": copiar la principal; después la réplica no ve la segunda venta
+        db.session.remove()
+        db.engines[None].dispose()
+        shutil.copyfile(principal, copia)
+        registrar_venta(detalles)
+        db.session.commit()
+
+        sentencias = []
+        event.listen(db.engines['replica'], 'before_cursor_execute', lambda *args: sentencias.append(args[2]))
+        tabla = Generacion.__table__
+
+        replica.revisar()
+        with replica.lecturas_en_replica():
+            en_replica = Venta.query.count()
+            Generacion.incrementar('prueba_replica')
+            db.session.commit()
+        comprobar(en_replica == 1, f'las lecturas del bloque van a la réplica ({en_replica} venta(s))')
+        comprobar(Venta.query.count() == 2, 'fuera del bloque se lee la principal')
+        comprobar(Generacion.obtener('prueba_replica') == 1, 'las escrituras del bloque van a la principal')
+
+        # Réplica retrasada: su latido es de hace 100 s y no tiene el último de la principal
+        db.session.rollback()
+        with db.engines['replica'].begin() as conexion:
+            conexion.execute(tabla.update().where(tabla.c.clave == replica.LATIDO)
+                             .values(valor=int(time.time()) - 100))
+        replica.revisar()
+        with replica.lecturas_en_replica():
+            retrasada = Venta.query.count()
+        retraso = replica.estadisticas()['retraso']
+        comprobar(retrasada == 2 and retraso is not None and retraso >= 100,
+                  f'con la réplica retrasada se lee la principal (retraso {retraso} s)')
+
+    cliente = prueba.test_client()
+    cliente.post('/auth/login', data={'email': 'replica@example.com', 'password': 'replica'})
+    with prueba.app_context():
+        # La réplica se pone al día
+        with db.engines['replica'].begin() as conexion:
+            conexion.execute(tabla.update().where(tabla.c.clave == replica.LATIDO)
+                             .values(valor=int(time.time()) + 1))
+        replica.revisar()
+    for ruta in ('/dashboard', '/ventas/', '/ventas/api/ventas/estadisticas', '/reportes/reportes/ventas'):
+        sentencias.clear()
+        respuesta = cliente.get(ruta)
+        comprobar(respuesta.status_code == 200 and sentencias,
+                  f'{ruta}: {respuesta.status_code}, {len(sentencias)} consulta(s) en la réplica')
+    with prueba.app_context():
+        ultimos_accesos.volcar()
+
+    shutil.rmtree(carpeta, ignore_errors=True)
+    if fallos:
+        raise SystemExit(1)
+    print("OK: los reportes leen de la réplica y vuelven a la principal si se retrasa.")
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)